@@ -0,0 +1,433 @@
+#
+# Copyright 2016 iXsystems, Inc.
+# All rights reserved
+#
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted providing that the following conditions
+# are met:
+# 1. Redistributions of source code must retain the above copyright
+#    notice, this list of conditions and the following disclaimer.
+# 2. Redistributions in binary form must reproduce the above copyright
+#    notice, this list of conditions and the following disclaimer in the
+#    documentation and/or other materials provided with the distribution.
+#
+# THIS SOFTWARE IS PROVIDED BY THE AUTHOR ``AS IS'' AND ANY EXPRESS OR
+# IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE IMPLIED
+# WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE
+# ARE DISCLAIMED.  IN NO EVENT SHALL THE AUTHOR BE LIABLE FOR ANY
+# DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL
+# DAMAGES (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS
+# OR SERVICES; LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION)
+# HOWEVER CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT,
+# STRICT LIABILITY, OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING
+# IN ANY WAY OUT OF THE USE OF THIS SOFTWARE, EVEN IF ADVISED OF THE
+# POSSIBILITY OF SUCH DAMAGE.
+#
+
+"""
+Offline benchmarks of the CLI parser, interpreter, tab completion and
+output formatters, as well as of entity namespaces running against the
+in-process fake backend (see freenas/cli/fake.py). No FreeNAS server is
+needed, only the CLI's Python dependencies.
+
+Usage:
+    python3 benchmarks/run.py [--quick] [--filter <text>] [--repeat <n>]
+                              [--output <results.json>]
+                              [--compare <baseline.json>] [--threshold <percent>]
+
+Results are printed as a table and can be saved as JSON. A saved file
+can later be passed to --compare; the run then reports the change of
+median time per benchmark and exits with status 1 if any benchmark got
+slower by more than --threshold percent.
+"""
+
+import os
+import sys
+import glob
+import json
+import time
+import argparse
+import platform
+import statistics
+import contextlib
+from six.moves.urllib.parse import urlparse
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+from freenas.cli import repl  # noqa
+from freenas.cli.parser import parse  # noqa
+from freenas.cli.namespace import Namespace, Command  # noqa
+from freenas.cli.complete import EntitySubscriberComplete, EnumComplete  # noqa
+from freenas.cli.output import Table, Object, ValueType  # noqa
+from freenas.cli.output.ascii import AsciiOutputFormatter  # noqa
+from freenas.cli.output.json import JsonOutputFormatter  # noqa
+
+
+EXAMPLES_DIR = os.path.join(os.path.dirname(repl.__file__), 'examples')
+BENCHMARKS = []
+
+
+def benchmark(name):
+    """
+    Registers a benchmark. The decorated function does the setup for
+    given size scale and returns the callable to be timed.
+    """
+    def wrapper(fn):
+        BENCHMARKS.append((name, fn))
+        return fn
+
+    return wrapper
+
+
+class FakeReadline(object):
+    def __init__(self):
+        self.buffer = ''
+
+    def get_line_buffer(self):
+        return self.buffer
+
+    def get_begidx(self):
+        return max(self.buffer.rfind(i) for i in ' =') + 1
+
+
+class FakeSubscriber(object):
+    def __init__(self, items):
+        self.items = {i['id']: i for i in items}
+        self.on_add = set()
+        self.on_update = set()
+        self.on_delete = set()
+
+    def wait_ready(self):
+        pass
+
+    def query(self, *filter, **params):
+        callback = params.get('callback')
+        return [callback(i) if callback else i for i in self.items.values()]
+
+
+class SyntheticCommand(Command):
+    def run(self, context, args, kwargs, opargs):
+        pass
+
+    def complete(self, context, **kwargs):
+        return [
+            EntitySubscriberComplete('name=', 'bench.item', lambda o: o['name'], list=True),
+            EnumComplete('mode=', ['fast', 'slow', 'auto'])
+        ]
+
+
+class SyntheticNamespace(Namespace):
+    def __init__(self, name, children=0, commands=0):
+        super(SyntheticNamespace, self).__init__(name)
+        self.nslist = [SyntheticNamespace('{0}child{1}'.format(name, i)) for i in range(children)]
+        self.command_names = ['cmd{0}'.format(i) for i in range(commands)]
+
+    def commands(self):
+        return {i: SyntheticCommand() for i in self.command_names}
+
+
+def create_context():
+    context = repl.Context()
+    context.ml = repl.MainLoop(context)
+    return context
+
+
+CONTEXT = None
+
+
+def get_context():
+    global CONTEXT
+    if not CONTEXT:
+        CONTEXT = create_context()
+
+    return CONTEXT
+
+
+@benchmark('parser.examples')
+def bench_parse_examples(scale):
+    files = sorted(glob.glob(os.path.join(EXAMPLES_DIR, '**', '*.cli'), recursive=True))
+    sources = []
+    for i in files:
+        with open(i, 'rb') as f:
+            sources.append((f.read().decode('utf8'), i))
+
+    def run():
+        for text, filename in sources:
+            parse(text, filename)
+
+    return run
+
+
+@benchmark('parser.generated')
+def bench_parse_generated(scale):
+    lines = []
+    for i in range(scale):
+        lines.append('account user create name=user{0} uid={0} group=wheel'.format(i))
+        lines.append('x{0} = [1, 2, 3] + [{0}]'.format(i))
+
+    text = '\n'.join(lines)
+    return lambda: parse(text, '<bench>')
+
+
+def eval_benchmark(code):
+    def setup(scale):
+        context = get_context()
+        ast = parse(code.replace('$N', str(scale)), '<bench>')
+        return lambda: context.eval_block(ast)
+
+    return setup
+
+
+benchmark('eval.loop')(eval_benchmark(
+    'x = 0\nfor (i in range($N)) {\n    x = x + i * 2\n}\n'
+))
+
+benchmark('eval.function_calls')(eval_benchmark(
+    'function inc(a) {\n    return a + 1\n}\ny = 0\nfor (i in range($N)) {\n    y = inc(y)\n}\n'
+))
+
+benchmark('eval.conditionals')(eval_benchmark(
+    'z = 0\nfor (i in range($N)) {\n    if (i % 2 == 0) {\n        z = z + 1\n    } else {\n        z = z - 1\n    }\n}\n'
+))
+
+
+def complete_benchmark(buffer, text, cached):
+    def setup(scale):
+        context = get_context()
+        context.variables.set('complete_cache_ttl', 30 if cached else 0)
+        context.entity_subscribers['bench.item'] = FakeSubscriber(
+            {'id': i, 'name': 'item-{0:07d}'.format(i)} for i in range(scale * 10)
+        )
+        ns = SyntheticNamespace('bench', children=scale, commands=100)
+        context.ml.path = [context.root_ns, ns]
+
+        readline = FakeReadline()
+        readline.buffer = buffer
+        repl.readline = readline
+        context.completion_cache.invalidate()
+        context.completion_indexes.clear()
+        if context.ml.complete(text, 0) is None:
+            raise AssertionError('No completions for {0!r}'.format(buffer))
+
+        def run():
+            if not cached:
+                context.completion_indexes.clear()
+
+            context.ml.complete(text, 0)
+
+        return run
+
+    return setup
+
+
+benchmark('complete.namespace')(complete_benchmark('benchchild', 'benchchild', False))
+benchmark('complete.namespace.cached')(complete_benchmark('benchchild', 'benchchild', True))
+benchmark('complete.entity')(complete_benchmark('cmd1 name=item-00001', 'item-00001', False))
+benchmark('complete.entity.cached')(complete_benchmark('cmd1 name=item-00001', 'item-00001', True))
+
+
+def table(rows):
+    data = [
+        {'id': i, 'name': 'dataset/{0}'.format(i), 'size': i * 1024, 'enabled': bool(i % 2), 'tags': ['a', 'b']}
+        for i in range(rows)
+    ]
+
+    return Table(data, [
+        Table.Column('ID', 'id', ValueType.NUMBER),
+        Table.Column('Name', 'name'),
+        Table.Column('Size', 'size', ValueType.SIZE),
+        Table.Column('Enabled', 'enabled', ValueType.BOOLEAN),
+        Table.Column('Tags', 'tags', ValueType.SET)
+    ])
+
+
+def output_benchmark(formatter, rows):
+    def setup(scale):
+        get_context()
+        tab = table(rows * scale // 1000)
+
+        def run():
+            with open(os.devnull, 'w') as f:
+                if formatter == 'ascii':
+                    AsciiOutputFormatter.output_table(tab, file=f)
+                else:
+                    with contextlib.redirect_stdout(f):
+                        JsonOutputFormatter.output_table(tab)
+
+        return run
+
+    return setup
+
+
+benchmark('output.table.ascii.10k')(output_benchmark('ascii', 10000))
+benchmark('output.table.ascii.100k')(output_benchmark('ascii', 100000))
+benchmark('output.table.json.10k')(output_benchmark('json', 10000))
+benchmark('output.table.json.100k')(output_benchmark('json', 100000))
+
+
+@benchmark('output.object.ascii')
+def bench_output_object(scale):
+    get_context()
+    obj = Object(*[
+        Object.Item('Property {0}'.format(i), 'prop{0}'.format(i), 'value ' * (i % 20), editable=bool(i % 2))
+        for i in range(scale)
+    ])
+
+    return lambda: AsciiOutputFormatter.format_object(obj)
+
+
+FAKE_CONTEXT = None
+
+
+def get_fake_context(scale):
+    """
+    Returns a logged in context with plugins loaded, connected to the
+    in-process fake backend.
+    """
+    global FAKE_CONTEXT
+    if not FAKE_CONTEXT:
+        context = repl.Context()
+        context.uri = 'fake:?users={0}&datasets={1}&snapshots={2}&syslog={2}'.format(scale * 10, scale, scale * 100)
+        context.parsed_uri = urlparse(context.uri)
+        context.read_middleware_config_file(None)
+        context.start()
+        context.ml = repl.MainLoop(context)
+        context.login('root', '')
+        context.wait_entity_subscribers()
+        FAKE_CONTEXT = context
+
+    return FAKE_CONTEXT
+
+
+def get_namespace(context, path):
+    return context.ml.get_relative_object(context.root_ns, path.split())
+
+
+def namespace_show_benchmark(path):
+    def setup(scale):
+        context = get_fake_context(scale)
+        ns = get_namespace(context, path)
+
+        def run():
+            tab = ns.commands()['show'].run(context, [], {}, [])
+            with open(os.devnull, 'w') as f:
+                AsciiOutputFormatter.output_table(tab, file=f)
+
+        return run
+
+    return setup
+
+
+def namespace_get_one_benchmark(path, name_format):
+    def setup(scale):
+        context = get_fake_context(scale)
+        ns = get_namespace(context, path)
+        names = [name_format.format(i, i % scale) for i in range(0, scale * 10, scale // 10)]
+        if not ns.get_one(names[-1]):
+            raise AssertionError('{0} not found in {1}'.format(names[-1], path))
+
+        def run():
+            for i in names:
+                ns.get_one(i)
+
+        return run
+
+    return setup
+
+
+benchmark('namespace.user.show')(namespace_show_benchmark('account user'))
+benchmark('namespace.user.get_one')(namespace_get_one_benchmark('account user', 'user{0:06d}'))
+benchmark('namespace.snapshot.show')(namespace_show_benchmark('volume pool0 snapshot'))
+benchmark('namespace.snapshot.get_one')(namespace_get_one_benchmark(
+    'volume pool0 snapshot', 'pool0/dataset{1:05d}@auto-{0:08d}'
+))
+
+
+def measure(fn, repeat):
+    times = []
+    for i in range(repeat):
+        started_at = time.perf_counter()
+        fn()
+        times.append(time.perf_counter() - started_at)
+
+    return {
+        'runs': repeat,
+        'min': min(times),
+        'median': statistics.median(times),
+        'mean': statistics.mean(times),
+        'stdev': statistics.stdev(times) if repeat > 1 else 0.0
+    }
+
+
+def compare(results, baseline, threshold):
+    regressions = []
+    print('\n{0:<32} {1:>12} {2:>12} {3:>9}'.format('Benchmark', 'Baseline', 'Current', 'Change'))
+    for name, current in sorted(results.items()):
+        base = baseline.get(name)
+        if not base:
+            print('{0:<32} {1:>12} {2:>12.4f} {3:>9}'.format(name, '-', current['median'], 'new'))
+            continue
+
+        change = (current['median'] / base['median'] - 1) * 100 if base['median'] else 0
+        print('{0:<32} {1:>12.4f} {2:>12.4f} {3:>+8.1f}%'.format(name, base['median'], current['median'], change))
+        if change > threshold:
+            regressions.append(name)
+
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Run offline CLI benchmarks')
+    parser.add_argument('--quick', action='store_true', help='Run with 10 times smaller data sets')
+    parser.add_argument('--filter', metavar='TEXT', help='Run only benchmarks with TEXT in their name')
+    parser.add_argument('--repeat', type=int, default=5, help='Number of timed runs per benchmark')
+    parser.add_argument('--output', metavar='FILE', help='Save results as JSON')
+    parser.add_argument('--compare', metavar='FILE', help='Compare with results saved by --output')
+    parser.add_argument('--threshold', type=float, default=10.0, help='Regression threshold in percent')
+    args = parser.parse_args()
+
+    scale = 100 if args.quick else 1000
+    results = {}
+
+    print('{0:<32} {1:>10} {2:>10} {3:>10}'.format('Benchmark', 'Min', 'Median', 'Stdev'))
+    for name, setup in BENCHMARKS:
+        if args.filter and args.filter not in name:
+            continue
+
+        fn = setup(scale)
+        fn()
+        results[name] = measure(fn, args.repeat)
+        print('{0:<32} {min:>10.4f} {median:>10.4f} {stdev:>10.4f}'.format(name, **results[name]))
+
+    report = {
+        'meta': {
+            'timestamp': time.time(),
+            'python': platform.python_version(),
+            'platform': platform.platform(),
+            'scale': scale,
+            'repeat': args.repeat
+        },
+        'results': results
+    }
+
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(report, f, indent=4, sort_keys=True)
+
+    if args.compare:
+        with open(args.compare, 'r') as f:
+            baseline = json.load(f)
+
+        if baseline['meta'].get('scale') != scale:
+            print('Warning: baseline was recorded with scale {0}, current scale is {1}'.format(
+                baseline['meta'].get('scale'), scale
+            ))
+
+        regressions = compare(results, baseline['results'], args.threshold)
+        if regressions:
+            print('\nRegressions over {0}%: {1}'.format(args.threshold, ', '.join(regressions)))
+            sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
@@ -29,13 +29,14 @@ import os
 import inspect
 import sys
 import signal
+import time
 import select
-import readline
 import gettext
 import platform
 import textwrap
 import re
 import logging
+import json
 import copy
 import getpass
 from datetime import datetime
@@ -43,15 +44,15 @@ from freenas.cli.parser import Quote, parse, unparse, dump_ast
 from freenas.cli.complete import NullComplete, EnumComplete
 from freenas.cli.namespace import (
     Command, PipeCommand, CommandException, description,
-    SingleItemNamespace, Namespace, FilteringCommand
+    SingleItemNamespace, Namespace, FilteringCommand, TaskBasedSaveMixin
 )
 from freenas.cli.output import (
     Table, ValueType, output_less, format_value,
-    Sequence, read_value, format_output
+    Sequence, read_value, format_output, output_msg, ProgressBar
 )
 from freenas.cli.output import Object as output_obj, get_terminal_size
-from freenas.cli.descriptions.tasks import translate as translate_task
-from freenas.cli.utils import TaskPromise, describe_task_state, parse_timedelta, add_tty_formatting, quote, to_ascii
+from freenas.cli.descriptions.tasks import translate_many as translate_tasks
+from freenas.cli.utils import TaskPromise, TaskBatch, describe_task_state, parse_timedelta, add_tty_formatting, quote, to_ascii
 from freenas.dispatcher.shell import ShellClient
 from freenas.utils.url import wrap_address
 from urllib.parse import urlparse
@@ -124,6 +125,9 @@ class ChangeNamespaceCommand(Command):
     This is basically a navigation command to facilitate unix-like navigation
     """
 
+    # Completions depend on the partially typed path
+    complete_uses_text = True
+
     def mod_namespaces(self, nslist, prepend=''):
         """Small utility function to append `/` at the end of the namespace name"""
         modded_ns = []
@@ -901,16 +905,28 @@ class ClearCommand(Command):
 class HistoryCommand(Command):
     """
     Usage: history <number>
+           history [<number>] [path=<namespace>] [prefix=<command>] [search=<text>]
 
     Example: history
              history 10
+             history path="volume snapshot"
+             history prefix="account user" 20
+             history search=create
 
-    List the commands previously executed in this CLI instance.
+    List the commands previously executed in this and earlier CLI sessions.
     Optionally, provide a number to specify the number of lines,
     from the last line of history, to display.
+
+    History can be narrowed down to commands executed within a given
+    namespace ("path", use "" for the root namespace), commands starting
+    with a given prefix, or commands containing a given text. Matches are
+    searched starting from the most recent command.
     """
 
     def run(self, context, args, kwargs, opargs):
+        if context.history is None:
+            raise CommandException(_("Command history is only available in interactive mode"))
+
         desired_range = None
         if args:
             if len(args) != 1:
@@ -921,22 +937,47 @@ class HistoryCommand(Command):
                 desired_range = int(args[0])
             except ValueError:
                 raise CommandException(_("Please specify an integer for the history range"))
-        histroy_range = readline.get_current_history_length()
-        if desired_range is not None and desired_range < histroy_range:
-            histroy_range = desired_range + 1
+
+        for k in kwargs:
+            if k not in ('path', 'prefix', 'search'):
+                raise CommandException(_("Invalid argument for history command: {0}".format(k)))
+
+        path = kwargs.get('path')
+        if path is not None:
+            path = ' '.join(str(path).split())
+
+        entries = context.history.search(
+            text=kwargs.get('search'),
+            path=path,
+            prefix=kwargs.get('prefix'),
+            limit=desired_range or 1000
+        )
+
         return Table(
-            [{'cmd': readline.get_history_item(i)} for i in range(1, histroy_range)],
-            [Table.Column('Command History', 'cmd', ValueType.STRING)]
+            [{'path': e.path or '/', 'cmd': e.command} for e in entries],
+            [
+                Table.Column('Namespace', 'path', ValueType.STRING),
+                Table.Column('Command History', 'cmd', ValueType.STRING)
+            ]
         )
 
+    def complete(self, context, **kwargs):
+        return [
+            NullComplete('path='),
+            NullComplete('prefix='),
+            NullComplete('search=')
+        ]
+
 
 @description("Run specified script")
 class SourceCommand(Command):
     """
     Usage: source </path/filename>
            source </path/filename1> </path/filename2> </path/filename3>
+           source --profile </path/filename>
 
     Example: source /mnt/mypool/myscript
+             source --profile /mnt/mypool/myscript
 
     Run specified file or files, where each file contains a list
     of CLI commands. When creating the source file, separate
@@ -944,25 +985,105 @@ class SourceCommand(Command):
     CLI command on its own line. If multiple files are
     specified, they are run in the order given. If a CLI
     command fails, the source operation aborts.
+
+    With --profile, execution time of every statement and function
+    is measured and a report of the slowest ones is displayed
+    afterwards. See 'help profile' for more reports.
     """
 
     def run(self, context, args, kwargs, opargs):
+        profile = '--profile' in args
+        args = [a for a in args if a != '--profile']
         if len(args) == 0:
             raise CommandException(_("Please provide a filename. For help see 'help <command>'"))
-        else:
-            for arg in args:
-                arg = os.path.expanduser(arg)
-                if os.path.isfile(arg):
-                    try:
-                        with open(arg, 'rb') as f:
-                            ast = parse(f.read().decode('utf8'), arg)
-                            context.eval_block(ast)
-                    except UnicodeDecodeError as e:
-                        raise CommandException(_(
-                            "Incorrect filetype, cannot parse file: {0}".format(str(e))
-                        ))
+
+        if profile:
+            context.profiler.reset()
+            with context.profiler.session():
+                self.source(context, args)
+
+            return ProfileCommand().run(context, [], {}, [])
+
+        self.source(context, args)
+
+    def source(self, context, args):
+        for arg in args:
+            arg = os.path.expanduser(arg)
+            if os.path.isfile(arg):
+                try:
+                    with open(arg, 'rb') as f:
+                        ast = parse(f.read().decode('utf8'), arg)
+                        context.eval_block(ast)
+                except UnicodeDecodeError as e:
+                    raise CommandException(_(
+                        "Incorrect filetype, cannot parse file: {0}".format(str(e))
+                    ))
+            else:
+                raise CommandException(_("File {0} does not exist.".format(arg)))
+
+
+@description("Show script execution profile")
+class ProfileCommand(Command):
+    """
+    Usage: profile [<number>]
+           profile functions [<number>]
+           profile pstats <filename>
+           profile callgrind <filename>
+           profile reset
+
+    Example: setopt profile=yes
+             source /mnt/mypool/myscript
+             profile 10
+             profile functions
+             profile callgrind /tmp/callgrind.out.myscript
+             profile reset
+
+    Shows statements (or user-defined functions) which took the most
+    time to execute, excluding time spent in nested statements, along
+    with their locations, execution counts, total time and number of
+    middleware calls. Profile can also be saved in a format readable
+    by Python's pstats module or by callgrind tools like kcachegrind.
+    Data is collected while the profile option is enabled or while
+    running 'source --profile'.
+    """
+
+    def run(self, context, args, kwargs, opargs):
+        profiler = context.profiler
+        action = args[0] if args and not isinstance(args[0], int) else 'statements'
+        if action in ('statements', 'functions'):
+            limit = args[-1] if args and isinstance(args[-1], int) else 20
+            records = profiler.hot_spots(limit, action == 'functions')
+            return Table(records, [
+                Table.Column('Location', lambda r: r.location),
+                Table.Column('Function' if action == 'functions' else 'Statement', lambda r: r.name),
+                Table.Column('Count', lambda r: r.count, ValueType.NUMBER),
+                Table.Column('Self s', lambda r: round(r.exclusive, 3)),
+                Table.Column('Total s', lambda r: round(r.inclusive, 3)),
+                Table.Column('RPCs', lambda r: r.rpc, ValueType.NUMBER)
+            ])
+
+        if action == 'reset':
+            profiler.reset()
+            return
+
+        if action in ('pstats', 'callgrind'):
+            if len(args) != 2:
+                raise CommandException(_("Please provide a filename. For help see 'help <command>'"))
+
+            try:
+                if action == 'pstats':
+                    profiler.dump_pstats(args[1])
                 else:
-                    raise CommandException(_("File {0} does not exist.".format(arg)))
+                    profiler.dump_callgrind(args[1])
+            except IOError as err:
+                raise CommandException(_("Cannot write {0}: {1}".format(args[1], str(err))))
+
+            return
+
+        raise CommandException(_("Invalid action: {0}. For help see 'help <command>'".format(action)))
+
+    def complete(self, context, **kwargs):
+        return [EnumComplete(0, ['functions', 'pstats', 'callgrind', 'reset'])]
 
 
 @description("Dump namespace configuration to a series of CLI commands")
@@ -1059,37 +1180,271 @@ class PendingCommand(Command):
     """
 
     def run(self, context, args, kwargs, opargs):
-        pending = list(filter(
-            lambda t: t['session'] == context.session_id,
-            context.pending_tasks.values()
-        ))
+        pending = sorted(context.session_tasks.values(), key=lambda t: t['id'])
+        descriptions = translate_tasks(context, pending)
 
         return Table(pending, [
             Table.Column('Task ID', 'id'),
-            Table.Column('Task description', lambda t: translate_task(context, t['name'], t['args'])),
+            Table.Column('Task description', lambda t: descriptions[t['id']]),
             Table.Column('Task status', describe_task_state)
         ])
 
 
-@description("Wait for a task to complete and show its progress")
+@description("Display list of background jobs")
+class JobsCommand(Command):
+    """
+    Usage: jobs
+
+    Example: jobs
+
+    Display the list of background jobs of this session. A statement is
+    run as a background job when it ends with '&', eg.:
+
+        dump >> config.txt &
+    """
+
+    def run(self, context, args, kwargs, opargs):
+        jobs = [{
+            'id': '%{0}'.format(job.id),
+            'state': job.state,
+            'runtime': round(job.runtime, 3),
+            'description': job.description
+        } for job in context.background_jobs.values()]
+
+        return Table(jobs, [
+            Table.Column('Job', 'id'),
+            Table.Column('State', 'state'),
+            Table.Column('Runtime', 'runtime', ValueType.NUMBER),
+            Table.Column('Statement', 'description')
+        ])
+
+
+@description("Display list of interval jobs")
+class IntervalsCommand(Command):
+    """
+    Usage: intervals
+
+    Example: intervals
+
+    Display the functions scheduled with setinterval() and settimeout(),
+    how many times they ran, how many runs were skipped because the
+    previous run was still in progress, and their last error.
+    Use clearinterval(<id>) to stop one.
+
+    Note that setinterval() repeats until the job is cleared; scripts
+    which called it again from the scheduled function to run it
+    periodically should use settimeout() instead.
+    """
+
+    def run(self, context, args, kwargs, opargs):
+        now = time.monotonic()
+        jobs = [{
+            'id': job.id,
+            'name': job.name,
+            'interval': int(job.interval * 1000),
+            'mode': job.mode if job.repeat else 'once',
+            'overlap': job.overlap,
+            'runs': job.runs,
+            'skipped': job.skipped,
+            'next': round(max(job.next_run - now, 0), 3) if job.next_run else None,
+            'error': job.last_error
+        } for job in context.scheduler.list()]
+
+        return Table(jobs, [
+            Table.Column('ID', 'id', ValueType.NUMBER),
+            Table.Column('Function', 'name'),
+            Table.Column('Interval (ms)', 'interval', ValueType.NUMBER),
+            Table.Column('Mode', 'mode'),
+            Table.Column('Overlap', 'overlap'),
+            Table.Column('Runs', 'runs', ValueType.NUMBER),
+            Table.Column('Skipped', 'skipped', ValueType.NUMBER),
+            Table.Column('Next run (s)', 'next', ValueType.NUMBER),
+            Table.Column('Last error', 'error')
+        ])
+
+
+@description("Wait for a background job and show its result")
+class FgCommand(Command):
+    """
+    Usage: fg
+           fg <job>
+
+    Example: fg
+             fg %2
+
+    Wait for the most recently started background job, or the specified
+    one, and display its result. Ctrl+C stops waiting, the job itself
+    continues in the background. Use 'jobs' to determine the job number.
+    """
+
+    def run(self, context, args, kwargs, opargs):
+        if len(args) > 1:
+            raise CommandException(_('Invalid usage.\n{0}'.format(inspect.getdoc(self))))
+
+        if args:
+            job = context.find_job(args[0])
+        elif context.background_jobs:
+            job = context.find_job(next(reversed(context.background_jobs)))
+        else:
+            return _('No background jobs found')
+
+        try:
+            result = job.wait()
+        except KeyboardInterrupt:
+            return _('Job %{0} will continue to run in the background'.format(job.id))
+        except RuntimeError as err:
+            context.background_jobs.pop(job.id, None)
+            raise CommandException(str(err))
+
+        context.background_jobs.pop(job.id, None)
+        return result
+
+    def complete(self, context, **kwargs):
+        return [EnumComplete(0, ['%{0}'.format(i) for i in context.background_jobs])]
+
+
+@description("Wait until pipelined task submissions got their task IDs")
+class FlushCommand(Command):
+    """
+    Usage: flush
+
+    Example: setopt submit_window=64
+             for (s in snapshots) { volume pool0 snapshot ${s} delete }
+             flush
+
+    Wait until every task submitted without waiting for its task ID (see
+    the submit_window option) has been accepted by the server. Use it
+    before statements that depend on those tasks having been submitted.
+    """
+
+    def run(self, context, args, kwargs, opargs):
+        if args or kwargs:
+            raise CommandException(_('Invalid usage.\n{0}'.format(inspect.getdoc(self))))
+
+        context.flush_tasks()
+
+
+@description("Start deferring changes of entities until commit")
+class BeginCommand(Command):
+    """
+    Usage: begin
+
+    Example: begin
+             account user myuser set shell=/bin/csh
+             account user myuser set email=myuser@example.com
+             account user other set locked=yes
+             commit
+
+    Start a transaction. Changes made with 'set' and 'edit' after 'begin' are
+    not saved right away, they are saved by 'commit' using a single update
+    task per entity instead. 'rollback' discards them. Setting the autocommit
+    option to no has the same effect without the need for 'begin'.
+    """
+
+    def run(self, context, args, kwargs, opargs):
+        context.begin_transaction()
+
+
+@description("Save changes deferred since begin")
+class CommitCommand(Command):
+    """
+    Usage: commit
+
+    Example: commit
+
+    Submit one update task for every entity changed since 'begin' (or since
+    the last commit when autocommit is set to no), then wait for all of
+    them and show the outcome of each task.
+    """
+
+    def run(self, context, args, kwargs, opargs):
+        return context.commit_transaction()
+
+
+@description("Discard changes deferred since begin")
+class RollbackCommand(Command):
+    """
+    Usage: rollback
+
+    Example: rollback
+
+    Discard changes made since 'begin' (or since the last commit when
+    autocommit is set to no) without saving them.
+    """
+
+    def run(self, context, args, kwargs, opargs):
+        count = context.rollback_transaction()
+        return _("Discarded changes of {0} entities".format(count))
+
+
+@description("Wait for tasks to complete and show their progress")
 class WaitCommand(Command):
     """
     Usage: wait
            wait <task ID>
+           wait <task ID> <task ID> ...
+           wait <job>
+           wait all
 
     Example: wait
              wait 100
+             wait 100 101 102
+             wait %1
+             wait all
 
-    Show task progress of either all waiting tasks or the
-    specified task. Use 'task show' to determine the task ID.
+    Show task progress of the most recently submitted task, the specified
+    task or tasks, or all pending tasks of this session. Progress of
+    multiple tasks is shown in a single combined view. Use 'task show'
+    to determine the task ID. A background job, started with '&', is
+    given as '%' followed by the number shown by 'jobs'. 'wait all' also
+    waits for all background jobs before waiting for tasks.
     """
 
     def run(self, context, args, kwargs, opargs):
+        context.flush_tasks()
+        jobs = [context.find_job(i) for i in args if str(i).startswith('%')]
+        if jobs:
+            if len(jobs) != len(args):
+                raise CommandException(_('Jobs and task ids cannot be waited for at once'))
+
+            for job in jobs:
+                try:
+                    job.wait()
+                except RuntimeError as err:
+                    output_msg(str(err))
+
+                context.background_jobs.pop(job.id, None)
+
+            return
+
+        if args == ['all']:
+            for job in list(context.background_jobs.values()):
+                try:
+                    job.wait()
+                except RuntimeError as err:
+                    output_msg(str(err))
+
+                context.background_jobs.pop(job.id, None)
+
+            tids = sorted(context.session_jobs)
+
+            if not tids:
+                return 'No pending tasks found'
+
+            with context.tracer.span('wait', tasks=tids):
+                return context.wait_for_tasks_with_progress(tids)
+
         if args:
             try:
-                tid = int(args[0])
+                tids = [int(i) for i in args]
             except ValueError:
                 raise CommandException('Task id argument must be an integer')
+
+            if len(tids) > 1:
+                with context.tracer.span('wait', tasks=tids):
+                    return context.wait_for_tasks_with_progress(tids)
+
+            tid = tids[0]
         else:
             tid = None
             try:
@@ -1099,7 +1454,11 @@ class WaitCommand(Command):
         if tid is None:
             return 'No recently submitted tasks (which are still active) found'
 
-        return context.wait_for_task_with_progress(tid)
+        with context.tracer.span('wait', tasks=[tid]):
+            return context.wait_for_task_with_progress(tid)
+
+    def complete(self, context, **kwargs):
+        return [EnumComplete(0, ['all'])]
 
 
 class AttachDebuggerCommand(Command):
@@ -1134,6 +1493,74 @@ class WCommand(Command):
         ])
 
 
+@description("Show statistics of middleware calls")
+class RpcStatsCommand(Command):
+    """
+    Usage: rpcstats
+           rpcstats commands
+           rpcstats json [<filename>]
+           rpcstats reset
+
+    Example: setopt rpc_stats=yes
+             rpcstats
+             rpcstats commands
+             rpcstats json /tmp/rpcstats.json
+             rpcstats reset
+
+    Shows the number of calls, errors, latencies and transferred bytes
+    of middleware calls made by this CLI session, either per method
+    (tasks are listed as task.submit:<name>) or per CLI command which
+    made them. "json" dumps all statistics including latency histograms,
+    optionally to a file. Statistics are only collected while the
+    rpc_stats option is enabled.
+    """
+
+    def run(self, context, args, kwargs, opargs):
+        if len(args) > 2 or kwargs:
+            raise CommandException(_("Invalid syntax: {0}. For help see 'help <command>'".format(args)))
+
+        action = args[0] if args else 'methods'
+        if action == 'reset':
+            context.rpc_stats.reset()
+            return
+
+        if action == 'json':
+            data = json.dumps(context.rpc_stats.__getstate__(), indent=4, sort_keys=True)
+            if len(args) < 2:
+                return data
+
+            try:
+                with open(args[1], 'w') as f:
+                    f.write(data)
+            except IOError as err:
+                raise CommandException(_("Cannot write {0}: {1}".format(args[1], str(err))))
+
+            return
+
+        if action not in ('methods', 'commands'):
+            raise CommandException(_("Invalid action: {0}. For help see 'help <command>'".format(action)))
+
+        if not context.variables.get('rpc_stats'):
+            output_msg(_("Statistics collection is disabled. Enable it with 'setopt rpc_stats=yes'"))
+
+        stats = context.rpc_stats.by_method if action == 'methods' else context.rpc_stats.by_command
+        rows = sorted(stats.items(), key=lambda i: i[1].total, reverse=True)
+        return Table(rows, [
+            Table.Column('Method' if action == 'methods' else 'Command', lambda r: r[0]),
+            Table.Column('Calls', lambda r: r[1].count, ValueType.NUMBER),
+            Table.Column('Errors', lambda r: r[1].errors, ValueType.NUMBER),
+            Table.Column('Total ms', lambda r: round(r[1].total, 1)),
+            Table.Column('Avg ms', lambda r: round(r[1].average, 1)),
+            Table.Column('p95 ms', lambda r: r[1].percentile(95)),
+            Table.Column('Max ms', lambda r: round(r[1].max or 0, 1)),
+            Table.Column('Bytes in', lambda r: r[1].bytes_in, ValueType.SIZE),
+            Table.Column('Bytes out', lambda r: r[1].bytes_out, ValueType.SIZE)
+        ])
+
+    def complete(self, context, **kwargs):
+        return [EnumComplete(0, ['methods', 'commands', 'json', 'reset'])]
+
+
 class TimeCommand(Command):
     """
     Usage: time `<code>`
@@ -1425,3 +1852,148 @@ class SelectPipeCommand(PipeCommand):
             result = Table(None, [Table.Column('Result', 'result')])
             result.data = ({'result': x.get(args[0])} for x in input)
             return result
+
+
+@description("Delete or change every listed entity")
+class ApplyPipeCommand(PipeCommand):
+    """
+    Usage: <command> | apply delete [<property>=<value> ...]
+           <command> | apply set <property>=<value> ...
+
+    Examples: volume pool0 snapshot show | search name~="auto-2016" | apply delete
+              share show | search type==nfs | apply set enabled=no
+
+    Delete or change every entity listed by the command. Tasks are
+    submitted straight from the listed entities, with at most apply_max of
+    them running at the same time, and the entities whose tasks failed are
+    listed at the end.
+    """
+
+    def __init__(self):
+        self.must_be_last = True
+
+    def run(self, context, args, kwargs, opargs, input=None):
+        ns = context.pipe_cwd
+        if len(args) != 1 or args[0] not in ('delete', 'set') or opargs:
+            raise CommandException(_(
+                "Invalid syntax {0}. For help see 'help <command>'".format(args)
+            ))
+
+        if not isinstance(input, Table) or not isinstance(ns, TaskBasedSaveMixin):
+            raise CommandException(_("apply can only be used with lists of entities"))
+
+        op = args[0]
+        if op == 'set' and not kwargs:
+            raise CommandException(_("You have provided no properties to set."))
+
+        if op == 'set' and not ns.allow_edit or op == 'delete' and not ns.allow_create:
+            raise CommandException(_("Entities of {0} cannot be {1}".format(
+                ns.get_name(),
+                'changed' if op == 'set' else 'deleted'
+            )))
+
+        for k in kwargs:
+            if not ns.has_property(k):
+                raise CommandException(_('Property {0} not found'.format(k)))
+
+        rows = list(input.data)
+        if not rows:
+            return _("No entities to {0}".format(op))
+
+        progress = None if context.in_worker else ProgressBar()
+
+        def on_change(batch):
+            if progress:
+                progress.update(
+                    percentage=batch.finished * 100.0 / len(rows),
+                    message=_("{0} of {1} done, {2} failed".format(batch.finished, len(rows), len(batch.failures)))
+                )
+
+        batch = TaskBatch(context, context.variables.get('apply_max'), on_change)
+        unchanged = 0
+        on_change(batch)
+
+        try:
+            for row in rows:
+                label = ns.primary_key.do_get(row) if ns.primary_key else row.get(ns.save_key_name)
+                try:
+                    if op == 'delete':
+                        self.delete(context, ns, row, label, kwargs, batch)
+                    elif not self.update(context, ns, row, label, kwargs, batch):
+                        unchanged += 1
+                except (CommandException, ValueError) as err:
+                    batch.fail(label, str(err))
+
+            batch.wait()
+        except KeyboardInterrupt:
+            output_msg(_("Stopped submitting, {0} submitted tasks will continue to run".format(batch.unfinished)))
+        finally:
+            batch.close()
+            if progress:
+                progress.end()
+
+        output_msg(_("{0} of {1} entities done, {2} failed, {3} unchanged".format(
+            batch.finished - len(batch.failures),
+            len(rows),
+            len(batch.failures),
+            unchanged
+        )))
+
+        if batch.failures:
+            return Table(batch.failures, [
+                Table.Column('Name', 'name'),
+                Table.Column('Task ID', 'id', ValueType.NUMBER),
+                Table.Column('Error', 'error')
+            ])
+
+    def delete(self, context, ns, row, label, kwargs, batch):
+        delete_args = []
+        for k, v in kwargs.items():
+            prop = ns.get_mapping(k)
+            if prop.delete_arg:
+                prop.do_set(delete_args, v, row)
+
+        if type(ns).delete is not TaskBasedSaveMixin.delete:
+            this = self.item(context, ns, row, label)
+            this.delete_args = delete_args
+            batch.submit_call(label, lambda: ns.delete(this, kwargs))
+            return
+
+        batch.submit(label, ns.delete_task, row[ns.save_key_name], *delete_args)
+
+    def update(self, context, ns, row, label, kwargs, batch):
+        entity = copy.deepcopy(row)
+        update_args = []
+        for k, v in kwargs.items():
+            prop = ns.get_mapping(k)
+            if prop.set is None or not prop.is_usersetable(entity):
+                raise CommandException(_('Property {0} is not writable'.format(k)))
+            if prop.regex is not None and not re.match(prop.regex, str(v)):
+                raise CommandException(_('Invalid input {0} for property {1}.'.format(v, k)))
+            if prop.update_arg:
+                prop.do_set(update_args, v, entity)
+            elif not prop.create_arg:
+                prop.do_set(entity, v)
+            else:
+                raise CommandException(_('Property {0} is a create time argument only. It cannot be set'.format(k)))
+
+        diff = {k: v for k, v in entity.items() if k not in row or row[k] != v}
+        if not diff and not update_args:
+            return False
+
+        if type(ns).save is not TaskBasedSaveMixin.save:
+            this = self.item(context, ns, row, label)
+            this.entity = entity
+            this.update_args = update_args
+            batch.submit_call(label, lambda: ns.save(this))
+            return True
+
+        batch.submit(label, ns.update_task, row[ns.save_key_name], diff, *update_args)
+        return True
+
+    def item(self, context, ns, row, label):
+        # Namespaces with their own save or delete get a bare item, without get_one() or load()
+        this = SingleItemNamespace(label, ns, context)
+        this.orig_entity = row
+        this.entity = copy.deepcopy(row)
+        return this
@@ -25,12 +25,120 @@
 #
 #####################################################################
 
+import time
+import bisect
+import collections
+import threading
 from freenas.cli.output import format_value
+from freenas.utils import query as q
 from freenas.cli.utils import quote
 from copy import deepcopy
 
 
+class PrefixIndex(object):
+    """
+    Sorted set of completion strings supporting prefix lookups with bisect.
+    Keys are reference counted, so several entities mapping to the same
+    name are kept until the last of them goes away.
+    """
+
+    def __init__(self, items=None):
+        self.lock = threading.RLock()
+        self.keys = []
+        self.counts = {}
+        self.reset(items or [])
+
+    def __len__(self):
+        return len(self.keys)
+
+    def reset(self, items):
+        with self.lock:
+            self.counts = {}
+            for i in items:
+                self.counts[i] = self.counts.get(i, 0) + 1
+
+            self.keys = sorted(self.counts)
+
+    def add(self, key):
+        with self.lock:
+            count = self.counts.get(key, 0)
+            self.counts[key] = count + 1
+            if not count:
+                bisect.insort(self.keys, key)
+
+    def remove(self, key):
+        with self.lock:
+            count = self.counts.get(key, 0)
+            if count > 1:
+                self.counts[key] = count - 1
+                return
+
+            self.counts.pop(key, None)
+            idx = bisect.bisect_left(self.keys, key)
+            if idx < len(self.keys) and self.keys[idx] == key:
+                del self.keys[idx]
+
+    def match(self, prefix, limit=None):
+        """
+        Returns up to ``limit`` keys starting with ``prefix`` and the total
+        number of such keys.
+        """
+        with self.lock:
+            lo = bisect.bisect_left(self.keys, prefix)
+            hi = bisect.bisect_right(self.keys, prefix + '\U0010ffff', lo) if prefix else len(self.keys)
+            end = min(hi, lo + limit) if limit else hi
+            return self.keys[lo:end], hi - lo
+
+
+class EntitySubscriberIndex(PrefixIndex):
+    """
+    Prefix index over the mapped entities of an entity subscriber, kept up
+    to date from subscriber events instead of re-querying it on every TAB.
+    """
+
+    def __init__(self, subscriber, mapper, filter=None):
+        super(EntitySubscriberIndex, self).__init__()
+        self.subscriber = subscriber
+        self.mapper = mapper
+        self.filter = filter or []
+        keys = (self.map(e) for e in subscriber.query(*self.filter))
+        self.reset(k for k in keys if k is not None)
+        subscriber.on_add.add(self.on_add)
+        subscriber.on_update.add(self.on_update)
+        subscriber.on_delete.add(self.on_delete)
+
+    def close(self):
+        self.subscriber.on_add.discard(self.on_add)
+        self.subscriber.on_update.discard(self.on_update)
+        self.subscriber.on_delete.discard(self.on_delete)
+
+    def map(self, entity):
+        if self.filter and not q.query([entity], *self.filter):
+            return None
+
+        value = self.mapper(entity)
+        return None if value is None else str(value)
+
+    def on_add(self, entity):
+        key = self.map(entity)
+        if key is not None:
+            self.add(key)
+
+    def on_update(self, old_entity, new_entity):
+        with self.lock:
+            self.on_delete(old_entity)
+            self.on_add(new_entity)
+
+    def on_delete(self, entity):
+        key = self.map(entity)
+        if key is not None:
+            self.remove(key)
+
+
 class NullComplete(object):
+    # Whether choices are served from a prefix index rather than a list
+    indexed = False
+
     def __init__(self, name, **kwargs):
         self.name = name
         self.list = kwargs.pop('list', False)
@@ -38,6 +146,13 @@ class NullComplete(object):
     def choices(self, context, token):
         return []
 
+    def matches(self, context, token, prefix, limit=None):
+        result = [i for i in self.choices(context, token) if i.startswith(prefix)]
+        return (result[:limit] if limit else result), len(result)
+
+    def sources(self):
+        return []
+
 
 class EnumComplete(NullComplete):
     def __init__(self, name, choices, **kwargs):
@@ -49,6 +164,8 @@ class EnumComplete(NullComplete):
 
 
 class EntitySubscriberComplete(NullComplete):
+    indexed = True
+
     def __init__(self, name, datasource, mapper=None, extra=None, filter=None, **kwargs):
         super(EntitySubscriberComplete, self).__init__(name, **kwargs)
         self.datasource = datasource
@@ -59,12 +176,38 @@ class EntitySubscriberComplete(NullComplete):
     def choices(self, context, token):
         return context.entity_subscribers[self.datasource].query(*self.filter, callback=self.mapper) + self.extra
 
+    def matches(self, context, token, prefix, limit=None):
+        extra = [i for i in self.extra if i.startswith(prefix)]
+        result, count = self.get_index(context).match(prefix, limit)
+        result = extra + result
+        return (result[:limit] if limit else result), count + len(extra)
+
+    def get_index(self, context):
+        # Completers are recreated on every TAB, so indexes are shared
+        # through the context. Mappers are usually lambdas, hence the
+        # code object identifies the mapping.
+        subscriber = context.entity_subscribers[self.datasource]
+        key = (self.datasource, getattr(self.mapper, '__code__', self.mapper), repr(self.filter))
+        return context.completion_indexes.get(key, subscriber, self.mapper, self.filter)
+
+    def sources(self):
+        return [self.datasource]
+
 
 class RpcComplete(EntitySubscriberComplete):
+    indexed = False
+
     def __init__(self, name, datasource, mapper=None, extra=None, call_args=None, **kwargs):
         self.call_args = call_args
         super(RpcComplete, self).__init__(name, datasource, mapper, extra, **kwargs)
 
+    def matches(self, context, token, prefix, limit=None):
+        return NullComplete.matches(self, context, token, prefix, limit)
+
+    def sources(self):
+        # RPC results are not tracked by any entity subscriber
+        return []
+
     def choices(self, context, token):
         result = deepcopy(self.extra)
         datasource = context.call_sync(self.datasource, *(self.call_args or ()))
@@ -108,3 +251,102 @@ class MultipleSourceComplete(NullComplete):
             result.extend(c.choices(context, token))
 
         return result
+
+    def sources(self):
+        return [s for c in self.components for s in c.sources()]
+
+
+class CompletionIndexCache(object):
+    """
+    Entity subscriber indexes shared between completers. Only the most
+    recently used ones are kept; evicted indexes stop listening to their
+    subscriber.
+    """
+
+    MAX_ENTRIES = 32
+
+    def __init__(self):
+        self.indexes = collections.OrderedDict()
+        self.lock = threading.Lock()
+
+    def __len__(self):
+        return len(self.indexes)
+
+    def get(self, key, subscriber, mapper, filter=None):
+        with self.lock:
+            index = self.indexes.pop(key, None)
+            if index is not None and index.subscriber is not subscriber:
+                index.close()
+                index = None
+
+            if index is None:
+                subscriber.wait_ready()
+                index = EntitySubscriberIndex(subscriber, mapper, filter)
+
+            self.indexes[key] = index
+            while len(self.indexes) > self.MAX_ENTRIES:
+                self.indexes.popitem(last=False)[1].close()
+
+            return index
+
+    def clear(self):
+        with self.lock:
+            for index in self.indexes.values():
+                index.close()
+
+            self.indexes.clear()
+
+
+class CompletionCache(object):
+    """
+    Completion choices keyed by (namespace path, command, argument slot).
+
+    Entries expire after their TTL and are dropped as soon as any entity
+    subscriber they were computed from reports a change.
+    """
+
+    MAX_ENTRIES = 1000
+
+    def __init__(self):
+        self.entries = {}
+        self.by_source = {}
+        self.lock = threading.Lock()
+
+    def get(self, key):
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is None:
+                return None
+
+            expires, choices = entry
+            if time.time() >= expires:
+                del self.entries[key]
+                return None
+
+            return choices
+
+    def put(self, key, choices, sources=None, ttl=30):
+        if not ttl or ttl <= 0:
+            return
+
+        with self.lock:
+            now = time.time()
+            if len(self.entries) >= self.MAX_ENTRIES:
+                for k, (expires, v) in list(self.entries.items()):
+                    if expires <= now:
+                        del self.entries[k]
+
+            self.entries[key] = (now + ttl, choices)
+            for s in sources or []:
+                if s:
+                    self.by_source.setdefault(s, set()).add(key)
+
+    def invalidate(self, source=None):
+        with self.lock:
+            if source is None:
+                self.entries.clear()
+                self.by_source.clear()
+                return
+
+            for key in self.by_source.pop(source, []):
+                self.entries.pop(key, None)
@@ -25,4 +25,30 @@
 #
 #####################################################################
 
-instance = None
+import sys
+import types
+import threading
+
+
+class Config(types.ModuleType):
+    """
+    config.instance is the Context of the current thread. Threads working
+    for one of several contexts, like the hosts of fleet mode, bind theirs
+    with bind(); all other threads get the Context created last.
+    """
+    local = threading.local()
+    default = None
+
+    @property
+    def instance(self):
+        return getattr(self.local, 'instance', None) or self.default
+
+    @instance.setter
+    def instance(self, value):
+        self.default = value
+
+    def bind(self, context):
+        self.local.instance = context
+
+
+sys.modules[__name__].__class__ = Config
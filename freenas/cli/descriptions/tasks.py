@@ -34,7 +34,11 @@ _ = t.gettext
 
 
 def get_username(context, uid):
-    u = context.call_sync('user.query', [('id', '=', uid)], {'single': True})
+    if 'user' in context.entity_subscribers:
+        u = context.entity_subscribers['user'].items.get(uid)
+    else:
+        u = context.call_sync('user.query', [('id', '=', uid)], {'single': True})
+
     return u['username'] if u else '<unknown>'
 
 tasks = {
@@ -71,3 +75,10 @@ def translate(context, name, args=None):
         return second(context, args)
     except:
         return first
+
+
+def translate_many(context, task_list):
+    """
+    Translates a list of tasks at once. Returns a dict of task id -> description.
+    """
+    return {task['id']: translate(context, task['name'], task['args']) for task in task_list}
@@ -0,0 +1,122 @@
+#
+# Copyright 2016 iXsystems, Inc.
+# All rights reserved
+#
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted providing that the following conditions
+# are met:
+# 1. Redistributions of source code must retain the above copyright
+#    notice, this list of conditions and the following disclaimer.
+# 2. Redistributions in binary form must reproduce the above copyright
+#    notice, this list of conditions and the following disclaimer in the
+#    documentation and/or other materials provided with the distribution.
+#
+# THIS SOFTWARE IS PROVIDED BY THE AUTHOR ``AS IS'' AND ANY EXPRESS OR
+# IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE IMPLIED
+# WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE
+# ARE DISCLAIMED.  IN NO EVENT SHALL THE AUTHOR BE LIABLE FOR ANY
+# DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL
+# DAMAGES (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS
+# OR SERVICES; LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION)
+# HOWEVER CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT,
+# STRICT LIABILITY, OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING
+# IN ANY WAY OUT OF THE USE OF THIS SOFTWARE, EVEN IF ADVISED OF THE
+# POSSIBILITY OF SUCH DAMAGE.
+#
+#####################################################################
+
+import asyncio
+import threading
+
+
+class EventLoop(object):
+    """
+    An asyncio event loop running on a thread of its own. Event messages,
+    progress bars and scheduler timers are all served by it, so they need
+    no threads of their own. Commands keep running synchronously on the
+    main thread and on worker threads.
+    """
+    def __init__(self):
+        self.loop = asyncio.new_event_loop()
+        self.thread = threading.Thread(target=self.run, name='event loop')
+        self.thread.daemon = True
+        self.thread.start()
+
+    def run(self):
+        asyncio.set_event_loop(self.loop)
+        self.loop.run_forever()
+
+    def stop(self, timeout=1):
+        """
+        Cancels all tasks and stops the loop. Unless called on the loop
+        thread, waits up to timeout seconds for it to finish.
+        """
+        def stop():
+            for task in asyncio.all_tasks(self.loop):
+                task.cancel()
+
+            # Lets the cancelled tasks run once more to finish
+            self.loop.call_soon(self.loop.stop)
+
+        self.loop.call_soon_threadsafe(stop)
+        if not self.in_loop:
+            self.thread.join(timeout)
+
+    @property
+    def in_loop(self):
+        return threading.current_thread() is self.thread
+
+    def time(self):
+        return self.loop.time()
+
+    def call_soon(self, fn, *args):
+        """
+        Runs fn on the loop thread. Can be called from any thread.
+        """
+        return self.loop.call_soon_threadsafe(fn, *args)
+
+    def call_later(self, delay, fn, *args):
+        """
+        Runs fn on the loop thread after delay seconds. Must be called
+        on the loop thread.
+        """
+        return self.loop.call_later(delay, fn, *args)
+
+    def call_at(self, when, fn, *args):
+        """
+        Runs fn on the loop thread at when, in time.monotonic() terms.
+        Must be called on the loop thread.
+        """
+        return self.loop.call_at(when, fn, *args)
+
+    def submit(self, coro):
+        """
+        Starts a coroutine on the loop and returns its concurrent.futures.Future.
+        """
+        return asyncio.run_coroutine_threadsafe(coro, self.loop)
+
+
+class LoopQueue(object):
+    """
+    A queue fed from any thread and consumed by coroutines on the loop.
+    """
+    def __init__(self, loop):
+        self.loop = loop
+        self.queue = None
+
+    @property
+    def items(self):
+        # Created on the loop thread, older asyncio binds queues to the current thread's loop
+        if self.queue is None:
+            self.queue = asyncio.Queue()
+
+        return self.queue
+
+    def put(self, item):
+        self.loop.call_soon(lambda: self.items.put_nowait(item))
+
+    def get(self):
+        return self.items.get()
+
+    def get_nowait(self):
+        return self.items.get_nowait()
@@ -0,0 +1,610 @@
+#
+# Copyright 2016 iXsystems, Inc.
+# All rights reserved
+#
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted providing that the following conditions
+# are met:
+# 1. Redistributions of source code must retain the above copyright
+#    notice, this list of conditions and the following disclaimer.
+# 2. Redistributions in binary form must reproduce the above copyright
+#    notice, this list of conditions and the following disclaimer in the
+#    documentation and/or other materials provided with the distribution.
+#
+# THIS SOFTWARE IS PROVIDED BY THE AUTHOR ``AS IS'' AND ANY EXPRESS OR
+# IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE IMPLIED
+# WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE
+# ARE DISCLAIMED.  IN NO EVENT SHALL THE AUTHOR BE LIABLE FOR ANY
+# DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL
+# DAMAGES (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS
+# OR SERVICES; LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION)
+# HOWEVER CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT,
+# STRICT LIABILITY, OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING
+# IN ANY WAY OUT OF THE USE OF THIS SOFTWARE, EVEN IF ADVISED OF THE
+# POSSIBILITY OF SUCH DAMAGE.
+#
+#####################################################################
+
+
+"""
+In-process stand-in for the dispatcher, selected with a 'fake:' URI.
+
+The dataset is generated on connect and sizes of the collections are
+set in the URI query string, eg.:
+
+    cli 'fake:?users=1000&snapshots=100000&seed=42'
+
+Supported parameters are the keys of DEFAULT_SIZES, 'seed', 'task_delay'
+(seconds a submitted task spends in EXECUTING state) and 'latency' (seconds
+each call takes, to mimic a network round trip).
+"""
+
+import copy
+import errno
+import random
+import gettext
+import datetime
+import threading
+import collections
+import six
+from six.moves.urllib.parse import urlparse, parse_qs
+from freenas.dispatcher.rpc import RpcException
+from freenas.utils import query as q
+
+t = gettext.translation('freenas-cli', fallback=True)
+_ = t.gettext
+
+
+DEFAULT_SIZES = collections.OrderedDict([
+    ('users', 100),
+    ('groups', 10),
+    ('volumes', 1),
+    ('datasets', 100),
+    ('snapshots', 1000),
+    ('tasks', 100),
+    ('syslog', 1000)
+])
+
+SHELLS = ['/bin/sh', '/bin/csh', '/bin/tcsh', '/usr/local/bin/bash', '/usr/local/bin/zsh', '/usr/sbin/nologin']
+TASK_NAMES = ['volume.snapshot.create', 'volume.snapshot.delete', 'user.update', 'service.manage', 'update.check']
+SYSLOG_IDENTIFIERS = ['dispatcher', 'kernel', 'sshd', 'smbd', 'zfsd', 'crond']
+FINAL_STATES = ('FINISHED', 'FAILED', 'ABORTED')
+
+
+def zfs_property(value):
+    return {'value': str(value), 'rawvalue': str(value), 'parsed': value, 'source': 'DEFAULT'}
+
+
+class FakeDataset(object):
+    """
+    Generated in-memory contents of entity collections. Stored entities
+    are never modified in place, changes replace them with updated copies.
+    """
+
+    def __init__(self, sizes=None, seed=0, generate=True):
+        self.sizes = DEFAULT_SIZES.copy()
+        self.sizes.update(sizes or {})
+        self.random = random.Random(seed)
+        self.now = datetime.datetime(2016, 6, 1)
+        self.collections = collections.defaultdict(collections.OrderedDict)
+        self.last_id = {}
+        if generate:
+            self.generate()
+
+    def generate(self):
+        self.generate_groups()
+        self.generate_users()
+        self.generate_volumes()
+        self.generate_tasks()
+        self.generate_syslog()
+        self.add('session', {'id': 1, 'username': 'root', 'active': True, 'started_at': self.now})
+
+    def timestamp(self, max_age=86400 * 30):
+        return self.now - datetime.timedelta(seconds=self.random.randint(0, max_age))
+
+    def generate_groups(self):
+        self.add('group', {'id': 0, 'gid': 0, 'name': 'wheel', 'builtin': True, 'sudo': False, 'members': []})
+        for i in range(self.sizes['groups']):
+            gid = 1000 + i
+            self.add('group', {'id': gid, 'gid': gid, 'name': 'group{0:05d}'.format(i), 'builtin': False, 'sudo': False})
+
+    def generate_users(self):
+        self.add('user', self.user(0, 'root', 0, builtin=True))
+        groups = [0] + [1000 + i for i in range(self.sizes['groups'])]
+        for i in range(self.sizes['users']):
+            self.add('user', self.user(1000 + i, 'user{0:06d}'.format(i), self.random.choice(groups)))
+
+    def user(self, uid, name, group, builtin=False):
+        return {
+            'id': uid,
+            'uid': uid,
+            'username': name,
+            'full_name': name.capitalize(),
+            'group': group,
+            'groups': [],
+            'shell': self.random.choice(SHELLS),
+            'home': '/root' if builtin else '/nonexistent',
+            'email': None,
+            'sudo': False,
+            'locked': False,
+            'builtin': builtin,
+            'password_disabled': False,
+            'sshpubkey': None,
+            'attributes': {}
+        }
+
+    def generate_volumes(self):
+        volumes = ['pool{0}'.format(i) for i in range(self.sizes['volumes'])] or ['pool0']
+        for i in volumes:
+            self.add('volume', {
+                'id': i,
+                'guid': str(self.random.getrandbits(63)),
+                'type': 'zfs',
+                'status': 'ONLINE',
+                'mountpoint': '/mnt/{0}'.format(i),
+                'encrypted': False,
+                'providers_presence': 'ALL',
+                'topology': {'data': [], 'log': [], 'cache': [], 'spare': []},
+                'properties': {'size': zfs_property(2 ** 40), 'free': zfs_property(2 ** 39)}
+            })
+
+        datasets = []
+        for i in range(self.sizes['datasets']):
+            volume = volumes[i % len(volumes)]
+            name = '{0}/dataset{1:05d}'.format(volume, i)
+            datasets.append((volume, name))
+            self.add('volume.dataset', self.dataset(volume, name))
+
+        for i in range(self.sizes['snapshots']):
+            volume, dataset = datasets[i % len(datasets)] if datasets else (volumes[0], volumes[0])
+            self.add('volume.snapshot', self.snapshot(volume, dataset, 'auto-{0:08d}'.format(i)))
+
+    def dataset(self, volume, name):
+        used = self.random.randint(0, 2 ** 34)
+        return {
+            'id': name,
+            'name': name,
+            'volume': volume,
+            'type': 'FILESYSTEM',
+            'mountpoint': '/mnt/{0}'.format(name),
+            'mounted': True,
+            'volsize': None,
+            'permissions_type': 'PERM',
+            'permissions': {'user': 'root', 'group': 'wheel'},
+            'properties': {
+                'compression': zfs_property('lz4'),
+                'used': zfs_property(used),
+                'available': zfs_property(2 ** 39 - used),
+                'readonly': zfs_property(False),
+                'atime': zfs_property(True),
+                'dedup': zfs_property('off'),
+                'refquota': zfs_property(None),
+                'quota': zfs_property(None),
+                'refreservation': zfs_property(None),
+                'reservation': zfs_property(None),
+                'recordsize': zfs_property(131072),
+                'volblocksize': zfs_property(None)
+            }
+        }
+
+    def snapshot(self, volume, dataset, name):
+        return {
+            'id': '{0}@{1}'.format(dataset, name),
+            'name': name,
+            'volume': volume,
+            'dataset': dataset,
+            'replicable': True,
+            'lifetime': None,
+            'holds': {},
+            'properties': {
+                'compression': zfs_property('lz4'),
+                'used': zfs_property(self.random.randint(0, 2 ** 24)),
+                'available': zfs_property(0),
+                'creation': zfs_property(self.timestamp())
+            }
+        }
+
+    def generate_tasks(self):
+        for i in range(self.sizes['tasks']):
+            created_at = self.timestamp()
+            name = self.random.choice(TASK_NAMES)
+            self.add('task', self.task(name, [], created_at, state='FINISHED', session=None))
+
+    def task(self, name, args, created_at, state='CREATED', session=None):
+        finished = state in FINAL_STATES
+        return {
+            'name': name,
+            'args': args,
+            'state': state,
+            'description': {'name': name, 'message': name},
+            'created_at': created_at,
+            'started_at': created_at if finished else None,
+            'updated_at': created_at,
+            'finished_at': created_at if finished else None,
+            'session': session,
+            'user': 'root',
+            'parent': None,
+            'result': None,
+            'error': None,
+            'warnings': [],
+            'progress': {'percentage': 100 if finished else 0, 'message': '', 'extra': None}
+        }
+
+    def generate_syslog(self):
+        timestamps = sorted(self.timestamp() for i in range(self.sizes['syslog']))
+        for seqnum, ts in enumerate(timestamps):
+            identifier = self.random.choice(SYSLOG_IDENTIFIERS)
+            self.add('syslog', {
+                'id': seqnum,
+                'seqnum': seqnum,
+                'timestamp': ts,
+                'identifier': identifier,
+                'priority': 'INFO',
+                'facility': 'DAEMON',
+                'message': '{0}: message {1}'.format(identifier, seqnum)
+            })
+
+    def query(self, name, *filter, **params):
+        return q.query(list(self.collections[name].values()), *filter, **params)
+
+    def get(self, name, id):
+        entity = self.collections[name].get(id)
+        if entity is None:
+            raise RpcException(errno.ENOENT, 'Entity {0} not found in {1}'.format(id, name))
+
+        return entity
+
+    def template(self, name, entity):
+        """
+        Returns a complete new entity of given collection, with all the
+        properties server would fill in.
+        """
+        if name in ('user', 'group'):
+            id = max(999, self.last_id.get(name, 0)) + 1
+            if name == 'user':
+                return self.user(entity.get('uid') or id, entity.get('username'), entity.get('group'))
+
+            gid = entity.get('gid') or id
+            return {'id': gid, 'gid': gid, 'name': entity.get('name'), 'builtin': False, 'sudo': False, 'members': []}
+
+        if name == 'volume.dataset' and entity.get('name'):
+            return self.dataset(entity['name'].split('/')[0], entity['name'])
+
+        if name == 'volume.snapshot' and entity.get('dataset') and entity.get('name'):
+            return self.snapshot(entity['dataset'].split('/')[0], entity['dataset'], entity['name'])
+
+        return {}
+
+    def create(self, name, entity):
+        new = self.template(name, entity)
+        new.update({k: v for k, v in entity.items() if v is not None or k not in new})
+        return self.add(name, new)
+
+    def add(self, name, entity):
+        if 'id' not in entity:
+            entity['id'] = self.last_id.get(name, 0) + 1
+
+        if isinstance(entity['id'], six.integer_types):
+            self.last_id[name] = max(self.last_id.get(name, 0), entity['id'])
+
+        self.collections[name][entity['id']] = entity
+        return entity
+
+    def update(self, name, id, updated_params):
+        old = self.get(name, id)
+        new = copy.deepcopy(old)
+        for k, v in updated_params.items():
+            q.set(new, k, v)
+
+        self.collections[name][id] = new
+        return old, new
+
+    def remove(self, name, id):
+        return self.collections[name].pop(self.get(name, id)['id'])
+
+
+class FakeClient(object):
+    """
+    Implements the parts of the dispatcher client API used by the CLI.
+    Tasks are executed one at a time by a worker thread; 'create',
+    'update' and 'delete' tasks of known collections change the dataset
+    and notify subscribers of the collection.
+    """
+
+    def __init__(self):
+        self.dataset = None
+        self.opened = False
+        self.token = None
+        self.user = None
+        self.session_id = 1
+        self.task_delay = 0
+        self.latency = 0
+        self.lock = threading.RLock()
+        self.event_handler = None
+        self.error_handler = None
+        self.subscribers = collections.defaultdict(set)
+        self.task_queue = six.moves.queue.Queue()
+        self.task_done = {}
+        self.task_thread = None
+        self.methods = {
+            'management.ping': lambda: None,
+            'management.enable_features': lambda features: None,
+            'session.get_my_session_id': lambda: self.session_id,
+            'shell.get_shells': lambda: SHELLS,
+            'task.submit': self.submit_task,
+            'task.abort': self.abort_task,
+            'task.status': lambda id: self.dataset.get('task', id)
+        }
+
+    def connect(self, uri, password=None):
+        params = parse_qs(urlparse(uri).query)
+
+        def param(name, type, default):
+            try:
+                return type(params[name][-1]) if name in params else default
+            except ValueError:
+                raise ValueError(_("Invalid value of fake backend parameter {0}".format(name)))
+
+        sizes = {i: param(i, int, v) for i, v in DEFAULT_SIZES.items()}
+        self.dataset = FakeDataset(sizes, param('seed', int, 0))
+        self.task_delay = param('task_delay', float, 0)
+        self.latency = param('latency', float, 0)
+        self.opened = True
+
+    def disconnect(self):
+        self.opened = False
+
+    def login_user(self, username, password, check_password=False):
+        self.user = username
+        self.token = 'fake'
+
+    def login_token(self, token):
+        pass
+
+    def subscribe_events(self, *masks):
+        pass
+
+    def on_event(self, handler):
+        self.event_handler = handler
+
+    def on_error(self, handler):
+        self.error_handler = handler
+
+    def call_sync(self, name, *args, **kwargs):
+        if self.latency:
+            threading.Event().wait(self.latency)
+
+        with self.lock:
+            method = self.methods.get(name)
+            if method:
+                return copy.deepcopy(method(*args))
+
+            collection, __, op = name.rpartition('.')
+            if op == 'query':
+                filter = args[0] if len(args) > 0 and args[0] else []
+                params = args[1] if len(args) > 1 and args[1] else {}
+                return copy.deepcopy(self.dataset.query(collection, *filter, **params))
+
+        raise RpcException(errno.ENOENT, 'Method {0} not found'.format(name))
+
+    def call_async(self, name, callback, *args, **kwargs):
+        def run():
+            try:
+                result = self.call_sync(name, *args)
+            except RpcException as err:
+                result = err
+
+            if callback:
+                callback(result)
+
+        threading.Thread(target=run, daemon=True, name='fake call {0}'.format(name)).start()
+
+    def call_task_sync(self, name, *args):
+        tid = self.call_sync('task.submit', name, list(args))
+        self.task_done[tid].wait()
+        return self.call_sync('task.status', tid)
+
+    def sync_delay(self, name):
+        """
+        Returns number of seconds the initial sync of given collection
+        should appear to take.
+        """
+        return 0
+
+    def subscribe(self, subscriber):
+        """
+        Registers an entity subscriber and returns the current contents
+        of its collection, so that no change is missed in between.
+        """
+        with self.lock:
+            self.subscribers[subscriber.name].add(subscriber)
+            return list(self.dataset.collections[subscriber.name].values())
+
+    def unsubscribe(self, subscriber):
+        with self.lock:
+            self.subscribers[subscriber.name].discard(subscriber)
+
+    def emit(self, name, op, old, new):
+        for i in list(self.subscribers[name]):
+            i.changed(op, old, new)
+
+    def create_entity(self, name, entity):
+        with self.lock:
+            entity = self.dataset.create(name, entity)
+            self.emit(name, 'create', None, entity)
+            return entity
+
+    def update_entity(self, name, id, updated_params):
+        with self.lock:
+            old, new = self.dataset.update(name, id, updated_params)
+            self.emit(name, 'update', old, new)
+            return new
+
+    def delete_entity(self, name, id):
+        with self.lock:
+            entity = self.dataset.remove(name, id)
+            self.emit(name, 'delete', entity, None)
+
+    def submit_task(self, name, args=None):
+        task = self.create_entity('task', self.dataset.task(
+            name, args or [], datetime.datetime.utcnow(), session=self.session_id
+        ))
+
+        self.task_done[task['id']] = threading.Event()
+        self.task_queue.put(task['id'])
+        if not self.task_thread:
+            self.task_thread = threading.Thread(target=self.task_worker, daemon=True, name='fake tasks')
+            self.task_thread.start()
+
+        return task['id']
+
+    def abort_task(self, id):
+        with self.lock:
+            if self.dataset.get('task', id)['state'] not in FINAL_STATES:
+                self.update_entity('task', id, {'state': 'ABORTED', 'finished_at': datetime.datetime.utcnow()})
+
+    def task_worker(self):
+        while True:
+            tid = self.task_queue.get()
+            with self.lock:
+                task = self.dataset.get('task', tid)
+                if task['state'] in FINAL_STATES:
+                    self.task_done.pop(tid).set()
+                    continue
+
+                self.update_entity('task', tid, {'state': 'EXECUTING', 'started_at': datetime.datetime.utcnow()})
+
+            if self.task_delay:
+                threading.Event().wait(self.task_delay)
+
+            with self.lock:
+                updated = {'finished_at': datetime.datetime.utcnow(), 'progress.percentage': 100}
+                try:
+                    updated['result'] = self.execute_task(task['name'], task['args'])
+                    updated['state'] = 'FINISHED'
+                except RpcException as err:
+                    updated['state'] = 'FAILED'
+                    updated['error'] = {'type': 'RpcException', 'code': err.code, 'message': err.message, 'extra': None}
+
+                if self.dataset.get('task', tid)['state'] not in FINAL_STATES:
+                    self.update_entity('task', tid, updated)
+
+                self.task_done.pop(tid).set()
+
+    def execute_task(self, name, args):
+        collection, __, op = name.rpartition('.')
+        if collection not in self.dataset.collections:
+            return None
+
+        if op == 'create':
+            return self.create_entity(collection, copy.deepcopy(args[0]))['id']
+
+        if op == 'update':
+            self.update_entity(collection, args[0], args[1])
+            return args[0]
+
+        if op == 'delete':
+            self.delete_entity(collection, args[0])
+
+        return None
+
+
+class FakeEntitySubscriber(object):
+    """
+    Entity subscriber counterpart of FakeClient, with the same interface
+    as the dispatcher's EntitySubscriber.
+    """
+
+    def __init__(self, client, name, maxsize=None):
+        self.client = client
+        self.name = name
+        self.items = collections.OrderedDict()
+        self.on_add = set()
+        self.on_update = set()
+        self.on_delete = set()
+        self.listeners = collections.defaultdict(list)
+        self.cv = threading.Condition()
+        self.ready = threading.Event()
+
+    def start(self):
+        for i in self.client.subscribe(self):
+            self.items[i['id']] = i
+
+        delay = self.client.sync_delay(self.name)
+        if delay:
+            threading.Timer(delay, self.ready.set).start()
+        else:
+            self.ready.set()
+
+    def stop(self):
+        self.client.unsubscribe(self)
+
+    def wait_ready(self, timeout=None):
+        return self.ready.wait(timeout)
+
+    def changed(self, op, old, new):
+        with self.cv:
+            if op == 'delete':
+                self.items.pop(old['id'], None)
+            else:
+                self.items[new['id']] = new
+
+            for i in self.listeners.get((old or new)['id'], []):
+                i.put((op, old, new))
+
+            self.cv.notify_all()
+
+        if op == 'create':
+            for i in list(self.on_add):
+                i(new)
+        elif op == 'update':
+            for i in list(self.on_update):
+                i(old, new)
+        elif op == 'delete':
+            for i in list(self.on_delete):
+                i(old)
+
+    def query(self, *filter, **params):
+        callback = params.pop('callback', None)
+        result = q.query(list(self.items.values()), *filter, **params)
+        if callback and isinstance(result, list):
+            return [callback(i) for i in result]
+
+        if callback and isinstance(result, dict):
+            return callback(result)
+
+        return result
+
+    def get(self, id, timeout=None, remote=False):
+        with self.cv:
+            if timeout:
+                self.cv.wait_for(lambda: id in self.items, timeout)
+
+            return self.items.get(id)
+
+    def wait_for(self, id, condition, timeout=None):
+        with self.cv:
+            if self.cv.wait_for(lambda: id in self.items and condition(self.items[id]), timeout):
+                return self.items[id]
+
+    def update(self, entity):
+        old = self.items.get(entity['id'])
+        self.items[entity['id']] = entity
+        for i in list(self.on_update):
+            i(old, entity)
+
+    def enforce_update(self, *filter):
+        for i in self.client.call_sync('{0}.query'.format(self.name), list(filter)):
+            self.changed('update' if i['id'] in self.items else 'create', self.items.get(i['id']), i)
+
+    def listen(self, id):
+        queue = six.moves.queue.Queue()
+        with self.cv:
+            self.listeners[id].append(queue)
+
+        try:
+            while True:
+                yield queue.get()
+        finally:
+            with self.cv:
+                self.listeners[id].remove(queue)
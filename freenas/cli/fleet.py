@@ -0,0 +1,197 @@
+#
+# Copyright 2016 iXsystems, Inc.
+# All rights reserved
+#
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted providing that the following conditions
+# are met:
+# 1. Redistributions of source code must retain the above copyright
+#    notice, this list of conditions and the following disclaimer.
+# 2. Redistributions in binary form must reproduce the above copyright
+#    notice, this list of conditions and the following disclaimer in the
+#    documentation and/or other materials provided with the distribution.
+#
+# THIS SOFTWARE IS PROVIDED BY THE AUTHOR ``AS IS'' AND ANY EXPRESS OR
+# IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE IMPLIED
+# WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE
+# ARE DISCLAIMED.  IN NO EVENT SHALL THE AUTHOR BE LIABLE FOR ANY
+# DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL
+# DAMAGES (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS
+# OR SERVICES; LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION)
+# HOWEVER CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT,
+# STRICT LIABILITY, OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING
+# IN ANY WAY OUT OF THE USE OF THIS SOFTWARE, EVEN IF ADVISED OF THE
+# POSSIBILITY OF SUCH DAMAGE.
+#
+#####################################################################
+
+import time
+import gettext
+import operator
+import threading
+import contextlib
+import six
+from six.moves.urllib.parse import urlparse
+from freenas.cli.output import Table, ValueType, output_lock, output_msg, format_output
+from freenas.cli.utils import flatten_table
+
+
+t = gettext.translation('freenas-cli', fallback=True)
+_ = t.gettext
+
+
+class FleetHost(object):
+    def __init__(self, uri):
+        self.uri = uri
+        self.hostname = urlparse(uri if '://' in uri or ':' in uri else 'ws://' + uri).hostname or uri
+        self.state = 'WAITING'
+        self.error = None
+        self.connect_time = None
+        self.run_time = None
+
+
+class Fleet(object):
+    """
+    Runs one parsed script against many hosts concurrently. Every host gets
+    a Context of its own, created and logged in by `connect(uri)`, and at
+    most `concurrency` hosts are connected at the same time. A host that
+    fails does not stop the others.
+
+    Results are printed as soon as a host produces them, tables with a
+    leading Host column. With `aggregate` set, tables of the same statement
+    are instead merged across hosts and printed at the end.
+    """
+    def __init__(self, uris, connect, concurrency=8, aggregate=False):
+        self.hosts = [FleetHost(i) for i in uris]
+        self.connect = connect
+        self.concurrency = max(1, concurrency)
+        self.aggregate = aggregate
+        self.aggregated = {}
+        self.queue = six.moves.queue.Queue()
+        self.stopped = False
+
+    @staticmethod
+    def read_hosts(f):
+        for line in f:
+            line = line.split('#', 1)[0].strip()
+            if line:
+                yield line
+
+    def run(self, ast):
+        for host in self.hosts:
+            self.queue.put(host)
+
+        workers = []
+        for i in range(min(self.concurrency, len(self.hosts))):
+            w = threading.Thread(target=self.worker, args=(ast,), name='fleet worker')
+            w.daemon = True
+            w.start()
+            workers.append(w)
+
+        try:
+            for w in workers:
+                while w.is_alive():
+                    w.join(0.5)
+        except KeyboardInterrupt:
+            # Hosts already running finish their current statement on their own
+            self.stopped = True
+            output_msg(_("Interrupted, hosts not started yet are skipped"))
+            for host in self.hosts:
+                if host.state == 'WAITING':
+                    host.state = 'SKIPPED'
+
+        for key in sorted(self.aggregated):
+            format_output(self.aggregated[key])
+
+        return self.summary()
+
+    def worker(self, ast):
+        while not self.stopped:
+            try:
+                host = self.queue.get_nowait()
+            except six.moves.queue.Empty:
+                return
+
+            self.run_host(host, ast)
+
+    def run_host(self, host, ast):
+        host.state = 'CONNECTING'
+        started_at = time.time()
+        try:
+            context = self.connect(host.uri)
+        except SystemExit:
+            # Context.connect() and login() report the reason themselves
+            host.state = 'FAILED'
+            host.error = _("Cannot connect or log in")
+            return
+        except BaseException as err:
+            host.state = 'FAILED'
+            host.error = str(err) or type(err).__name__
+            return
+        finally:
+            host.connect_time = time.time() - started_at
+
+        host.state = 'RUNNING'
+        started_at = time.time()
+        try:
+            for index, stmt in enumerate(ast):
+                if self.stopped:
+                    raise KeyboardInterrupt()
+
+                context.call_stack = []
+                ret = flatten_table(context.ml.eval(stmt, first=True, printable_none=True))
+                if ret is not None:
+                    self.emit(host, index, ret)
+
+            host.state = 'FINISHED'
+        except BaseException as err:
+            host.state = 'FAILED'
+            host.error = str(err) or type(err).__name__
+        finally:
+            host.run_time = time.time() - started_at
+            with contextlib.suppress(BaseException):
+                context.connection.disconnect()
+
+            # The event loop is shared with the other hosts
+            context.output_future.cancel()
+
+    def emit(self, host, index, ret):
+        if not isinstance(ret, Table):
+            with output_lock:
+                output_msg('[{0}]'.format(host.hostname))
+                format_output(ret)
+            return
+
+        columns = [Table.Column(_("Host"), operator.itemgetter(0))]
+        columns += [
+            Table.Column(c.label, operator.itemgetter(i + 1), c.vt, c.width)
+            for i, c in enumerate(ret.columns)
+        ]
+
+        # Cells are resolved right away, while the host's context is still connected
+        rows = [[host.hostname] + [r[c.name] for c in ret.columns] for r in ret]
+
+        with output_lock:
+            if self.aggregate:
+                self.aggregated.setdefault(index, Table([], columns)).data.extend(rows)
+            else:
+                format_output(Table(rows, columns))
+
+    def summary(self):
+        return Table([{
+            'host': h.hostname,
+            'state': h.state,
+            'connect': round(h.connect_time, 3) if h.connect_time is not None else None,
+            'run': round(h.run_time, 3) if h.run_time is not None else None,
+            'error': h.error
+        } for h in self.hosts], [
+            Table.Column(_("Host"), 'host'),
+            Table.Column(_("State"), 'state'),
+            Table.Column(_("Connect (s)"), 'connect', ValueType.NUMBER),
+            Table.Column(_("Run (s)"), 'run', ValueType.NUMBER),
+            Table.Column(_("Error"), 'error')
+        ])
+
+    @property
+    def failed(self):
+        return [h for h in self.hosts if h.state != 'FINISHED']
@@ -33,12 +33,14 @@ import time
 import random
 import json
 import re
-from threading import Timer
+import itertools
+import collections
+from threading import Event
 from builtins import input
 from freenas.cli.namespace import Command
 from freenas.cli.output import format_output, output_msg, Table, Sequence
 from freenas.cli.parser import Quote, parse, unparse, read_ast as parser_read_ast, FunctionDefinition
-from freenas.cli.utils import pass_env
+from freenas.cli.utils import pass_env, TaskGroup
 from freenas.cli import config
 from freenas.utils import decode_escapes
 
@@ -125,8 +127,30 @@ def rand(a, b):
     return random.randint(a, b)
 
 
-def setinterval(interval, fn):
-    Timer(interval / 1000, fn).start()
+def setinterval(interval, fn, mode='rate', overlap='skip'):
+    """
+    Runs fn every interval milliseconds and returns the id of the job.
+    mode 'rate' runs it at a fixed rate, 'delay' waits interval after each
+    run ends. overlap tells whether a run due while the previous one is
+    still going is skipped or queued.
+
+    setinterval used to run fn only once. Scripts that re-arm themselves by
+    calling setinterval from fn now start one more repeating job on every
+    run: use settimeout there, or call setinterval once and stop the job
+    with clearinterval.
+    """
+    return config.instance.scheduler.add(fn, interval / 1000, True, mode, overlap, getattr(fn, 'name', None)).id
+
+
+def settimeout(timeout, fn):
+    """
+    Runs fn once, after timeout milliseconds, and returns the id of the job.
+    """
+    return config.instance.scheduler.add(fn, timeout / 1000, False, name=getattr(fn, 'name', None)).id
+
+
+def clearinterval(id):
+    return config.instance.scheduler.remove(id)
 
 
 def readkey():
@@ -162,6 +186,54 @@ def rpc(name, *args):
     return Sequence(*config.instance.call_sync(name, *args))
 
 
+def rpc_batch_iter(calls, concurrency=8):
+    """
+    Issues calls given as [method, arg1, arg2, ...] lists through call_async,
+    keeping up to concurrency of them in flight, and yields their results in
+    the original order. A failed call yields its exception instead of a result.
+    Calls are read lazily, so this can be fed from a generator.
+    """
+    context = config.instance
+    calls = iter(calls)
+    pending = collections.deque()
+
+    if concurrency < 1:
+        raise ValueError('concurrency must be a positive number')
+
+    def issue(call):
+        if not isinstance(call, (list, tuple)) or not call or not isinstance(call[0], str):
+            raise ValueError('Each call must be a list of a method name and its arguments')
+
+        slot = {'done': Event(), 'result': None}
+
+        def done(result):
+            slot['result'] = result
+            slot['done'].set()
+
+        pending.append(slot)
+        try:
+            context.call_async(call[0], done, *call[1:])
+        except BaseException as err:
+            done(err)
+
+    for call in itertools.islice(calls, concurrency):
+        issue(call)
+
+    while pending:
+        slot = pending.popleft()
+        while not slot['done'].wait(0.5):
+            pass
+
+        for call in itertools.islice(calls, 1):
+            issue(call)
+
+        yield slot['result']
+
+
+def rpc_batch(calls, concurrency=8):
+    return list(rpc_batch_iter(calls, concurrency))
+
+
 def call_task(name, *args):
     return config.instance.call_task_sync(name, *args)
 
@@ -250,6 +322,21 @@ def waitfor(promise):
     return promise.wait()
 
 
+def group():
+    return TaskGroup(config.instance)
+
+
+def waitall(promises, timeout=None):
+    if isinstance(promises, TaskGroup):
+        return promises.wait(timeout)
+
+    g = TaskGroup(config.instance, False)
+    for i in promises:
+        g.add(i)
+
+    return g.wait(timeout)
+
+
 def dump_ast(ast):
     return ast.to_json()
 
@@ -288,6 +375,8 @@ functions = {
     'unparse': unparse_,
     'sleep': time.sleep,
     'rpc': rpc,
+    'rpc_batch': rpc_batch,
+    'rpc_batch_iter': rpc_batch_iter,
     'call_task': call_task,
     'cwd': cwd,
     'register_command': register_command,
@@ -299,6 +388,8 @@ functions = {
     'typeof': typeof,
     'rand': rand,
     'setinterval': setinterval,
+    'settimeout': settimeout,
+    'clearinterval': clearinterval,
     'append': lambda a, i: a.append(i),
     'remove': lambda a, i: a.remove(i),
     'resize': array_resize,
@@ -317,6 +408,8 @@ functions = {
     're_match': re_match,
     're_search': re_search,
     'waitfor': waitfor,
+    'group': group,
+    'waitall': waitall,
     'dump_ast': dump_ast,
     'read_ast': read_ast,
     'defined': defined,
@@ -0,0 +1,234 @@
+#
+# Copyright 2016 iXsystems, Inc.
+# All rights reserved
+#
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted providing that the following conditions
+# are met:
+# 1. Redistributions of source code must retain the above copyright
+#    notice, this list of conditions and the following disclaimer.
+# 2. Redistributions in binary form must reproduce the above copyright
+#    notice, this list of conditions and the following disclaimer in the
+#    documentation and/or other materials provided with the distribution.
+#
+# THIS SOFTWARE IS PROVIDED BY THE AUTHOR ``AS IS'' AND ANY EXPRESS OR
+# IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE IMPLIED
+# WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE
+# ARE DISCLAIMED.  IN NO EVENT SHALL THE AUTHOR BE LIABLE FOR ANY
+# DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL
+# DAMAGES (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS
+# OR SERVICES; LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION)
+# HOWEVER CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT,
+# STRICT LIABILITY, OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING
+# IN ANY WAY OUT OF THE USE OF THIS SOFTWARE, EVEN IF ADVISED OF THE
+# POSSIBILITY OF SUCH DAMAGE.
+#
+#####################################################################
+
+
+import os
+import time
+import threading
+
+try:
+    import fcntl
+except ImportError:
+    fcntl = None
+
+
+class HistoryStore(object):
+    """
+    Persistent command history shared between CLI sessions.
+
+    Lines are buffered in memory and appended to the history file in
+    batches. The file is rotated once it grows past ``max_size`` and
+    only its tail is read back on startup. Every entry remembers the
+    namespace it was executed in, stored as a trailing CLI comment so
+    that the file stays a valid script for older clients.
+    """
+
+    PATH_MARKER = '  #@'
+    BLOCK_SIZE = 65536
+
+    class Entry(object):
+        __slots__ = ('command', 'path')
+
+        def __init__(self, command, path=''):
+            self.command = command
+            self.path = path
+
+    def __init__(self, filename, max_entries=10000, max_size=1024 * 1024, rotations=1, flush_count=20, flush_interval=5):
+        self.filename = filename
+        self.max_entries = max_entries
+        self.max_size = max_size
+        self.rotations = rotations
+        self.flush_count = flush_count
+        self.flush_interval = flush_interval
+        self.entries = []
+        self.by_path = {}
+        self.by_prefix = {}
+        self.buffer = []
+        self.last_flush = time.time()
+        self.lock = threading.RLock()
+
+    def __len__(self):
+        return len(self.entries)
+
+    @staticmethod
+    def command_prefix(command):
+        return command.split(None, 1)[0] if command.strip() else ''
+
+    def format_line(self, command, path):
+        # The last marker on a line starts the path, so a command that
+        # contains the marker itself gets one appended even without a path
+        if path or self.PATH_MARKER in command:
+            return '{0}{1}{2}'.format(command, self.PATH_MARKER, path)
+
+        return command
+
+    def parse_line(self, line):
+        command, sep, path = line.rpartition(self.PATH_MARKER)
+        if not sep:
+            return line, ''
+
+        return command, path
+
+    def add_entry(self, command, path=''):
+        idx = len(self.entries)
+        self.entries.append(self.Entry(command, path))
+        self.by_path.setdefault(path, []).append(idx)
+        self.by_prefix.setdefault(self.command_prefix(command), []).append(idx)
+
+    def read_tail(self, filename, count):
+        try:
+            with open(filename, 'rb') as f:
+                f.seek(0, os.SEEK_END)
+                pos = f.tell()
+                data = b''
+                while pos > 0 and data.count(b'\n') <= count:
+                    step = min(self.BLOCK_SIZE, pos)
+                    pos -= step
+                    f.seek(pos)
+                    data = f.read(step) + data
+        except (IOError, OSError):
+            return []
+
+        lines = [l for l in data.decode('utf8', 'ignore').splitlines() if l.strip()]
+        if pos > 0:
+            # First line is most likely cut in half
+            lines = lines[1:]
+
+        return lines[-count:]
+
+    def load(self):
+        with self.lock:
+            lines = self.read_tail(self.filename, self.max_entries)
+            if len(lines) < self.max_entries and self.rotations > 0:
+                older = self.read_tail('{0}.1'.format(self.filename), self.max_entries - len(lines))
+                lines = older + lines
+
+            for line in lines:
+                self.add_entry(*self.parse_line(line))
+
+            return self.entries
+
+    def append(self, command, path=''):
+        with self.lock:
+            self.add_entry(command, path)
+            self.buffer.append(self.format_line(command, path))
+            if len(self.buffer) >= self.flush_count or time.time() - self.last_flush >= self.flush_interval:
+                self.flush()
+
+    def flush(self):
+        with self.lock:
+            self.last_flush = time.time()
+            if not self.buffer:
+                return
+
+            buffer, self.buffer = self.buffer, []
+            try:
+                with self.open_locked() as f:
+                    f.write(''.join('\n' + line for line in buffer))
+                    f.flush()
+                    if f.tell() >= self.max_size:
+                        self.rotate()
+            except (IOError, OSError):
+                pass
+
+    def open_locked(self):
+        """
+        Opens the history file for appending with an exclusive lock held.
+        Another session may rotate the file while we wait for the lock, in
+        which case the file is opened again under its name.
+        """
+        while True:
+            f = open(self.filename, 'a')
+            if not fcntl:
+                return f
+
+            try:
+                fcntl.flock(f, fcntl.LOCK_EX)
+                opened = os.fstat(f.fileno())
+                try:
+                    current = os.stat(self.filename)
+                except (IOError, OSError):
+                    current = None
+
+                if current and (current.st_ino, current.st_dev) == (opened.st_ino, opened.st_dev):
+                    return f
+            except BaseException:
+                f.close()
+                raise
+
+            f.close()
+
+    def rotate(self):
+        # Called with the history file locked, so concurrent sessions
+        # do not rotate the same file twice
+        if self.rotations < 1:
+            os.unlink(self.filename)
+            return
+
+        for i in range(self.rotations - 1, 0, -1):
+            src = '{0}.{1}'.format(self.filename, i)
+            if os.path.exists(src):
+                os.rename(src, '{0}.{1}'.format(self.filename, i + 1))
+
+        os.rename(self.filename, '{0}.1'.format(self.filename))
+
+    def search(self, text=None, path=None, prefix=None, limit=None):
+        """
+        Returns entries matching all of the given filters, newest last.
+        Scans backwards, so only the most recent ``limit`` matches are visited.
+        """
+        with self.lock:
+            candidates = None
+            if path is not None:
+                candidates = self.by_path.get(path, [])
+
+            if prefix:
+                by_prefix = self.by_prefix.get(self.command_prefix(prefix), [])
+                if candidates is None:
+                    candidates = by_prefix
+                else:
+                    by_prefix = set(by_prefix)
+                    candidates = [i for i in candidates if i in by_prefix]
+
+            if candidates is None:
+                candidates = range(len(self.entries))
+
+            result = []
+            for idx in reversed(candidates):
+                entry = self.entries[idx]
+                if prefix and not entry.command.startswith(prefix):
+                    continue
+
+                if text and text not in entry.command:
+                    continue
+
+                result.append(entry)
+                if limit and len(result) >= limit:
+                    break
+
+            result.reverse()
+            return result
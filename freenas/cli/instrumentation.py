@@ -0,0 +1,574 @@
+#
+# Copyright 2016 iXsystems, Inc.
+# All rights reserved
+#
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted providing that the following conditions
+# are met:
+# 1. Redistributions of source code must retain the above copyright
+#    notice, this list of conditions and the following disclaimer.
+# 2. Redistributions in binary form must reproduce the above copyright
+#    notice, this list of conditions and the following disclaimer in the
+#    documentation and/or other materials provided with the distribution.
+#
+# THIS SOFTWARE IS PROVIDED BY THE AUTHOR ``AS IS'' AND ANY EXPRESS OR
+# IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE IMPLIED
+# WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE
+# ARE DISCLAIMED.  IN NO EVENT SHALL THE AUTHOR BE LIABLE FOR ANY
+# DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL
+# DAMAGES (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS
+# OR SERVICES; LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION)
+# HOWEVER CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT,
+# STRICT LIABILITY, OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING
+# IN ANY WAY OUT OF THE USE OF THIS SOFTWARE, EVEN IF ADVISED OF THE
+# POSSIBILITY OF SUCH DAMAGE.
+#
+#####################################################################
+
+
+import os
+import json
+import time
+import bisect
+import marshal
+import threading
+import contextlib
+import collections
+from freenas.cli.parser import unparse
+from freenas.cli.output import Table, ValueType
+
+
+class LatencyStats(object):
+    """
+    Call count, error count, transferred bytes and latency histogram
+    of a single RPC method or CLI command.
+    """
+
+    # Upper bounds of histogram buckets, in milliseconds
+    BUCKETS = [1, 2, 5, 10, 20, 50, 100, 200, 500, 1000, 2000, 5000, 10000]
+
+    def __init__(self):
+        self.count = 0
+        self.errors = 0
+        self.total = 0.0
+        self.min = None
+        self.max = None
+        self.bytes_in = 0
+        self.bytes_out = 0
+        self.histogram = [0] * (len(self.BUCKETS) + 1)
+
+    def add(self, duration, error=False, bytes_in=0, bytes_out=0):
+        ms = duration * 1000
+        self.count += 1
+        self.total += ms
+        self.min = ms if self.min is None else min(self.min, ms)
+        self.max = ms if self.max is None else max(self.max, ms)
+        self.bytes_in += bytes_in
+        self.bytes_out += bytes_out
+        self.histogram[bisect.bisect_left(self.BUCKETS, ms)] += 1
+        if error:
+            self.errors += 1
+
+    @property
+    def average(self):
+        return self.total / self.count if self.count else 0
+
+    def percentile(self, pct):
+        """
+        Upper bound of the histogram bucket containing given percentile.
+        """
+        if not self.count:
+            return 0
+
+        threshold = self.count * pct / 100.0
+        seen = 0
+        for idx, n in enumerate(self.histogram):
+            seen += n
+            if seen >= threshold:
+                return self.BUCKETS[idx] if idx < len(self.BUCKETS) else self.max
+
+        return self.max
+
+    def __getstate__(self):
+        return {
+            'count': self.count,
+            'errors': self.errors,
+            'total_ms': round(self.total, 3),
+            'avg_ms': round(self.average, 3),
+            'min_ms': round(self.min or 0, 3),
+            'max_ms': round(self.max or 0, 3),
+            'p50_ms': self.percentile(50),
+            'p95_ms': self.percentile(95),
+            'bytes_in': self.bytes_in,
+            'bytes_out': self.bytes_out,
+            'histogram': {
+                ('<={0}'.format(b) if idx < len(self.BUCKETS) else '>{0}'.format(self.BUCKETS[-1])): n
+                for idx, (b, n) in enumerate(zip(self.BUCKETS + [None], self.histogram)) if n
+            }
+        }
+
+
+class RpcStats(object):
+    """
+    Statistics of dispatcher calls made by the CLI, grouped by RPC method
+    (or submitted task name) and by the CLI command that issued them.
+    """
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.local = threading.local()
+        self.started_at = time.time()
+        self.by_method = {}
+        self.by_command = {}
+
+    @property
+    def command(self):
+        return getattr(self.local, 'command', None) or '<none>'
+
+    @contextlib.contextmanager
+    def command_scope(self, name):
+        """
+        Attributes calls made by the current thread to the given CLI command.
+        """
+        previous = getattr(self.local, 'command', None)
+        self.local.command = name
+        try:
+            yield
+        finally:
+            self.local.command = previous
+
+    @staticmethod
+    def size_of(obj):
+        try:
+            return len(json.dumps(obj, default=str))
+        except (TypeError, ValueError):
+            return 0
+
+    def record(self, method, duration, error=False, args=None, result=None, command=None):
+        bytes_out = self.size_of(args) if args else 0
+        bytes_in = self.size_of(result) if result is not None else 0
+        command = command or self.command
+
+        with self.lock:
+            for stats, key in ((self.by_method, method), (self.by_command, command)):
+                if key not in stats:
+                    stats[key] = LatencyStats()
+
+                stats[key].add(duration, error, bytes_in, bytes_out)
+
+    @contextlib.contextmanager
+    def measure(self, method, args=None):
+        """
+        Times the enclosed call. Set ``result`` on the yielded object to
+        have its size accounted for.
+        """
+        call = CallRecord()
+        started_at = time.time()
+        try:
+            yield call
+        except BaseException:
+            self.record(method, time.time() - started_at, True, args)
+            raise
+
+        self.record(method, time.time() - started_at, False, args, call.result)
+
+    def wrap_callback(self, method, callback, args=None):
+        """
+        Wraps an asynchronous call callback so that the call is recorded
+        once its result arrives.
+        """
+        command = self.command
+        started_at = time.time()
+
+        def wrapper(*cb_args, **cb_kwargs):
+            result = cb_args[0] if cb_args else None
+            if isinstance(result, BaseException):
+                self.record(method, time.time() - started_at, True, args, None, command)
+            else:
+                self.record(method, time.time() - started_at, False, args, result, command)
+            if callback:
+                return callback(*cb_args, **cb_kwargs)
+
+        return wrapper
+
+    def reset(self):
+        with self.lock:
+            self.started_at = time.time()
+            self.by_method = {}
+            self.by_command = {}
+
+    def __getstate__(self):
+        with self.lock:
+            return {
+                'since': self.started_at,
+                'methods': {k: v.__getstate__() for k, v in self.by_method.items()},
+                'commands': {k: v.__getstate__() for k, v in self.by_command.items()}
+            }
+
+
+class CallRecord(object):
+    __slots__ = ('result',)
+
+    def __init__(self):
+        self.result = None
+
+
+class ProfileRecord(object):
+    __slots__ = ('name', 'file', 'line', 'column', 'count', 'inclusive', 'exclusive', 'rpc', 'rpc_self', 'callers')
+
+    def __init__(self, name, file, line, column):
+        self.name = name
+        self.file = file
+        self.line = line
+        self.column = column
+        self.count = 0
+        self.inclusive = 0.0
+        self.exclusive = 0.0
+        self.rpc = 0
+        self.rpc_self = 0
+        self.callers = {}
+
+    @property
+    def location(self):
+        # Column is a lexer offset, so it only serves to tell apart
+        # statements sharing a line
+        return '{0}:{1}'.format(self.file, self.line)
+
+
+class ProfileFrame(object):
+    __slots__ = ('key', 'record', 'started_at', 'rpc_start', 'child_time', 'child_rpc')
+
+    def __init__(self, key, record, rpc_start):
+        self.key = key
+        self.record = record
+        self.started_at = time.time()
+        self.rpc_start = rpc_start
+        self.child_time = 0.0
+        self.child_rpc = 0
+
+
+class ScriptProfiler(object):
+    """
+    Accumulates inclusive and exclusive time, execution counts and middleware
+    call counts per script statement (keyed by the file, line and column
+    recorded on AST nodes) and per user-defined function.
+    """
+
+    LABEL_LENGTH = 60
+
+    def __init__(self, variables):
+        self.variables = variables
+        self.forced = 0
+        self.rpc_calls = 0
+        self.records = {}
+        self.local = threading.local()
+
+    @property
+    def active(self):
+        return self.forced > 0 or self.variables.get('profile')
+
+    @property
+    def stack(self):
+        # Each thread (eg. parallel for workers) nests frames on its own
+        if not hasattr(self.local, 'stack'):
+            self.local.stack = []
+
+        return self.local.stack
+
+    def reset(self):
+        self.records = {}
+        self.local = threading.local()
+
+    @contextlib.contextmanager
+    def session(self):
+        """
+        Profiles the enclosed code regardless of the profile option.
+        """
+        self.forced += 1
+        try:
+            yield
+        finally:
+            self.forced -= 1
+
+    def label(self, stmt):
+        try:
+            label = unparse(stmt, oneliner=True)
+        except BaseException:
+            label = type(stmt).__name__
+
+        if len(label) > self.LABEL_LENGTH:
+            label = label[:self.LABEL_LENGTH - 3] + '...'
+
+        return label
+
+    def statement(self, stmt):
+        location = (getattr(stmt, 'file', None) or '<stdin>', getattr(stmt, 'line', 0), getattr(stmt, 'column', 0))
+        key = location
+        if location[0] == '<stdin>':
+            # Interactive lines all start at line 1, tell them apart by text
+            key = location + (self.label(stmt),)
+
+        record = self.records.get(key)
+        if not record:
+            record = self.records[key] = ProfileRecord(self.label(stmt), *location)
+
+        return self.frame(key, record)
+
+    def function(self, func):
+        key = ('<function>', func.name)
+        record = self.records.get(key)
+        if not record:
+            body = getattr(func, 'exp', None)
+            first = body[0] if body else None
+            record = self.records[key] = ProfileRecord(
+                'function {0}()'.format(func.name),
+                getattr(first, 'file', '<builtin>'),
+                getattr(first, 'line', 0),
+                getattr(first, 'column', 0)
+            )
+
+        return self.frame(key, record)
+
+    @contextlib.contextmanager
+    def frame(self, key, record):
+        parent = self.stack[-1] if self.stack else None
+        frame = ProfileFrame(key, record, self.rpc_calls)
+        recursive = any(f.key == key for f in self.stack)
+        self.stack.append(frame)
+        try:
+            yield
+        finally:
+            self.stack.pop()
+            elapsed = time.time() - frame.started_at
+            rpc = self.rpc_calls - frame.rpc_start
+
+            record.count += 1
+            record.exclusive += elapsed - frame.child_time
+            record.rpc_self += rpc - frame.child_rpc
+            if not recursive:
+                record.inclusive += elapsed
+                record.rpc += rpc
+
+            if parent:
+                parent.child_time += elapsed
+                parent.child_rpc += rpc
+                edge = record.callers.setdefault(parent.key, [0, 0.0, 0.0])
+                edge[0] += 1
+                edge[1] += elapsed - frame.child_time
+                edge[2] += elapsed
+
+    def hot_spots(self, limit=None, functions=False):
+        records = [r for k, r in self.records.items() if (k[0] == '<function>') == functions]
+        records.sort(key=lambda r: r.exclusive, reverse=True)
+        return records[:limit] if limit else records
+
+    def pstats_key(self, key):
+        record = self.records[key]
+        return record.file, record.line, record.name
+
+    def dump_pstats(self, filename):
+        """
+        Writes statistics in the format read by pstats.Stats.
+        """
+        stats = {}
+        for key, record in self.records.items():
+            callers = {
+                self.pstats_key(k): (n, n, tt, ct)
+                for k, (n, tt, ct) in record.callers.items() if k in self.records
+            }
+
+            stats[self.pstats_key(key)] = (record.count, record.count, record.exclusive, record.inclusive, callers)
+
+        with open(filename, 'wb') as f:
+            marshal.dump(stats, f)
+
+    def dump_callgrind(self, filename):
+        """
+        Writes statistics in callgrind format (as read by kcachegrind),
+        with costs in microseconds and middleware calls.
+        """
+        calls = {}
+        for key, record in self.records.items():
+            for parent, (n, tt, ct) in record.callers.items():
+                calls.setdefault(parent, []).append((record, n, ct))
+
+        with open(filename, 'w') as f:
+            f.write('version: 1\ncreator: freenas-cli\npositions: line\nevents: Time_us RPC\n\n')
+            for key, record in self.records.items():
+                f.write('fl={0}\nfn={1}\n'.format(record.file, record.name))
+                f.write('{0} {1} {2}\n'.format(record.line, int(record.exclusive * 1000000), record.rpc_self))
+                for callee, n, ct in calls.get(key, []):
+                    f.write('cfl={0}\ncfn={1}\n'.format(callee.file, callee.name))
+                    f.write('calls={0} {1}\n'.format(n, callee.line))
+                    f.write('{0} {1} {2}\n'.format(record.line, int(ct * 1000000), callee.rpc))
+
+                f.write('\n')
+
+
+class Tracer(object):
+    """
+    Writes one JSON line per top-level CLI command to the file named by
+    the trace_file option, with timings of the command's spans: parsing,
+    namespace resolution, middleware calls, task submissions, waiting
+    on entity subscribers and output rendering.
+    """
+
+    def __init__(self, context):
+        self.context = context
+        self.lock = threading.Lock()
+        self.trace = None
+        self.thread = None
+        self.depth = 0
+
+    @property
+    def active(self):
+        return self.trace is not None and threading.current_thread() is self.thread
+
+    def begin(self, command):
+        if self.trace is not None:
+            if threading.current_thread() is self.thread:
+                # Nested command, eg. cd processing its target path
+                self.depth += 1
+
+            return
+
+        if not self.context.variables.get('trace_file'):
+            return
+
+        self.thread = threading.current_thread()
+        self.depth = 1
+        self.trace = {
+            'timestamp': time.time(),
+            'pid': os.getpid(),
+            'session': self.context.session_id,
+            'command': command,
+            'spans': [],
+            'started_at': time.time()
+        }
+
+    def fail(self, error):
+        if self.active:
+            self.trace['error'] = str(error)
+            self.trace['call_stack'] = [str(i) for i in self.context.call_stack]
+
+    def end(self):
+        if not self.active:
+            return
+
+        self.depth -= 1
+        if self.depth > 0:
+            return
+
+        trace, self.trace = self.trace, None
+        trace['duration_ms'] = round((time.time() - trace.pop('started_at')) * 1000, 3)
+        trace.setdefault('call_stack', [str(i) for i in self.context.call_stack])
+
+        try:
+            with self.lock, open(self.context.variables.get('trace_file'), 'a') as f:
+                f.write(json.dumps(trace, default=str) + '\n')
+        except (IOError, OSError, TypeError):
+            pass
+
+    def set_command(self, command):
+        if self.active and self.depth == 1:
+            self.trace['command'] = command
+
+    @contextlib.contextmanager
+    def span(self, kind, **attrs):
+        if not self.active:
+            yield
+            return
+
+        trace = self.trace
+        started_at = time.time()
+        span = dict(attrs, span=kind, start_ms=round((started_at - trace['started_at']) * 1000, 3))
+        trace['spans'].append(span)
+        try:
+            yield
+        except BaseException as err:
+            span['error'] = str(err)
+            raise
+        finally:
+            span['duration_ms'] = round((time.time() - started_at) * 1000, 3)
+
+
+class StartupProfiler(object):
+    """
+    Phase by phase timing of the CLI startup, including import and _init
+    time of each plugin and initial sync time and size of each entity
+    subscriber collection. Subscribers are waited for in order, so sync
+    time of a collection is the time it was first seen ready.
+    """
+
+    def __init__(self):
+        self.enabled = False
+        self.started_at = None
+        self.total = None
+        self.phases = collections.OrderedDict()
+        self.plugins = collections.OrderedDict()
+        self.collections = collections.OrderedDict()
+
+    def start(self, started_at):
+        self.enabled = True
+        self.started_at = started_at
+        self.phases['main'] = time.time() - started_at
+
+    def finish(self):
+        self.total = time.time() - self.started_at
+
+    @contextlib.contextmanager
+    def phase(self, name):
+        if not self.enabled:
+            yield
+            return
+
+        started_at = time.time()
+        try:
+            yield
+        finally:
+            self.phases[name] = self.phases.get(name, 0) + time.time() - started_at
+
+    def plugin(self, name, stage, duration):
+        if self.enabled:
+            self.plugins.setdefault(name, {'import': 0.0, 'init': 0.0})[stage] = duration
+
+    def subscriber_started(self, name):
+        if self.enabled:
+            self.collections[name] = {'started_at': time.time(), 'sync': None, 'entities': None}
+
+    def subscriber_ready(self, name, entities):
+        collection = self.collections.get(name)
+        if collection and collection['sync'] is None:
+            collection['sync'] = time.time() - collection['started_at']
+            collection['entities'] = entities
+
+    def tables(self):
+        plugins = sorted(self.plugins.items(), key=lambda i: i[1]['import'] + i[1]['init'], reverse=True)
+        subscribers = sorted(self.collections.items(), key=lambda i: i[1]['sync'] or 0, reverse=True)
+        return [
+            Table(list(self.phases.items()), [
+                Table.Column('Phase', lambda r: r[0]),
+                Table.Column('Seconds', lambda r: round(r[1], 3)),
+                Table.Column('Share %', lambda r: round(r[1] / self.total * 100, 1) if self.total else None)
+            ]),
+            Table(plugins, [
+                Table.Column('Plugin', lambda r: r[0]),
+                Table.Column('Import s', lambda r: round(r[1]['import'], 3)),
+                Table.Column('Init s', lambda r: round(r[1]['init'], 3))
+            ]),
+            Table(subscribers, [
+                Table.Column('Collection', lambda r: r[0]),
+                Table.Column('Sync s', lambda r: round(r[1]['sync'], 3) if r[1]['sync'] is not None else None),
+                Table.Column('Entities', lambda r: r[1]['entities'], ValueType.NUMBER)
+            ])
+        ]
+
+    def __getstate__(self):
+        return {
+            'total': self.total,
+            'phases': [{'name': k, 'duration': v} for k, v in self.phases.items()],
+            'plugins': [{'name': k, 'import': v['import'], 'init': v['init']} for k, v in self.plugins.items()],
+            'collections': [
+                {'name': k, 'sync': v['sync'], 'entities': v['entities']} for k, v in self.collections.items()
+            ]
+        }
@@ -508,6 +508,9 @@ class ItemNamespace(Namespace):
                     prop.do_remove(entity, v)
 
             self.parent.modified = True
+            if context.defer_save(self.parent):
+                return
+
             tid = self.parent.save()
             return EntityPromise(context, tid, self.parent)
 
@@ -562,6 +565,9 @@ class ItemNamespace(Namespace):
                 )
 
             self.parent.modified = True
+            if context.defer_save(self.parent):
+                return
+
             self.parent.save()
 
         def complete(self, context, **kwargs):
@@ -659,6 +665,24 @@ class ItemNamespace(Namespace):
     def save(self):
         raise NotImplementedError()
 
+    def transaction_key(self):
+        """
+        Identifies the entity for deferred saves (see 'begin' command).
+        None means changes of this namespace are always saved immediately.
+        """
+        return None
+
+    def restore_pending(self):
+        # Reloading must not lose changes deferred until 'commit'
+        pending = self.context.pending_change(self)
+        if pending is not None:
+            self.entity = copy.deepcopy(pending['entity'])
+            self.orig_entity = pending['orig_entity']
+            if pending['update_args'] is not None:
+                self.update_args = copy.deepcopy(pending['update_args'])
+
+            self.modified = True
+
     def has_property(self, prop):
         return any(x for x in self.property_mappings if x.name == prop)
 
@@ -794,6 +818,7 @@ class ConfigNamespace(ItemNamespace):
             self.entity = copy.deepcopy(self.orig_entity)
 
         self.modified = False
+        self.restore_pending()
 
     def save(self):
         return self.context.submit_task(
@@ -802,6 +827,9 @@ class ConfigNamespace(ItemNamespace):
             callback=lambda s, t: post_save(self, s, t)
         )
 
+    def transaction_key(self):
+        return type(self).__name__, self.name
+
 
 class SingleItemNamespace(ItemNamespace):
     def __init__(self, name, parent, context, **kwargs):
@@ -925,6 +953,7 @@ class SingleItemNamespace(ItemNamespace):
             # This is in case the task failed!
             self.entity = copy.deepcopy(self.orig_entity)
         self.modified = False
+        self.restore_pending()
 
     def wait(self):
         self.parent.wait_one(self.get_name())
@@ -933,6 +962,16 @@ class SingleItemNamespace(ItemNamespace):
     def save(self):
         return self.parent.save(self, not self.saved)
 
+    def transaction_key(self):
+        if not self.saved or not isinstance(self.parent, TaskBasedSaveMixin):
+            return None
+
+        name = self.name
+        if self.orig_entity and self.parent.primary_key:
+            name = self.parent.primary_key.do_get(self.orig_entity)
+
+        return type(self.parent).__name__, self.parent.get_name(), name
+
     def commands(self):
         base = super(SingleItemNamespace, self).commands()
         if self.parent.allow_create:
@@ -1282,7 +1321,9 @@ class EntitySubscriberBasedLoadMixin(object):
             options['sort'] = [self.default_sort]
 
         if not self.context.docgen_run:
-            self.context.entity_subscribers[self.entity_subscriber_name].wait_ready()
+            with self.context.tracer.span('wait', subscriber=self.entity_subscriber_name):
+                self.context.entity_subscribers[self.entity_subscriber_name].wait_ready()
+
             return self.context.entity_subscribers[self.entity_subscriber_name].query(
                 *(self.extra_query_params + params),
                 **options
@@ -1291,7 +1332,9 @@ class EntitySubscriberBasedLoadMixin(object):
             return {}
 
     def get_one(self, name):
-        self.context.entity_subscribers[self.entity_subscriber_name].wait_ready()
+        with self.context.tracer.span('wait', subscriber=self.entity_subscriber_name):
+            self.context.entity_subscribers[self.entity_subscriber_name].wait_ready()
+
         return copy.deepcopy(self.context.entity_subscribers[self.entity_subscriber_name].query(
             (self.primary_key_name, '=', name), *self.extra_query_params,
             single=True
@@ -1313,19 +1356,23 @@ class TaskBasedSaveMixin(object):
             callback = lambda s, t: post_save(this, s, t)
 
         if new:
-            return self.context.submit_task(
+            return self.context.submit_task_async(
                 self.create_task,
                 *this.get_create_args(),
                 callback=callback)
 
-        return self.context.submit_task(
+        return self.context.submit_task_async(
             self.update_task,
             this.orig_entity[self.save_key_name],
             *this.get_update_args(),
             callback=callback)
 
     def delete(self, this, kwargs):
-        return self.context.submit_task(self.delete_task, this.entity[self.save_key_name], *this.get_delete_args())
+        return self.context.submit_task_async(
+            self.delete_task,
+            this.entity[self.save_key_name],
+            *this.get_delete_args()
+        )
 
 
 class NestedObjectLoadMixin(object):
@@ -39,12 +39,12 @@ import collections
 
 from freenas.utils.permissions import get_unix_permissions, string_to_int
 from freenas.cli import config
-from freenas.utils import first_or_default
+from freenas.utils.query import get
 from freenas.dispatcher import Password
-from threading import Lock, Thread
+from threading import RLock, Event, Lock, local
 
 
-output_lock = Lock()
+output_lock = RLock()
 t = gettext.translation('freenas-cli', fallback=True)
 _ = t.gettext
 
@@ -68,6 +68,8 @@ class ValueType(enum.Enum):
 
 class Object(list):
     class Item(object):
+        __slots__ = ('descr', 'name', 'value', 'vt', 'editable')
+
         def __init__(self, descr, name, value, vt=ValueType.STRING, editable=None):
             self.descr = descr
             self.name = name
@@ -84,14 +86,57 @@ class Object(list):
                 'editable': self.editable
             }
 
+        def __setstate__(self, state):
+            self.descr = state['descr']
+            self.name = state['name']
+            self.value = state['value']
+            self.vt = ValueType[state['vt']]
+            self.editable = state['editable']
+
     def append(self, p_object):
         if not isinstance(p_object, self.Item):
             raise ValueError('Can only add Object.Item instances')
 
         super(Object, self).append(p_object)
+        self.by_name.setdefault(p_object.name, p_object)
+
+    def extend(self, iterable):
+        for i in iterable:
+            self.append(i)
+
+    def insert(self, index, p_object):
+        if not isinstance(p_object, self.Item):
+            raise ValueError('Can only add Object.Item instances')
+
+        super(Object, self).insert(index, p_object)
+        self.reindex()
+
+    def pop(self, index=-1):
+        ret = super(Object, self).pop(index)
+        self.reindex()
+        return ret
+
+    def remove(self, value):
+        super(Object, self).remove(value)
+        self.reindex()
+
+    def reindex(self):
+        self.by_name = {}
+        for i in self:
+            self.by_name.setdefault(i.name, i)
+
+    def get(self, item, default=None):
+        i = self.by_name.get(item)
+        return i.value if i else default
+
+    def __contains__(self, item):
+        if isinstance(item, self.Item):
+            return super(Object, self).__contains__(item)
+
+        return item in self.by_name
 
     def __getitem__(self, item):
-        i = first_or_default(lambda x: x.name == item, self)
+        i = self.by_name.get(item)
         if i:
             return i.value
 
@@ -102,6 +147,14 @@ class Object(list):
             raise ValueError('Can only add Object.Item instances')
 
         super(Object, self).__setitem__(key, value)
+        self.reindex()
+
+    def __delitem__(self, key):
+        super(Object, self).__delitem__(key)
+        self.reindex()
+
+    def __reduce__(self):
+        return self.__class__, tuple(self)
 
     def __getstate__(self):
         return {
@@ -110,6 +163,8 @@ class Object(list):
         }
 
     def __init__(self, *args):
+        super(Object, self).__init__()
+        self.by_name = {}
         for i in args:
             self.append(i)
 
@@ -185,73 +240,94 @@ class Sequence(list):
 
 
 class ProgressBar(object):
+    # Number of progress bars on screen, event messages are held back while there are any.
+    # Bars start and stop on different threads, so it only changes under active_lock
+    active = 0
+    active_lock = Lock()
+
     def __init__(self):
         self.message = None
         self.percentage = 0
-        self.draw_t = Thread(target=self.draw) if sys.stdout.isatty() else Thread(target=self.draw_static)
+        self.tty = sys.stdout.isatty()
+        self.progress_width = 40
+        self.none_fill = self.get_none_fill(''.join('#' if i < 8 else '_' for i in range(self.progress_width)))
+        self.old_message = ''
+        self.handle = None
         self.finished = False
+        self.done = Event()
+        self.loop = config.instance.loop
         sys.stdout.write('\n')
-        self.draw_t.daemon = True
-        self.draw_t.start()
+        self.loop.call_soon(self.start)
 
-    def draw(self):
-        progress_width = 40
-        none_fill = ''.join('#' if i < 8 else '_' for i in range(progress_width))
-
-        def get_none_fill(f):
-            asc = True
-            while True:
-                yield f
-                if asc:
-                    f = f[-1] + f[:-1]
-                    if f[-1] == '#':
-                        asc = False
-                else:
-                    f = f[1:] + f[0]
-                    if f[0] == '#':
-                        asc = True
-
-        generator = get_none_fill(none_fill)
+    @staticmethod
+    def get_none_fill(f):
+        asc = True
         while True:
-            if self.percentage is None:
-                none_fill = next(generator)
-                fill = none_fill
+            yield f
+            if asc:
+                f = f[-1] + f[:-1]
+                if f[-1] == '#':
+                    asc = False
             else:
-                filled_width = int(self.percentage * progress_width)
-                fill = '#' * filled_width + '_' * (progress_width - filled_width)
+                f = f[1:] + f[0]
+                if f[0] == '#':
+                    asc = True
 
-            sys.stdout.write('\033[2K\033[A\033[2K\r')
-            sys.stdout.write('Status: {}\n'.format(self.message))
-            sys.stdout.write('Total task progress: [{}] '.format(fill) +
-                             ('' if self.percentage is None else '{:.2%}'.format(self.percentage)))
+    def start(self):
+        with ProgressBar.active_lock:
+            ProgressBar.active += 1
 
-            sys.stdout.flush()
-            if self.finished:
-                break
-            time.sleep(0.5)
+        self.tick()
 
-    def draw_static(self):
-        old_message = ''
+    def tick(self):
+        # Runs on the event loop, which redraws every progress bar on screen
+        if self.tty:
+            self.draw()
+            self.handle = self.loop.call_later(0.5, self.tick)
+        else:
+            self.draw_static()
+            self.handle = self.loop.call_later(1, self.tick)
 
-        while True:
-            status = ''
-
-            if self.percentage is not None:
-                if self.message:
-                    status = 'Status {}. '.format(self.message)
-                status += 'Progress {:.2%}\n'.format(self.percentage)
-            elif old_message != self.message:
-                old_message = self.message
-                status = 'Status {}\n'.format(self.message)
-
-            if status:
-                sys.stdout.write(status)
-                sys.stdout.flush()
+    def stop(self):
+        self.handle.cancel()
+        if self.tty:
+            self.draw()
+        else:
+            self.draw_static()
+
+        with ProgressBar.active_lock:
+            ProgressBar.active -= 1
+
+        self.done.set()
+
+    def draw(self):
+        if self.percentage is None:
+            fill = next(self.none_fill)
+        else:
+            filled_width = int(self.percentage * self.progress_width)
+            fill = '#' * filled_width + '_' * (self.progress_width - filled_width)
 
-            if self.finished:
-                break
+        sys.stdout.write('\033[2K\033[A\033[2K\r')
+        sys.stdout.write('Status: {}\n'.format(self.message))
+        sys.stdout.write('Total task progress: [{}] '.format(fill) +
+                         ('' if self.percentage is None else '{:.2%}'.format(self.percentage)))
 
-            time.sleep(1)
+        sys.stdout.flush()
+
+    def draw_static(self):
+        status = ''
+
+        if self.percentage is not None:
+            if self.message:
+                status = 'Status {}. '.format(self.message)
+            status += 'Progress {:.2%}\n'.format(self.percentage)
+        elif self.old_message != self.message:
+            self.old_message = self.message
+            status = 'Status {}\n'.format(self.message)
+
+        if status:
+            sys.stdout.write(status)
+            sys.stdout.flush()
 
     def update(self, percentage=None, message=None):
         self.percentage = None if percentage is None else float(percentage / 100.0)
@@ -263,11 +339,159 @@ class ProgressBar(object):
         self.percentage = 1
 
     def end(self):
-        self.finished = True
-        self.draw_t.join()
+        if not self.finished:
+            self.finished = True
+            self.loop.call_soon(self.stop)
+            self.done.wait()
+
         sys.stdout.write('\n')
 
 
+class MultiProgressBar(object):
+    DONE_STATES = ('FINISHED', 'FAILED', 'ABORTED')
+
+    def __init__(self, tasks):
+        self.started_at = time.time()
+        self.tasks = collections.OrderedDict()
+        self.first_seen = {}
+        self.finished_at = {}
+        self.lines = 0
+        self.last_static = None
+        self.tty = sys.stdout.isatty()
+        self.closed = False
+        for i in tasks:
+            self.update(i)
+
+        # Drawn on the caller's thread, but counted like a ProgressBar so that
+        # queued messages do not break its cursor-up redraw
+        with ProgressBar.active_lock:
+            ProgressBar.active += 1
+
+    @staticmethod
+    def percentage(task):
+        if task['state'] == 'FINISHED':
+            return 100.0
+
+        return float(get(task, 'progress.percentage') or 0)
+
+    @staticmethod
+    def format_eta(seconds):
+        if seconds is None:
+            return '--:--:--'
+
+        seconds = int(seconds)
+        return '{0}:{1:02d}:{2:02d}'.format(seconds // 3600, seconds % 3600 // 60, seconds % 60)
+
+    @property
+    def done(self):
+        return all(t['state'] in self.DONE_STATES for t in self.tasks.values())
+
+    @property
+    def pending(self):
+        return [t['id'] for t in self.tasks.values() if t['state'] not in self.DONE_STATES]
+
+    def update(self, task):
+        now = time.time()
+        tid = task['id']
+        self.tasks[tid] = task
+        self.first_seen.setdefault(tid, (now, self.percentage(task)))
+        if task['state'] in self.DONE_STATES:
+            self.finished_at.setdefault(tid, now)
+
+    def task_rate(self, task, now):
+        """
+        Returns (percent per second, seconds left) for a single task,
+        measured since the task was first seen by this progress view.
+        """
+        start, start_percentage = self.first_seen[task['id']]
+        percentage = self.percentage(task)
+        if now <= start or percentage <= start_percentage:
+            return None, None
+
+        rate = (percentage - start_percentage) / (now - start)
+        return rate, (100.0 - percentage) / rate
+
+    def summary(self, now):
+        total = len(self.tasks)
+        finished = len([t for t in self.tasks.values() if t['state'] == 'FINISHED'])
+        failed = len([t for t in self.tasks.values() if t['state'] in ('FAILED', 'ABORTED')])
+        remaining = total - finished - failed
+        elapsed = now - self.started_at
+        throughput = (finished + failed) / elapsed if elapsed > 0 else 0
+        overall = sum(self.percentage(t) for t in self.tasks.values()) / total if total else 100.0
+        eta = remaining / throughput if throughput and remaining else (0 if not remaining else None)
+
+        return _("Tasks: {0}/{1} done, {2} failed, {3:.1f}% overall, {4:.2f} tasks/s, ETA {5}").format(
+            finished + failed, total, failed, overall, throughput, self.format_eta(eta)
+        ), overall
+
+    def render(self):
+        now = time.time()
+        rows, columns = get_terminal_size()
+        progress_width = 40
+        summary, overall = self.summary(now)
+        filled_width = int(overall / 100.0 * progress_width)
+        lines = [
+            summary,
+            'Total progress: [{0}]'.format('#' * filled_width + '_' * (progress_width - filled_width))
+        ]
+
+        running = [t for t in self.tasks.values() if t['state'] not in self.DONE_STATES]
+        max_lines = max(rows - 4, 1)
+        for task in running[:max_lines]:
+            rate, eta = self.task_rate(task, now)
+            lines.append('#{0} {1} {2:5.1f}% {3} ETA {4} {5}'.format(
+                task['id'],
+                task['state'].lower(),
+                self.percentage(task),
+                '{0:.2f}%/s'.format(rate) if rate else '-',
+                self.format_eta(eta),
+                get(task, 'progress.message') or get(task, 'description.message') or task['name']
+            )[:columns - 1])
+
+        if len(running) > max_lines:
+            lines.append(_("... and {0} more running tasks").format(len(running) - max_lines))
+
+        return lines
+
+    def draw(self):
+        lines = self.render()
+        with output_lock:
+            if self.tty:
+                if self.lines:
+                    sys.stdout.write('\033[{0}A'.format(self.lines))
+
+                for i in range(max(self.lines, len(lines))):
+                    sys.stdout.write('\033[2K' + (lines[i] if i < len(lines) else '') + '\n')
+
+                self.lines = max(self.lines, len(lines))
+            elif lines[0] != self.last_static:
+                self.last_static = lines[0]
+                sys.stdout.write(lines[0] + '\n')
+
+            sys.stdout.flush()
+
+    def close(self):
+        with ProgressBar.active_lock:
+            if not self.closed:
+                self.closed = True
+                ProgressBar.active -= 1
+
+    def end(self):
+        try:
+            self.draw()
+            with output_lock:
+                for task in self.tasks.values():
+                    if task['state'] in ('FAILED', 'ABORTED'):
+                        sys.stdout.write('Task #{0} {1}: {2}\n'.format(
+                            task['id'], task['state'].lower(), get(task, 'error.message') or ''
+                        ))
+
+                sys.stdout.flush()
+        finally:
+            self.close()
+
+
 def get_terminal_size(fd=1):
     """
     Returns height and width of current terminal. First tries to get
@@ -430,6 +654,49 @@ def stdout_redirect(where):
         sys.stdout = sys.__stdout__
 
 
+class ThreadStdout(object):
+    """
+    Stands in for sys.stdout while some thread captures what it prints.
+    Writes of a capturing thread go to its buffer, all others pass through.
+    """
+    install_lock = Lock()
+
+    def __init__(self, stream):
+        self.stream = stream
+        self.local = local()
+
+    def __getattr__(self, name):
+        return getattr(self.target, name)
+
+    @property
+    def target(self):
+        return getattr(self.local, 'buffer', None) or self.stream
+
+    def write(self, value):
+        return self.target.write(value)
+
+    def flush(self):
+        return self.target.flush()
+
+
+@contextlib.contextmanager
+def capture_output(buffer):
+    """
+    Collects everything the current thread prints in buffer.
+    """
+    with ThreadStdout.install_lock:
+        if not isinstance(sys.stdout, ThreadStdout):
+            sys.stdout = ThreadStdout(sys.stdout)
+
+        stdout = sys.stdout
+
+    stdout.local.buffer = buffer
+    try:
+        yield buffer
+    finally:
+        stdout.local.buffer = None
+
+
 class StringIO(io.StringIO):
     """
     Decode inputs so we can make it work in py2 and py3.
@@ -493,14 +760,57 @@ def refresh_prompt():
 
 
 def output_msg_locked(msg):
+    output_msgs_locked([msg])
+
+
+def output_msgs_locked(msgs):
     output_lock.acquire()
     config.instance.ml.blank_readline()
-    output_msg(msg)
+    for msg in msgs:
+        output_msg(msg)
+
     sys.stdout.flush()
     config.instance.ml.restore_readline()
     output_lock.release()
 
 
+def coalesce_messages(items, limit=None):
+    """
+    Reduces a batch of queued output items to the messages worth printing.
+    Items are either plain messages or (key, message) tuples; for keyed
+    items only the most recent message per key is kept. If limit is set,
+    at most that many keyed messages are kept, dropping the oldest ones
+    (plain messages are never dropped). Returns (messages, coalesced count, dropped count).
+    """
+    last = {}
+    for idx, item in enumerate(items):
+        if isinstance(item, tuple):
+            last[item[0]] = idx
+
+    kept = [
+        (isinstance(item, tuple), item[1] if isinstance(item, tuple) else item)
+        for idx, item in enumerate(items)
+        if not isinstance(item, tuple) or last[item[0]] == idx
+    ]
+
+    coalesced = len(items) - len(kept)
+    dropped = 0
+    keyed_count = len([i for i in kept if i[0]])
+    if limit and keyed_count > limit:
+        excess = keyed_count - limit
+        result = []
+        for keyed, msg in kept:
+            if keyed and dropped < excess:
+                dropped += 1
+                continue
+
+            result.append((keyed, msg))
+
+        kept = result
+
+    return [msg for __, msg in kept], coalesced, dropped
+
+
 def get_humanized_size(value):
     value = int(value)
     suffixes = [
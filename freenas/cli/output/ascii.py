@@ -33,6 +33,7 @@ import time
 import gettext
 import natural.date
 import math
+import textwrap
 from dateutil.parser import parse
 from texttable import Texttable
 from freenas.cli import config
@@ -179,32 +180,11 @@ class AsciiOutputFormatter(object):
 
     @staticmethod
     def output_object(obj, file=sys.stdout, **kwargs):
-        values = []
-        editable_column = False
-        for item in obj:
-            value ={'name': item.name,
-                    'descr': item.descr,
-                    'value': AsciiOutputFormatter.format_value(item.value, item.vt)}
-
-            if item.editable is not None:
-                value['editable'] = AsciiOutputFormatter.format_value(item.editable, ValueType.BOOLEAN)
-                editable_column = True
-
-            values.append(value)
-
-        cols = []
-        cols.append(Table.Column("Property", 'name'))
-        cols.append(Table.Column("Description", 'descr'))
-        cols.append(Table.Column("Value", 'value'))
-        if editable_column: 
-            cols.append(Table.Column("Settable", 'editable'))
-
-        table = AsciiOutputFormatter.format_table(Table(values, cols))
+        end = '\n' if kwargs.get('newline', True) else ' '
         try:
-            six.print_(table.draw(), file=file, end=('\n' if kwargs.get('newline', True) else ' '))
+            six.print_(AsciiOutputFormatter.format_object(obj), file=file, end=end)
         except UnicodeEncodeError:
-            table = AsciiOutputFormatter.format_table(Table(values, cols), conv2ascii=True)
-            six.print_(table.draw(), file=file, end=('\n' if kwargs.get('newline', True) else ' '))
+            six.print_(AsciiOutputFormatter.format_object(obj, conv2ascii=True), file=file, end=end)
 
     @staticmethod
     def output_tree(tree, children, label, label_vt=ValueType.STRING, file=sys.stdout):
@@ -239,28 +219,70 @@ class AsciiOutputFormatter(object):
         _print_header(tab.columns, file, end, printer=printer)
         _print_rows(tab.data, tab.columns, file, end, printer=printer)
 
-    def format_table(tab, conv2ascii=False):
+    @staticmethod
+    def format_object(obj, conv2ascii=False):
         def _try_conv2ascii(s):
-            return ascii(s) if not _is_ascii(s) and isinstance(s, str) else s
+            return ascii(s) if not _is_ascii(s) else s
 
-        max_width = get_terminal_size()[1]
-        table = Texttable(max_width=max_width)
-        table.set_deco(0)
-        table.header([i.label for i in tab.columns])
+        labels = ['Property', 'Description', 'Value']
+        editable_column = any(item.editable is not None for item in obj)
+        if editable_column:
+            labels.append('Settable')
+
+        rows = []
+        for item in obj:
+            row = [
+                item.name,
+                item.descr,
+                AsciiOutputFormatter.format_value(item.value, item.vt)
+            ]
+
+            if editable_column:
+                row.append(AsciiOutputFormatter.format_value(item.editable, ValueType.BOOLEAN))
+
+            row = ['' if i is None else str(i) for i in row]
+            if conv2ascii:
+                row = [_try_conv2ascii(i) for i in row]
+
+            rows.append(row)
+
+        widths = AsciiOutputFormatter._compute_widths(labels, rows)
+        lines = []
+        for row, header in [(labels, True)] + [(r, False) for r in rows]:
+            wrapped = []
+            for cell, width in zip(row, widths):
+                cell_lines = []
+                for part in cell.split('\n'):
+                    if part.strip() == '':
+                        cell_lines.append('')
+                    else:
+                        cell_lines.extend(textwrap.wrap(part, width))
+
+                wrapped.append(cell_lines)
 
+            for i in range(max(len(c) for c in wrapped)):
+                cells = []
+                for cell_lines, width in zip(wrapped, widths):
+                    text = cell_lines[i] if i < len(cell_lines) else ''
+                    cells.append(text.center(width) if header else text.ljust(width))
+
+                lines.append('   '.join(cells))
+
+        return '\n'.join(lines)
+
+    @staticmethod
+    def _compute_widths(labels, rows):
+        max_width = get_terminal_size()[1]
         widths = []
         ideal_widths = []
-        number_columns = len(tab.columns)
+        number_columns = len(labels)
         remaining_space = max_width
         # set maximum column width based on the amount of terminal space minus the 3 pixel borders
         max_col_width = (remaining_space - number_columns * 3) / number_columns
         for i in range(0, number_columns):
-            current_width = len(tab.columns[i].label)
-            tab_cols_acc = tab.columns[i].accessor
-            if len(tab.data) > 0:
-                max_row_width = max(
-                        [len(str(resolve_cell(row, tab_cols_acc))) for row in tab.data ]
-                        )
+            current_width = len(labels[i])
+            if len(rows) > 0:
+                max_row_width = max([len(row[i]) for row in rows])
                 ideal_widths.insert(i, max_row_width)
                 current_width = max_row_width if max_row_width > current_width else current_width
             if current_width < max_col_width:
@@ -269,7 +291,7 @@ class AsciiOutputFormatter(object):
                 remaining_columns = number_columns - i - 1
                 remaining_space = remaining_space - current_width - 3
                 if remaining_columns != 0:
-                    max_col_width = (remaining_space - remaining_columns * 3)/ remaining_columns
+                    max_col_width = (remaining_space - remaining_columns * 3) / remaining_columns
             else:
                 widths.insert(i, max_col_width)
                 remaining_space = remaining_space - max_col_width - 3
@@ -285,7 +307,21 @@ class AsciiOutputFormatter(object):
                     elif needed_space > remaining_space:
                         widths[i] = widths[i] + remaining_space
                         remaining_space = 0
-        table.set_cols_width(widths)
+
+        return [max(int(w), 1) for w in widths]
+
+    def format_table(tab, conv2ascii=False):
+        def _try_conv2ascii(s):
+            return ascii(s) if not _is_ascii(s) and isinstance(s, str) else s
+
+        max_width = get_terminal_size()[1]
+        table = Texttable(max_width=max_width)
+        table.set_deco(0)
+        table.header([i.label for i in tab.columns])
+        table.set_cols_width(AsciiOutputFormatter._compute_widths(
+            [i.label for i in tab.columns],
+            [[str(resolve_cell(row, i.accessor)) for i in tab.columns] for row in tab.data]
+        ))
 
         table.set_cols_dtype(['t'] * len(tab.columns))
         if conv2ascii:
@@ -132,6 +132,7 @@ AssignmentStatement = ASTObject('AssignmentStatement', 'name', 'expr')
 ConstStatement = ASTObject('ConstStatement', 'name', 'expr')
 ForStatement = ASTObject('ForStatement', 'stmt1', 'expr', 'stmt2', 'body')
 ForInStatement = ASTObject('ForInStatement', 'var', 'expr', 'body')
+ParallelForInStatement = ASTObject('ParallelForInStatement', 'var', 'expr', 'options', 'body')
 WhileStatement = ASTObject('WhileStatement', 'expr', 'body')
 UndefStatement = ASTObject('UndefStatement', 'name')
 AssertStatement = ASTObject('AssertStatement', 'expr', 'msg')
@@ -140,6 +141,7 @@ BreakStatement = ASTObject('BreakStatement')
 FunctionDefinition = ASTObject('FunctionDefinition', 'name', 'args', 'body')
 AnonymousFunction = ASTObject('AnonymousFunction', 'args', 'body')
 Redirection = ASTObject('Redirection', 'body', 'path')
+BackgroundStatement = ASTObject('BackgroundStatement', 'body')
 ShellEscape = ASTObject('ShellEscape', 'args')
 Quote = ASTObject('Quote', 'body')
 
@@ -171,7 +173,8 @@ tokens = list(reserved.values()) + [
     'REGEX', 'UP', 'PIPE', 'LIST', 'COMMA', 'INC', 'DEC', 'PLUS', 'MINUS',
     'MUL', 'DIV', 'EOPEN', 'EOPEN_SYNC', 'COPEN', 'LBRACE', 'RBRACE',
     'LBRACKET', 'RBRACKET', 'NEWLINE', 'SEMICOLON', 'COLON', 'REDIRECT',
-    'MOD', 'SHELL', 'LQUOTE', 'RQUOTE', 'PLUSPLUS', 'MINUSMINUS'
+    'MOD', 'SHELL', 'LQUOTE', 'RQUOTE', 'PLUSPLUS', 'MINUSMINUS', 'AMPERSAND',
+    'PARALLEL'
 ]
 
 
@@ -288,8 +291,15 @@ def t_STRING(t):
     return t
 
 
+parallel_for_re = re.compile(r'[ \t]*for\b')
+
+
 def common_atom_routine(t):
     t.type = reserved.get(t.value, 'ATOM')
+    if t.value == 'parallel' and parallel_for_re.match(t.lexer.lexdata, t.lexer.lexpos):
+        # Only a keyword in front of 'for', so that 'parallel' remains
+        # usable as a command, argument or variable name
+        t.type = 'PARALLEL'
     if t.type == 'TRUE':
         t.value = True
     elif t.type == 'FALSE':
@@ -307,6 +317,17 @@ def t_script_ATOM(t):
     return common_atom_routine(t)
 
 
+def t_INITIAL_JOB_ID(t):
+    r'%[0-9]+'
+    # Background job reference (fg %1). Only valid at the start of a word,
+    # so that a value like 100% is not split into a number and an atom
+    if t.lexpos > 0 and re.match(r'[\w\)\]\}"\']', t.lexer.lexdata[t.lexpos - 1]):
+        raise SyntaxError("Illegal character '%'")
+
+    t.type = 'ATOM'
+    return t
+
+
 def t_INITIAL_ATOM(t):
     r'[\w_\-\+\*\:#\/][\w_\.\/#@\:\-\+\*\/]*'
     return common_atom_routine(t)
@@ -339,6 +360,7 @@ t_LIST = r'\?'
 t_script_COLON = r':'
 t_REDIRECT = r'>>'
 t_SHELL = r'!'
+t_AMPERSAND = r'&'
 
 
 precedence = (
@@ -497,11 +519,25 @@ def p_stmt_redirect_2(p):
     p[0] = Redirection(p[1], p[3], p=p)
 
 
+def p_stmt_redirect_3(p):
+    """
+    stmt_redirect : stmt AMPERSAND
+    stmt_redirect : stmt REDIRECT ATOM AMPERSAND
+    stmt_redirect : stmt REDIRECT STRING AMPERSAND
+    """
+    if len(p) == 3:
+        p[0] = BackgroundStatement(p[1], p=p)
+        return
+
+    p[0] = BackgroundStatement(Redirection(p[1], p[3], p=p), p=p)
+
+
 def p_stmt(p):
     """
     stmt : if_stmt
     stmt : for_stmt
     stmt : for_in_stmt
+    stmt : parallel_for_in_stmt
     stmt : while_stmt
     stmt : assignment_stmt
     stmt : function_definition_stmt
@@ -564,6 +600,42 @@ def p_for_in_stmt_2(p):
     p[0] = ForInStatement((p[3], p[5]), p[7], p[9], p=p)
 
 
+def p_parallel_for_in_stmt_1(p):
+    """
+    parallel_for_in_stmt : PARALLEL FOR LPAREN ATOM IN expr RPAREN block
+    parallel_for_in_stmt : PARALLEL FOR LPAREN ATOM IN expr SEMICOLON parallel_option_list RPAREN block
+    """
+    if len(p) == 9:
+        p[0] = ParallelForInStatement(p[4], p[6], [], p[8], p=p)
+        return
+
+    p[0] = ParallelForInStatement(p[4], p[6], p[8], p[10], p=p)
+
+
+def p_parallel_for_in_stmt_2(p):
+    """
+    parallel_for_in_stmt : PARALLEL FOR LPAREN ATOM COMMA ATOM IN expr RPAREN block
+    parallel_for_in_stmt : PARALLEL FOR LPAREN ATOM COMMA ATOM IN expr SEMICOLON parallel_option_list RPAREN block
+    """
+    if len(p) == 11:
+        p[0] = ParallelForInStatement((p[4], p[6]), p[8], [], p[10], p=p)
+        return
+
+    p[0] = ParallelForInStatement((p[4], p[6]), p[8], p[10], p[12], p=p)
+
+
+def p_parallel_option_list(p):
+    """
+    parallel_option_list : ATOM ASSIGN expr
+    parallel_option_list : ATOM ASSIGN expr COMMA parallel_option_list
+    """
+    if len(p) == 4:
+        p[0] = [BinaryParameter(p[1], p[2], p[3], p=p)]
+        return
+
+    p[0] = [BinaryParameter(p[1], p[2], p[3], p=p)] + p[5]
+
+
 def p_while_stmt(p):
     """
     while_stmt : WHILE LPAREN expr RPAREN block
@@ -1100,6 +1172,9 @@ def parse(s, filename, recover_errors=False):
     lexer.breaknl = False
     lexer.seen_quote = False
     lexer.seen_lparen = False
+    # Nested parentheses can leave states behind, always start in INITIAL
+    del lexer.lexstatestack[:]
+    lexer.begin('INITIAL')
     parser.input = s
     parser.filename = filename
     parser.recover_errors = recover_errors
@@ -1233,6 +1308,16 @@ def unparse(token, indent=0, oneliner=False):
             format_block(token.body)
         ))
 
+    if isinstance(token, ParallelForInStatement):
+        var = ', '.join(token.var) if isinstance(token.var, tuple) else token.var
+        options = ', '.join(unparse(i) for i in token.options)
+        return ind('parallel for ({0} in {1}{2}) {{{3}}}'.format(
+            var,
+            unparse(token.expr),
+            '; ' + options if options else '',
+            format_block(token.body)
+        ))
+
     if isinstance(token, WhileStatement):
         return ind('while ({0}) {{{1}}}'.format(
             unparse(token.expr),
@@ -1255,6 +1340,12 @@ def unparse(token, indent=0, oneliner=False):
             format_block(token.body)
         ))
 
+    if isinstance(token, Redirection):
+        return ind('{0} >> {1}'.format(unparse(token.body, oneliner=True), maybe_quote(token.path)))
+
+    if isinstance(token, BackgroundStatement):
+        return ind('{0} &'.format(unparse(token.body, oneliner=True)))
+
     if isinstance(token, ShellEscape):
         return ind('!{0}'.format(' '.join(unparse(i) for i in token.args)))
 
@@ -0,0 +1,313 @@
+#
+# Copyright 2016 iXsystems, Inc.
+# All rights reserved
+#
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted providing that the following conditions
+# are met:
+# 1. Redistributions of source code must retain the above copyright
+#    notice, this list of conditions and the following disclaimer.
+# 2. Redistributions in binary form must reproduce the above copyright
+#    notice, this list of conditions and the following disclaimer in the
+#    documentation and/or other materials provided with the distribution.
+#
+# THIS SOFTWARE IS PROVIDED BY THE AUTHOR ``AS IS'' AND ANY EXPRESS OR
+# IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE IMPLIED
+# WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE
+# ARE DISCLAIMED.  IN NO EVENT SHALL THE AUTHOR BE LIABLE FOR ANY
+# DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL
+# DAMAGES (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS
+# OR SERVICES; LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION)
+# HOWEVER CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT,
+# STRICT LIABILITY, OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING
+# IN ANY WAY OUT OF THE USE OF THIS SOFTWARE, EVEN IF ADVISED OF THE
+# POSSIBILITY OF SUCH DAMAGE.
+#
+#####################################################################
+
+
+"""
+Recording of dispatcher traffic and its replay without a server.
+
+'cli --record session.rec.gz <URI>' saves RPC calls with their results
+and timing, entity subscriber syncs, entity changes and events of the
+session. 'cli replay:session.rec.gz' replays them. Timing of the recording
+is preserved by default; 'replay:session.rec.gz?speed=0' replays as fast
+as possible and eg. 'speed=10' ten times faster.
+
+Recordings contain all data the session has seen and must be handled
+accordingly; only values of SECRET_KEYS fields are removed.
+"""
+
+import copy
+import gzip
+import time
+import errno
+import threading
+import collections
+from six.moves.urllib.parse import urlparse, parse_qs
+from freenas.dispatcher.rpc import RpcException
+from freenas.dispatcher.jsonenc import dumps, loads
+from freenas.cli.fake import FakeClient, FakeDataset
+
+
+SECRET_KEYS = {'password', 'old_password', 'unixhash', 'nthash', 'lmhash', 'smbhash', 'token', 'secret', 'passphrase'}
+
+
+def redact(value):
+    if isinstance(value, dict):
+        return {k: None if k in SECRET_KEYS else redact(v) for k, v in value.items()}
+
+    if isinstance(value, (list, tuple)):
+        return [redact(i) for i in value]
+
+    return value
+
+
+def call_key(type, method, args):
+    return type, method, dumps(redact(list(args)))
+
+
+class Recorder(object):
+    """
+    Writes records as gzip-compressed JSON lines. Each record carries its
+    type and offset in seconds from the start of recording.
+    """
+
+    def __init__(self, filename):
+        self.file = gzip.open(filename, 'wt')
+        self.lock = threading.Lock()
+        self.started_at = time.time()
+
+    def start(self, uri):
+        """
+        Starts the recording clock, offsets are relative to the connect.
+        """
+        self.started_at = time.time()
+        self.record('connect', uri=uri)
+
+    def record(self, type, **kwargs):
+        kwargs = redact(kwargs)
+        kwargs['type'] = type
+        kwargs['t'] = round(time.time() - self.started_at, 6)
+        try:
+            line = dumps(kwargs)
+        except (TypeError, ValueError):
+            kwargs.pop('result', None)
+            kwargs['unserializable'] = True
+            line = dumps(kwargs)
+
+        with self.lock:
+            if self.file:
+                self.file.write(line + '\n')
+
+    def call(self, type, method, args, started_at, result=None, error=None):
+        params = {'method': method, 'args': list(args), 'duration': round(time.time() - started_at, 6)}
+        if error:
+            params['error'] = {'code': error.code, 'message': error.message}
+        else:
+            params['result'] = result
+
+        self.record(type, **params)
+
+    def attach(self, subscriber, name):
+        """
+        Records the initial sync of an entity subscriber once it's ready,
+        and all the later entity changes.
+        """
+        started_at = time.time()
+
+        def sync():
+            subscriber.wait_ready()
+            items = list(subscriber.items.values())
+            self.record('sync', collection=name, duration=round(time.time() - started_at, 6), items=items)
+
+        subscriber.on_add.add(lambda entity: self.record('entity', collection=name, op='create', entity=entity))
+        subscriber.on_update.add(lambda old, new: self.record('entity', collection=name, op='update', entity=new))
+        subscriber.on_delete.add(lambda entity: self.record('entity', collection=name, op='delete', entity=entity))
+        threading.Thread(target=sync, daemon=True, name='record {0}'.format(name)).start()
+
+    def subscriber_class(self, cls):
+        def create(client, name, *args, **kwargs):
+            if isinstance(client, RecordingClient):
+                client = client.client
+
+            subscriber = cls(client, name, *args, **kwargs)
+            self.attach(subscriber, name)
+            return subscriber
+
+        return create
+
+    def close(self):
+        with self.lock:
+            if self.file:
+                self.file.close()
+                self.file = None
+
+
+class RecordingClient(object):
+    """
+    Wraps a dispatcher client and records calls made through it.
+    """
+
+    def __init__(self, client, recorder):
+        self.client = client
+        self.recorder = recorder
+
+    def __getattr__(self, item):
+        return getattr(self.client, item)
+
+    def connect(self, uri, password=None):
+        self.recorder.start(uri)
+        return self.client.connect(uri, password=password)
+
+    def on_event(self, handler):
+        def record(event, data):
+            self.recorder.record('event', name=event, data=data)
+            handler(event, data)
+
+        self.client.on_event(record)
+
+    def call_sync(self, name, *args, **kwargs):
+        started_at = time.time()
+        try:
+            result = self.client.call_sync(name, *args, **kwargs)
+        except RpcException as err:
+            self.recorder.call('call', name, args, started_at, error=err)
+            raise
+
+        self.recorder.call('call', name, args, started_at, result=result)
+        return result
+
+    def call_async(self, name, callback, *args, **kwargs):
+        started_at = time.time()
+
+        def record(result):
+            if isinstance(result, RpcException):
+                self.recorder.call('call', name, args, started_at, error=result)
+            else:
+                self.recorder.call('call', name, args, started_at, result=result)
+
+            if callback:
+                callback(result)
+
+        return self.client.call_async(name, record, *args, **kwargs)
+
+    def call_task_sync(self, name, *args, **kwargs):
+        started_at = time.time()
+        result = self.client.call_task_sync(name, *args, **kwargs)
+        self.recorder.call('task', name, args, started_at, result=result)
+        return result
+
+
+class ReplayClient(FakeClient):
+    """
+    Answers calls with recorded results, serves recorded collections to
+    entity subscribers and plays back entity changes and events at their
+    recorded offsets. Queries which weren't recorded are served from the
+    recorded collections, other calls fall back to FakeClient.
+    """
+
+    def __init__(self):
+        super(ReplayClient, self).__init__()
+        self.speed = 1.0
+        self.calls = collections.defaultdict(collections.deque)
+        self.syncs = {}
+        self.timeline = []
+        self.replay_thread = None
+
+    def connect(self, uri, password=None):
+        parsed = urlparse(uri)
+        params = parse_qs(parsed.query)
+        self.speed = float(params['speed'][-1]) if 'speed' in params else 1.0
+        self.dataset = FakeDataset(generate=False)
+        self.load(parsed.path)
+        self.opened = True
+        self.replay_thread = threading.Thread(target=self.replay, daemon=True, name='replay')
+        self.replay_thread.start()
+
+    def load(self, filename):
+        with gzip.open(filename, 'rt') as f:
+            for line in f:
+                record = loads(line)
+                type = record['type']
+                if type in ('call', 'task'):
+                    self.calls[call_key(type, record['method'], record['args'])].append(record)
+                elif type == 'sync':
+                    self.syncs[record['collection']] = record
+                    for i in record['items']:
+                        self.dataset.add(record['collection'], i)
+                elif type in ('entity', 'event'):
+                    self.timeline.append(record)
+
+        # Changes which happened before the initial sync are already included in it
+        self.timeline = [
+            i for i in self.timeline
+            if i['type'] == 'event' or i['t'] >= self.syncs.get(i['collection'], {}).get('t', 0)
+        ]
+        self.timeline.sort(key=lambda i: i['t'])
+
+    def delay(self, seconds):
+        if self.speed > 0 and seconds > 0:
+            time.sleep(seconds / self.speed)
+
+    def sync_delay(self, name):
+        sync = self.syncs.get(name)
+        return sync['duration'] / self.speed if sync and self.speed > 0 else 0
+
+    def replay(self):
+        started_at = time.time()
+        for i in self.timeline:
+            if self.speed > 0:
+                self.delay(i['t'] - (time.time() - started_at) * self.speed)
+
+            if i['type'] == 'event':
+                if self.event_handler:
+                    self.event_handler(i['name'], i['data'])
+                continue
+
+            self.apply(i['collection'], i['op'], i['entity'])
+
+    def apply(self, name, op, entity):
+        with self.lock:
+            items = self.dataset.collections[name]
+            old = items.get(entity['id'])
+            if op == 'delete':
+                if old is not None:
+                    del items[entity['id']]
+                    self.emit(name, 'delete', old, None)
+
+                return
+
+            items[entity['id']] = entity
+            self.emit(name, 'update' if old else 'create', old, entity)
+
+    def recorded(self, type, name, args):
+        responses = self.calls.get(call_key(type, name, args))
+        if not responses:
+            return None
+
+        # The last recorded response answers all the repeated calls
+        record = responses.popleft() if len(responses) > 1 else responses[0]
+        self.delay(record['duration'])
+        if 'error' in record:
+            raise RpcException(record['error']['code'], record['error']['message'])
+
+        if record.get('unserializable'):
+            raise RpcException(errno.ENOENT, 'Result of {0} was not recorded'.format(name))
+
+        return record
+
+    def call_sync(self, name, *args, **kwargs):
+        record = self.recorded('call', name, args)
+        if record:
+            return copy.deepcopy(record['result'])
+
+        return super(ReplayClient, self).call_sync(name, *args, **kwargs)
+
+    def call_task_sync(self, name, *args):
+        record = self.recorded('task', name, args)
+        if record:
+            return copy.deepcopy(record['result'])
+
+        return super(ReplayClient, self).call_task_sync(name, *args)
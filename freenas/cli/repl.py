@@ -42,19 +42,34 @@ import gettext
 import getpass
 import traceback
 import threading
+import asyncio
 import six
 import paramiko
 import inspect
 import re
 import contextlib
+import functools
+import atexit
+import weakref
 import rollbar
 from six.moves.urllib.parse import urlparse
 from socket import gaierror as socket_error
 from freenas.cli.output import Table
 from freenas.cli.descriptions import events
-from freenas.cli.utils import SIGTSTPException, SIGTSTP_setter, errors_by_path, quote, flatten_table
+from freenas.cli.utils import (
+    SIGTSTPException, SIGTSTP_setter, errors_by_path, quote, flatten_table, JobPromise, SubmitPromise,
+    TaskGroup
+)
 from freenas.cli import functions
 from freenas.cli import config
+from freenas.cli.history import HistoryStore
+from freenas.cli.fake import FakeClient, FakeEntitySubscriber
+from freenas.cli.recording import Recorder, RecordingClient, ReplayClient
+from freenas.cli.complete import NullComplete, CompletionCache, CompletionIndexCache
+from freenas.cli.instrumentation import RpcStats, ScriptProfiler, Tracer, CallRecord, StartupProfiler
+from freenas.cli.scheduler import Scheduler
+from freenas.cli.eventloop import EventLoop, LoopQueue
+from freenas.cli.fleet import Fleet
 from freenas.cli.namespace import (
     Namespace, EntityNamespace, RootNamespace, SingleItemNamespace, ConfigNamespace, Command,
     FilteringCommand, PipeCommand, CommandException
@@ -64,11 +79,11 @@ from freenas.cli.parser import (
     IfStatement, ForStatement, ForInStatement, WhileStatement, FunctionCall, CommandCall, Subscript,
     ExpressionExpansion, CommandExpansion, SyncCommandExpansion, FunctionDefinition, ReturnStatement,
     BreakStatement, UndefStatement, AssertStatement, Redirection, AnonymousFunction, ShellEscape,
-    Parentheses, ConstStatement, Quote
+    Parentheses, ConstStatement, Quote, ParallelForInStatement, BackgroundStatement
 )
 from freenas.cli.output import (
-    ValueType, ProgressBar, output_lock, output_msg, read_value, format_value,
-    format_output, output_msg_locked
+    ValueType, ProgressBar, MultiProgressBar, output_lock, output_msg, read_value, format_value,
+    format_output, output_msgs_locked, coalesce_messages, capture_output, StringIO
 )
 from freenas.dispatcher.client import Client, ClientError
 from freenas.dispatcher.entity import EntitySubscriber
@@ -83,7 +98,9 @@ from freenas.cli.commands import (
     SelectPipeCommand, FindPipeCommand, LoginCommand, DumpCommand, WhoamiCommand, PendingCommand,
     WaitCommand, OlderThanPipeCommand, NewerThanPipeCommand, IndexCommand, AliasCommand,
     UnaliasCommand, ListVarsCommand, AttachDebuggerCommand,
-    WCommand, TimeCommand, RemoteCommand, BuiltinCommand
+    WCommand, TimeCommand, RemoteCommand, BuiltinCommand, RpcStatsCommand,
+    ProfileCommand, JobsCommand, FgCommand, FlushCommand, BeginCommand, CommitCommand,
+    RollbackCommand, ApplyPipeCommand, IntervalsCommand
 )
 from freenas.cli.docgen import CliDocGen
 
@@ -187,18 +204,61 @@ def sort_args(args):
     return positional, kwargs, opargs
 
 
+@functools.lru_cache(maxsize=256)
+def compile_wildcard(pattern):
+    """
+    Compiles a wildcard pattern and extracts the literal prefix every
+    matching value has to start with.
+    """
+    regex = re.compile(pattern)
+    if '|' in pattern:
+        return regex, ''
+
+    prefix = []
+    i = 1 if pattern.startswith('^') else 0
+    while i < len(pattern):
+        c = pattern[i]
+        if c == '\\' and i + 1 < len(pattern) and not pattern[i + 1].isalnum():
+            c = pattern[i + 1]
+            i += 2
+        elif c in '\\.^$*+?{}[]()':
+            break
+        else:
+            i += 1
+
+        quantifier = pattern[i] if i < len(pattern) else None
+        if quantifier in ('*', '?', '{'):
+            break
+
+        prefix.append(c)
+        if quantifier == '+':
+            break
+
+    return regex, ''.join(prefix)
+
+
+def iterate_wildcard(context, pattern, completion):
+    regex, prefix = compile_wildcard(pattern)
+    if completion.indexed:
+        candidates, count = completion.matches(context, None, prefix)
+    else:
+        candidates = (i for i in completion.choices(context, None) if i.startswith(prefix))
+
+    for i in candidates:
+        if regex.match(i):
+            yield i
+
+
 def expand_wildcards(context, args, kwargs, opargs, completions):
     def expand_one(value, completion):
-        choices = completion.choices(context, None)
-        regex = re.compile(value)
-        return list(filter(regex.match, choices))
+        return list(iterate_wildcard(context, value, completion))
 
     for i in completions:
         if not getattr(i, 'list', None):
             continue
 
         if isinstance(i.name, six.integer_types):
-            if not len(args) >= i.name or not isinstance(kwargs[name], six.string_types):
+            if not len(args) > i.name or not isinstance(args[i.name], six.string_types):
                 continue
 
             args[i.name] = expand_one(args[i.name], i)
@@ -270,11 +330,23 @@ class VariableStore(object):
             'prompt': self.Variable('{jobs_short}{host}:{path}>', ValueType.STRING),
             'timeout': self.Variable(10, ValueType.NUMBER),
             'tasks_blocking': self.Variable(False, ValueType.BOOLEAN),
+            'submit_window': self.Variable(0, ValueType.NUMBER),
+            'autocommit': self.Variable(True, ValueType.BOOLEAN),
             'show_events': self.Variable(True, ValueType.BOOLEAN),
             'debug': self.Variable(False, ValueType.BOOLEAN),
             'abort_on_errors': self.Variable(False, ValueType.BOOLEAN),
+            'parallel_max': self.Variable(4, ValueType.NUMBER),
+            'apply_max': self.Variable(16, ValueType.NUMBER),
             'output': self.Variable(None, ValueType.STRING),
             'verbosity': self.Variable(1, ValueType.NUMBER),
+            'output_rate': self.Variable(5, ValueType.NUMBER),
+            'output_batch_size': self.Variable(50, ValueType.NUMBER),
+            'complete_cache_ttl': self.Variable(30, ValueType.NUMBER),
+            'complete_prefetch': self.Variable(True, ValueType.BOOLEAN),
+            'complete_limit': self.Variable(100, ValueType.NUMBER),
+            'rpc_stats': self.Variable(False, ValueType.BOOLEAN),
+            'profile': self.Variable(False, ValueType.BOOLEAN),
+            'trace_file': self.Variable(None, ValueType.STRING),
             'rollbar_enabled': self.Variable(True, ValueType.BOOLEAN),
             'vm.console_interrupt': self.Variable(r'\035', ValueType.STRING),
             'cli_src_path': self.Variable(
@@ -288,11 +360,23 @@ class VariableStore(object):
             'prompt': _('Console prompt.'),
             'timeout': _('Console timeout period in minutes.'),
             'tasks_blocking': _('Toggle tasks blocking console output. Can be set to yes or no.'),
+            'submit_window': _('Maximum number of task submissions sent without waiting for their task ids. Set to 0 to submit tasks one at a time.'),
+            'autocommit': _('Can be set to yes or no. When set to no, changes made with set and edit are saved by the commit command, one update per entity.'),
             'show_events': _('Toggle displaying of events. Can be set to yes or no.'),
             'debug': _('Toggle display of debug messages. Can be set to yes or no.'),
             'abort_on_errors': _('Can be set to yes or no. When set to yes, command execution will abort on command errors.'),
+            'parallel_max': _('Default number of loop bodies a parallel for loop runs at the same time.'),
+            'apply_max': _('Maximum number of tasks the apply pipe command runs at the same time.'),
             'output': _('Either send all output to specified file or set to \'none\' to display output on the console.'),
             'verbosity': _('Increasing verbosity of event messages. Can be set from 1 to 5.'),
+            'output_rate': _('Maximum number of times per second event messages are printed. Set to 0 for no limit.'),
+            'output_batch_size': _('Maximum number of task status messages printed at once. Set to 0 for no limit.'),
+            'complete_cache_ttl': _('Number of seconds tab completion results are cached for. Set to 0 to disable caching.'),
+            'complete_prefetch': _('Toggle fetching tab completions for the current namespace in the background after changing namespace. Can be set to yes or no.'),
+            'complete_limit': _('Maximum number of tab completion matches displayed. Set to 0 for no limit.'),
+            'rpc_stats': _('Toggle collecting statistics of middleware calls, shown by the rpcstats command. Can be set to yes or no.'),
+            'profile': _('Toggle collecting per statement and per function execution times, shown by the profile command. Can be set to yes or no.'),
+            'trace_file': _('File to which a JSON line with timings of each command is appended. Set to \'none\' to disable tracing.'),
             'rollbar_enabled': _('Toggle rollbar error reporting. Can be set to yes or no.'),
             'vm.console_interrupt': _(r'Set the console interrupt key sequence for virtual machines with support for octal characters of the form \nnn. Default is ^] or octal 035.'),
             'cli_src_path': _('The absolute path of the cli source code on this machine')
@@ -362,16 +446,24 @@ class VariableStore(object):
 
 
 class Context(object):
-    def __init__(self):
+    # Plugins are imported and initialized one context at a time
+    plugin_lock = threading.Lock()
+
+    def __init__(self, loop=None):
         self.docgen_run = False
         self.uri = None
         self.parsed_uri = None
         self.hostname = None
         self.connection = Client()
+        self.entity_subscriber_class = EntitySubscriber
+        self.recorder = None
         self.ml = None
         self.logger = logging.getLogger('cli')
         self.plugin_dirs = []
         self.task_callbacks = {}
+        self.submit_cv = threading.Condition()
+        self.submit_in_flight = 0
+        self.transaction = None
         self.plugins = {}
         self.reverse_task_mappings = {}
         self.variables = VariableStore()
@@ -379,24 +471,35 @@ class Context(object):
         self.event_masks = ['*']
         self.event_divert = False
         self.event_queue = six.moves.queue.Queue()
-        self.output_queue = six.moves.queue.Queue()
+        self.loop = loop or EventLoop()
+        self.output_queue = LoopQueue(self.loop)
+        self.output_stats = {'coalesced': 0, 'dropped': 0}
         self.keepalive_timer = None
         self.argparse_parser = None
         self.entity_subscribers = {}
-        self.call_stack = [CallStackEntry('<stdin>', [], '<stdin>', 1, 1)]
+        self.thread_state = threading.local()
         self.builtin_operators = functions.operators
         self.builtin_functions = functions.functions
         self.global_env = Environment(self)
         self.user = None
         self.pending_tasks = {}
+        self.session_tasks = {}
+        self.session_jobs = set()
+        self.background_jobs = collections.OrderedDict()
+        self.background_job_id = 0
+        self.scheduler = Scheduler(self.loop, self.run_scheduled_job, self.scheduled_job_failed)
         self.session_id = None
         self.user_commands = []
+        self.completion_cache = CompletionCache()
+        self.completion_indexes = CompletionIndexCache()
+        self.rpc_stats = RpcStats()
+        self.profiler = ScriptProfiler(self.variables)
+        self.tracer = Tracer(self)
+        self.startup = StartupProfiler()
+        self.history = None
         self.local_connection = False
         config.instance = self
-
-        self.output_thread = threading.Thread(target=self.output_thread)
-        self.output_thread.daemon = True
-        self.output_thread.start()
+        self.output_future = self.loop.submit(self.output_task())
 
     @property
     def is_interactive(self):
@@ -404,14 +507,78 @@ class Context(object):
 
     @property
     def pending_jobs(self):
-        return len(list(filter(
-            lambda t: t['parent'] is None and t['session'] == self.session_id,
-            self.pending_tasks.values()
-        )))
+        return len(self.session_jobs)
+
+    @property
+    def call_stack(self):
+        if not hasattr(self.thread_state, 'call_stack'):
+            self.thread_state.call_stack = [CallStackEntry('<stdin>', [], '<stdin>', 1, 1)]
+
+        return self.thread_state.call_stack
+
+    @call_stack.setter
+    def call_stack(self, value):
+        self.thread_state.call_stack = value
+
+    @property
+    def task_groups(self):
+        # Open task groups only collect tasks submitted by their own thread
+        if not hasattr(self.thread_state, 'task_groups'):
+            self.thread_state.task_groups = weakref.WeakSet()
+
+        return self.thread_state.task_groups
+
+    @property
+    def pipe_cwd(self):
+        return getattr(self.thread_state, 'pipe_cwd', None)
+
+    @pipe_cwd.setter
+    def pipe_cwd(self, value):
+        self.thread_state.pipe_cwd = value
+
+    @property
+    def in_worker(self):
+        return getattr(self.thread_state, 'worker', False)
+
+    @property
+    def tasks_blocking(self):
+        return self.variables.get('tasks_blocking') and not getattr(self.thread_state, 'nonblocking', False)
+
+    @contextlib.contextmanager
+    def nonblocking_tasks(self):
+        """
+        Submits tasks without waiting for them, regardless of tasks_blocking.
+        """
+        self.thread_state.nonblocking = True
+        try:
+            yield
+        finally:
+            self.thread_state.nonblocking = False
+
+    def track_pending_task(self, task):
+        """
+        Keeps pending_tasks and the per-session task indexes up to date,
+        so that the prompt and 'pending' don't need to filter all tasks.
+        """
+        tid = task['id']
+        if task['state'] in ('FINISHED', 'FAILED', 'ABORTED'):
+            self.pending_tasks.pop(tid, None)
+            self.session_tasks.pop(tid, None)
+            self.session_jobs.discard(tid)
+            return
+
+        self.pending_tasks[tid] = task
+        if task['session'] == self.session_id:
+            self.session_tasks[tid] = task
+            if task['parent'] is None:
+                self.session_jobs.add(tid)
 
     def start(self, password=None):
-        self.discover_plugins()
-        self.connect(password) if not self.docgen_run else None
+        with self.startup.phase('discover_plugins'):
+            self.discover_plugins()
+
+        with self.startup.phase('connect'):
+            self.connect(password) if not self.docgen_run else None
 
     def start_entity_subscribers(self):
         for i in ENTITY_SUBSCRIBERS:
@@ -419,37 +586,44 @@ class Context(object):
                 self.entity_subscribers[i].stop()
                 del self.entity_subscribers[i]
 
-            e = EntitySubscriber(self.connection, i)
+            e = self.entity_subscriber_class(self.connection, i)
+            self.startup.subscriber_started(i)
+            e.on_add.add(lambda entity, name=i: self.completion_cache.invalidate(name))
+            e.on_update.add(lambda old, new, name=i: self.completion_cache.invalidate(name))
+            e.on_delete.add(lambda entity, name=i: self.completion_cache.invalidate(name))
             e.start()
             self.entity_subscribers[i] = e
 
+        self.completion_cache.invalidate()
+
+        self.pending_tasks = {}
+        self.session_tasks = {}
+        self.session_jobs = set()
+
         def update_task(task, old_task=None):
-            self.pending_tasks[task['id']] = task
+            self.track_pending_task(task)
             descr = task['name']
 
             if task['description']:
                 descr = task['description']['message']
 
-            if task['state'] in ('FINISHED', 'FAILED', 'ABORTED'):
-                del self.pending_tasks[task['id']]
-
             if self.variables.get('verbosity') > 1 and task['state'] in ('CREATED', 'FINISHED'):
-                self.output_queue.put(_(
+                self.output_queue.put((task['id'], _(
                     "Task #{0}: {1}: {2}".format(
                         task['id'],
                         descr,
                         task['state'].lower(),
                     )
-                ))
+                )))
 
             if self.variables.get('verbosity') > 2 and task['state'] == 'WAITING':
-                self.output_queue.put(_(
+                self.output_queue.put((task['id'], _(
                     "Task #{0}: {1}: {2}".format(
                         task['id'],
                         descr,
                         task['state'].lower(),
                     )
-                ))
+                )))
 
             if task['state'] == 'FAILED':
                 if self.variables.get('verbosity') > 0 and (not task['parent'] or self.variables.get('verbosity') > 1):
@@ -481,13 +655,27 @@ class Context(object):
         self.entity_subscribers['task'].on_update.add(lambda o, n: update_task(n, o))
 
     def wait_entity_subscribers(self):
-        for i in self.entity_subscribers.values():
-            i.wait_ready()
+        with self.tracer.span('wait', subscriber='*'):
+            for name, i in list(self.entity_subscribers.items()):
+                i.wait_ready()
+                self.startup.subscriber_ready(name, len(i.items))
 
     def connect(self, password=None):
+        if self.parsed_uri.scheme == 'fake':
+            self.connection = FakeClient()
+            self.entity_subscriber_class = FakeEntitySubscriber
+
+        if self.parsed_uri.scheme == 'replay':
+            self.connection = ReplayClient()
+            self.entity_subscriber_class = FakeEntitySubscriber
+
+        if self.recorder:
+            self.connection = RecordingClient(self.connection, self.recorder)
+            self.entity_subscriber_class = self.recorder.subscriber_class(self.entity_subscriber_class)
+
         try:
             self.connection.connect(self.uri, password=password)
-        except (socket_error, OSError) as err:
+        except (socket_error, OSError, ValueError) as err:
             output_msg(_(
                 "Could not connect to host: {0} due to error: {1}".format(
                     self.parsed_uri.hostname or '<local>', err
@@ -504,20 +692,56 @@ class Context(object):
 
     def login(self, user, password):
         try:
-            self.connection.login_user(user, password)
-            self.connection.subscribe_events(*EVENT_MASKS)
-            self.connection.on_event(self.handle_event)
-            self.connection.on_error(self.connection_error)
-            self.connection.call_sync('management.enable_features', ['streaming_responses'])
-            self.session_id = self.call_sync('session.get_my_session_id')
+            with self.startup.phase('login'):
+                self.connection.login_user(user, password)
+                self.connection.subscribe_events(*EVENT_MASKS)
+                self.connection.on_event(self.handle_event)
+                self.connection.on_error(self.connection_error)
+                self.connection.call_sync('management.enable_features', ['streaming_responses'])
+                self.session_id = self.call_sync('session.get_my_session_id')
         except RpcException as e:
             if e.code == errno.EACCES:
                 self.connection.disconnect()
                 output_msg(_("Wrong username or password"))
                 sys.exit(1)
 
-        self.start_entity_subscribers()
-        self.login_plugins()
+        with self.startup.phase('start_entity_subscribers'):
+            self.start_entity_subscribers()
+
+        with self.startup.phase('login_plugins'):
+            self.login_plugins()
+
+    def set_uri(self, uri):
+        """
+        Points the context at a host given on the command line. A URI
+        without a scheme is a websocket one.
+        """
+        self.uri = uri
+        self.parsed_uri = parse_uri(uri)
+        if self.parsed_uri.scheme == 'ws':
+            self.uri = self.parsed_uri.hostname
+
+        self.hostname = self.parsed_uri.hostname or 'localhost'
+        self.local_connection = is_local_uri(self.parsed_uri)
+
+    def set_user(self, username):
+        self.user = username
+        if self.parsed_uri.scheme == 'ssh' and self.parsed_uri.username is None:
+            self.uri = 'ssh://{0}@{1}'.format(username, self.parsed_uri.hostname)
+            if self.parsed_uri.port is not None:
+                self.uri = "{0}:{1}".format(self.uri, self.parsed_uri.port)
+            self.parsed_uri = urlparse(self.uri)
+
+    def login_session(self, password):
+        """
+        Logs in as the current local user on a local connection, otherwise
+        as the user given to set_user().
+        """
+        if self.local_connection:
+            self.user = getpass.getuser()
+            self.login(self.user, '')
+        else:
+            self.login(self.user, password)
 
     def keepalive(self):
         if self.connection.opened:
@@ -549,9 +773,10 @@ class Context(object):
             self.plugin_dirs += [plug_dirs]
 
     def discover_plugins(self):
-        for dir in self.plugin_dirs:
-            self.logger.debug(_("Searching for plugins in %s"), dir)
-            self.__discover_plugin_dir(dir)
+        with self.plugin_lock:
+            for dir in self.plugin_dirs:
+                self.logger.debug(_("Searching for plugins in %s"), dir)
+                self.__discover_plugin_dir(dir)
 
     def login_plugins(self):
         for i in list(self.plugins.values()):
@@ -569,9 +794,13 @@ class Context(object):
         self.logger.debug(_("Loading plugin from %s"), path)
         name, ext = os.path.splitext(os.path.basename(path))
         try:
+            started_at = time.time()
             plugin = load_module_from_file(name, path)
+            self.startup.plugin(name, 'import', time.time() - started_at)
             if hasattr(plugin, '_init'):
+                started_at = time.time()
                 plugin._init(self)
+                self.startup.plugin(name, 'init', time.time() - started_at)
                 self.plugins[path] = plugin
         except Exception:
             if self.variables.get('rollbar_enabled'):
@@ -739,33 +968,104 @@ class Context(object):
                     msg
                 )))
 
-    def output_thread(self):
+    async def output_task(self):
+        last_draw = 0
         while True:
-            item = self.output_queue.get()
-            output_msg_locked(item)
+            batch = [await self.output_queue.get()]
+            rate = self.variables.get('output_rate')
+            deadline = last_draw + (1.0 / rate if rate and rate > 0 else 0)
+
+            # Collect whatever arrives until the next redraw is allowed
+            while True:
+                timeout = deadline - time.time()
+                try:
+                    if timeout > 0:
+                        batch.append(await asyncio.wait_for(self.output_queue.get(), timeout))
+                    else:
+                        batch.append(self.output_queue.get_nowait())
+                except (asyncio.TimeoutError, asyncio.QueueEmpty):
+                    break
+
+            messages, coalesced, dropped = coalesce_messages(batch, self.variables.get('output_batch_size'))
+            self.output_stats['coalesced'] += coalesced
+            self.output_stats['dropped'] += dropped
+            if dropped:
+                messages.append(_("({0} task status messages not shown, {1} merged)".format(dropped, coalesced)))
+            elif coalesced and self.variables.get('verbosity') > 2:
+                messages.append(_("({0} task status messages merged)".format(coalesced)))
+
+            # A progress bar redraws the lines above it, messages wait until it is gone.
+            # Never block on output_lock here, it would stall everything else on the loop
+            while ProgressBar.active or not output_lock.acquire(blocking=False):
+                await asyncio.sleep(0.05)
+
+            try:
+                config.bind(self)
+                output_msgs_locked(messages)
+            finally:
+                output_lock.release()
+
+            last_draw = time.time()
 
     def handle_task_callback(self, data):
         if data['state'] in ('FINISHED', 'CANCELLED', 'ABORTED', 'FAILED'):
-            cb = self.task_callbacks.pop(data['id'])
-            cb(data['state'], data)
+            cb = self.task_callbacks.pop(data['id'], None)
+            if cb:
+                cb(data['state'], data)
 
     def print_event(self, event, data):
         if self.event_divert:
             self.event_queue.put((event, data))
             return
 
+        self.loop.call_soon(self.translate_event, event, data)
+
+    def translate_event(self, event, data):
+        # The loop may be shared by several contexts
+        config.bind(self)
         translation = events.translate(self, event, data)
         if translation:
             self.output_queue.put(translation)
 
+    @contextlib.contextmanager
+    def instrumented_call(self, span, method, args):
+        """
+        Accounts a middleware call in the script profiler, the command
+        trace and, when enabled, in RPC statistics.
+        """
+        self.profiler.rpc_calls += 1
+        with self.tracer.span(span, method=method):
+            if self.variables.get('rpc_stats'):
+                with self.rpc_stats.measure(method, args) as call:
+                    yield call
+            else:
+                yield CallRecord()
+
     def call_sync(self, name, *args, **kwargs):
-        return self.connection.call_sync(name, *args, **kwargs) if not self.docgen_run else {}
+        if self.docgen_run:
+            return {}
+
+        with self.instrumented_call('rpc', name, args) as call:
+            call.result = self.connection.call_sync(name, *args, **kwargs)
+
+        return call.result
 
     def call_async(self, name, callback, *args, **kwargs):
-        return self.connection.call_async(name, callback, *args, **kwargs) if not self.docgen_run else None
+        if self.docgen_run:
+            return None
+
+        self.profiler.rpc_calls += 1
+        if self.variables.get('rpc_stats'):
+            callback = self.rpc_stats.wrap_callback(name, callback, args)
+
+        with self.tracer.span('rpc_async', method=name):
+            return self.connection.call_async(name, callback, *args, **kwargs)
 
     def call_task_sync(self, name, *args, **kwargs):
-        return self.connection.call_task_sync(name, *args)
+        with self.instrumented_call('task', 'task:{0}'.format(name), args) as call:
+            call.result = self.connection.call_task_sync(name, *args)
+
+        return call.result
 
     def submit_task_common_routine(self, name, callback, *args):
         """
@@ -774,11 +1074,76 @@ class Context(object):
         below.
         It returns the id of the task.
         """
-        tid = self.connection.call_sync('task.submit', name, args)
+        with self.instrumented_call('task_submit', 'task.submit:{0}'.format(name), args) as call:
+            call.result = tid = self.connection.call_sync('task.submit', name, args)
+
+        self.register_task(tid, callback)
+        return tid
+
+    def register_task(self, tid, callback=None, groups=None):
         if callback:
             self.task_callbacks[tid] = callback
+
+            # The task may have ended before its id got back to us
+            subscriber = self.entity_subscribers.get('task')
+            task = subscriber.items.get(tid) if subscriber else None
+            if task:
+                self.handle_task_callback(task)
+
+        for group in list(self.task_groups if groups is None else groups):
+            group.add(tid)
+
         self.global_env['_last_task_id'] = Environment.Variable(tid)
-        return tid
+
+    def submit_task_async(self, name, *args, **kwargs):
+        """
+        Submits a task without waiting for the task.submit round trip and
+        returns a SubmitPromise of its id. At most submit_window submissions
+        are in flight at once. When submit_window is 0 or tasks are blocking
+        this is the same as submit_task().
+        """
+        callback = kwargs.pop('callback', None)
+        window = self.variables.get('submit_window')
+        if not window or self.tasks_blocking or self.docgen_run:
+            return self.submit_task(name, *args, callback=callback)
+
+        promise = SubmitPromise(name)
+        groups = list(self.task_groups)
+
+        def done(result):
+            try:
+                if isinstance(result, BaseException):
+                    promise.fail(result)
+                    self.output_queue.put(_("Task {0} could not be submitted: {1}".format(name, result)))
+                else:
+                    self.register_task(result, callback, groups)
+                    promise.resolve(result)
+            finally:
+                with self.submit_cv:
+                    self.submit_in_flight -= 1
+                    self.submit_cv.notify_all()
+
+        with self.submit_cv:
+            self.submit_cv.wait_for(lambda: self.submit_in_flight < window)
+            self.submit_in_flight += 1
+
+        try:
+            self.call_async('task.submit', done, name, args)
+        except BaseException:
+            with self.submit_cv:
+                self.submit_in_flight -= 1
+                self.submit_cv.notify_all()
+
+            raise
+
+        return promise
+
+    def flush_tasks(self, timeout=None):
+        """
+        Waits until every pipelined task submission got its task id back.
+        """
+        with self.submit_cv:
+            return self.submit_cv.wait_for(lambda: self.submit_in_flight == 0, timeout)
 
     def wait_for_task_with_progress(self, tid):
         def update(progress, task):
@@ -843,12 +1208,266 @@ class Context(object):
             if generator:
                 del generator
 
+    def wait_for_tasks_with_progress(self, tids):
+        subscriber = self.entity_subscribers['task']
+        changed = threading.Event()
+        progress = None
+        tasks = []
+
+        for tid in tids:
+            task = subscriber.get(tid, timeout=5)
+            if not task:
+                output_msg(_("Task {0} not found".format(tid)))
+                continue
+
+            tasks.append(task)
+
+        if not tasks:
+            return _("No tasks to wait for")
+
+        def on_update(old, new):
+            if progress and new['id'] in progress.tasks:
+                progress.update(new)
+                changed.set()
+
+        try:
+            SIGTSTP_setter(set_flag=True)
+            output_msg(_("Hit Ctrl+C to terminate all {0} tasks if needed".format(len(tasks))))
+            output_msg(_("To background running tasks press 'Ctrl+Z'"))
+
+            progress = MultiProgressBar(tasks)
+            subscriber.on_update.add(on_update)
+
+            # Pick up anything that changed before the callback was registered
+            for tid in progress.pending:
+                task = subscriber.items.get(tid)
+                if task:
+                    progress.update(task)
+
+            while not progress.done:
+                progress.draw()
+                changed.wait(0.5)
+                changed.clear()
+                time.sleep(0.1)
+        except KeyboardInterrupt:
+            pending = progress.pending if progress else [t['id'] for t in tasks]
+            six.print_()
+            output_msg(_("User requested termination. Abort signal sent to {0} tasks".format(len(pending))))
+            for tid in pending:
+                self.call_sync('task.abort', tid)
+        except SIGTSTPException:
+            pending = progress.pending if progress else [t['id'] for t in tasks]
+            if progress:
+                progress.close()
+                progress = None
+
+            six.print_()
+            output_msg(_("Tasks will continue to run in the background."))
+            output_msg(_("To bring them back to the foreground execute 'wait {0}'".format(
+                ' '.join(str(i) for i in pending)
+            )))
+        finally:
+            SIGTSTP_setter(set_flag=False)
+            subscriber.on_update.discard(on_update)
+            if progress:
+                progress.end()
+
+    def wait_for_task(self, tid):
+        """
+        Waits for a task without drawing progress or installing signal
+        handlers, so that it can be used off the main thread.
+        """
+        subscriber = self.entity_subscribers['task']
+        changed = threading.Event()
+
+        def on_update(old, new):
+            if new['id'] == tid:
+                changed.set()
+
+        subscriber.on_update.add(on_update)
+        try:
+            task = subscriber.get(tid, timeout=5)
+            if not task:
+                return _("Task {0} not found".format(tid))
+
+            while task['state'] not in ('FINISHED', 'FAILED', 'ABORTED', 'CANCELLED'):
+                changed.wait(0.5)
+                changed.clear()
+                task = subscriber.items.get(tid, task)
+
+            if task['state'] != 'FINISHED':
+                return _("The task with id: {0} ended in {1} state".format(tid, task['state']))
+        finally:
+            subscriber.on_update.discard(on_update)
+
+    def start_job(self, token, env):
+        """
+        Evaluates a statement on a worker thread and returns a promise of its
+        result. The statement gets its own scope, like a parallel for body.
+        """
+        self.background_job_id += 1
+        job = JobPromise(self, self.background_job_id, unparse(token, oneliner=True))
+        self.background_jobs[job.id] = job
+        call_stack = [CallStackEntry('<job %{0}>'.format(job.id), [], '<stdin>', 1, 1)]
+
+        def worker():
+            config.bind(self)
+            self.thread_state.worker = True
+            self.call_stack = call_stack
+            try:
+                result = flatten_table(self.ml.eval(token, env=Environment(self, outer=env), first=True))
+            except BaseException as err:
+                job.finish(error=str(err) or type(err).__name__)
+                self.output_queue.put(_("[{0}] Failed: {1}: {2}".format(job.id, job.description, job.error)))
+                return
+
+            job.finish(result)
+            self.output_queue.put(_("[{0}] Done: {1}".format(job.id, job.description)))
+
+        t = threading.Thread(target=worker)
+        t.daemon = True
+        t.start()
+        self.global_env['_last_job_id'] = Environment.Variable(job.id)
+        return job
+
+    def run_scheduled_job(self, job):
+        """
+        Runs a setinterval/settimeout function on a scheduler worker. Its
+        output is collected while it runs and written under output_lock
+        afterwards, like event messages.
+        """
+        config.bind(self)
+        self.thread_state.worker = True
+        self.call_stack = [CallStackEntry('<interval #{0}>'.format(job.id), [], '<stdin>', 1, 1)]
+        buffer = StringIO()
+        try:
+            with capture_output(buffer):
+                job.fn(self.global_env)
+        finally:
+            text = buffer.getvalue()
+            if text:
+                # Like queued messages, wait until no progress bar is on screen
+                while ProgressBar.active or not output_lock.acquire(blocking=False):
+                    time.sleep(0.05)
+
+                try:
+                    self.ml.blank_readline()
+                    sys.stdout.write(text)
+                    sys.stdout.flush()
+                    self.ml.restore_readline()
+                finally:
+                    output_lock.release()
+
+    def scheduled_job_failed(self, job, err):
+        self.output_queue.put(_("Interval job #{0} ({1}) failed: {2}".format(job.id, job.name, job.last_error)))
+
+    def find_job(self, name):
+        """
+        Looks up a background job by its '%<n>' or plain numeric id.
+        """
+        try:
+            return self.background_jobs[int(str(name).lstrip('%'))]
+        except (KeyError, ValueError):
+            raise CommandException(_("Job {0} not found".format(name)))
+
+    def begin_transaction(self):
+        if self.transaction:
+            raise CommandException(_("A transaction is already in progress, use commit or rollback to end it"))
+
+        self.transaction = collections.OrderedDict()
+
+    def pending_change(self, ns):
+        if not self.transaction:
+            return None
+
+        key = ns.transaction_key()
+        return self.transaction.get(key) if key is not None else None
+
+    def defer_save(self, ns):
+        """
+        Records changes of an entity namespace until commit, when a
+        transaction is in progress or autocommit is off. Returns False
+        if the namespace should be saved right away instead.
+        """
+        key = ns.transaction_key()
+        if key is None:
+            return False
+
+        if self.transaction is None:
+            if self.variables.get('autocommit'):
+                return False
+
+            self.transaction = collections.OrderedDict()
+
+        pending = self.transaction.get(key)
+        if pending and ns.orig_entity is not pending['orig_entity']:
+            # Namespace was loaded without the earlier changes, carry them over
+            diff = ns.get_diff()
+            ns.entity = copy.deepcopy(pending['entity'])
+            ns.entity.update(diff)
+            ns.orig_entity = pending['orig_entity']
+
+        self.transaction[key] = {
+            'ns': ns,
+            'entity': copy.deepcopy(ns.entity),
+            'orig_entity': ns.orig_entity,
+            'update_args': copy.deepcopy(getattr(ns, 'update_args', None))
+        }
+
+        return True
+
+    def commit_transaction(self):
+        """
+        Submits one update per entity changed since the transaction began,
+        all of them before waiting for any, and returns their outcome.
+        """
+        pending = list((self.transaction or {}).items())
+        self.transaction = None
+        if not pending:
+            return None
+
+        group = TaskGroup(self)
+        done = 0
+        try:
+            with self.nonblocking_tasks():
+                for key, change in pending:
+                    ns = change['ns']
+                    ns.entity = change['entity']
+                    ns.orig_entity = change['orig_entity']
+                    if change['update_args'] is not None:
+                        ns.update_args = change['update_args']
+
+                    try:
+                        ns.save()
+                    except Exception as err:
+                        output_msg(_("Cannot save {0}: {1}".format(ns.get_name(), err)))
+
+                    done += 1
+        except BaseException:
+            # Interrupted, keep the changes not submitted yet for another commit
+            self.transaction = collections.OrderedDict(pending[done:])
+            raise
+        finally:
+            group.close()
+
+        return group.wait()
+
+    def rollback_transaction(self):
+        count = len(self.transaction or {})
+        self.transaction = None
+        return count
+
     def submit_task(self, name, *args, **kwargs):
         callback = kwargs.pop('callback', None)
         tid = self.submit_task_common_routine(name, callback, *args)
 
-        if self.variables.get('tasks_blocking'):
-            error_msgs = self.wait_for_task_with_progress(tid)
+        if self.tasks_blocking:
+            with self.tracer.span('wait', tasks=[tid]):
+                if self.in_worker:
+                    error_msgs = self.wait_for_task(tid)
+                else:
+                    error_msgs = self.wait_for_task_with_progress(tid)
+
             if error_msgs:
                 output_msg(error_msgs)
 
@@ -977,7 +1596,8 @@ class MainLoop(object):
         'more': MorePipeCommand,
         'less': MorePipeCommand,
         'older_than': OlderThanPipeCommand,
-        'newer_than': NewerThanPipeCommand
+        'newer_than': NewerThanPipeCommand,
+        'apply': ApplyPipeCommand
     }
     base_builtin_commands = {
         '?': IndexCommand,
@@ -1000,6 +1620,13 @@ class MainLoop(object):
         'echo': EchoCommand,
         'whoami': WhoamiCommand,
         'pending': PendingCommand,
+        'jobs': JobsCommand,
+        'intervals': IntervalsCommand,
+        'fg': FgCommand,
+        'flush': FlushCommand,
+        'begin': BeginCommand,
+        'commit': CommitCommand,
+        'rollback': RollbackCommand,
         'wait': WaitCommand,
         'alias': AliasCommand,
         'unalias': UnaliasCommand,
@@ -1007,6 +1634,8 @@ class MainLoop(object):
         'attach_debugger': AttachDebuggerCommand,
         'w': WCommand,
         'time': TimeCommand,
+        'rpcstats': RpcStatsCommand,
+        'profile': ProfileCommand,
         'remote': RemoteCommand,
         'builtin': BuiltinCommand
     }
@@ -1023,6 +1652,17 @@ class MainLoop(object):
         self.aliases = {}
         self.connection = None
         self.saved_state = None
+        self.saved_count = 0
+        self.interactive = False
+        self.busy = False
+
+    @property
+    def start_from_root(self):
+        return getattr(self.context.thread_state, 'start_from_root', False)
+
+    @start_from_root.setter
+    def start_from_root(self, value):
+        self.context.thread_state.start_from_root = value
 
     def __get_prompt(self):
         variables = collections.defaultdict(lambda: '', {
@@ -1103,9 +1743,12 @@ class MainLoop(object):
         return line
 
     def repl(self):
+        self.interactive = True
         readline.parse_and_bind('tab: complete')
         readline.set_completer(self.complete)
         readline.set_completer_delims(' \t\n`~!@#$%^&*()=+[{]}\\|;\',<>?')
+        if hasattr(readline, 'set_completion_display_matches_hook'):
+            readline.set_completion_display_matches_hook(self.display_matches)
 
         self.greet()
         a = ShowUrlsCommand()
@@ -1125,9 +1768,11 @@ class MainLoop(object):
                 output_msg(_('User terminated command'))
                 continue
 
-            output_lock.acquire()
-            self.process(line)
-            output_lock.release()
+            self.busy = True
+            try:
+                self.process(line)
+            finally:
+                self.busy = False
 
     def find_in_scope(self, token, **kwargs):
         cwd = kwargs.pop('cwd', self.cwd)
@@ -1176,9 +1821,15 @@ class MainLoop(object):
         if env is None:
             env = self.context.global_env
 
+        profiler = self.context.profiler
+        result = None
         for stmt in block:
             try:
-                self.eval(stmt, env=env, first=True)
+                if profiler.active:
+                    with profiler.statement(stmt):
+                        result = self.eval(stmt, env=env, first=True)
+                else:
+                    result = self.eval(stmt, env=env, first=True)
             except SystemExit:
                 raise
             except FlowControlInstruction:
@@ -1187,8 +1838,133 @@ class MainLoop(object):
                 if self.context.variables.get('abort_on_errors'):
                     raise e
 
+                errors = getattr(self.context.thread_state, 'errors', None)
+                if errors is not None:
+                    errors.append(e)
+
                 continue
 
+        return result
+
+    def eval_parallel_for(self, token, env):
+        options = {'max': self.context.variables.get('parallel_max'), 'ordered': True}
+        for opt in token.options:
+            if opt.left not in options:
+                raise SyntaxError(_("Invalid parallel for option: {0}".format(opt.left)))
+
+            options[opt.left] = self.eval(opt.right, env=env)
+
+        try:
+            workers = int(options['max'])
+        except (TypeError, ValueError):
+            raise CommandException(_("Invalid value of max: {0}".format(options['max'])))
+
+        if workers < 1:
+            raise CommandException(_("Invalid value of max: {0}".format(workers)))
+
+        expr = self.eval(token.expr, env=env)
+        if isinstance(token.var, tuple) and isinstance(expr, dict):
+            expr = expr.items()
+
+        abort = self.context.variables.get('abort_on_errors')
+        call_stack = self.context.call_stack[:]
+        task_groups = list(self.context.task_groups)
+        queue = six.moves.queue.Queue(maxsize=workers)
+        stop = threading.Event()
+        lock = threading.Lock()
+        threads = []
+        results = []
+        errors = []
+
+        def run(index, item):
+            local_env = Environment(self.context, outer=env)
+            if isinstance(token.var, tuple):
+                local_env[token.var[0]], local_env[token.var[1]] = item
+            else:
+                local_env[token.var] = item
+
+            self.context.thread_state.errors = []
+            try:
+                result = self.eval_block(token.body, local_env, True)
+            except FlowControlInstruction as f:
+                if f.type == FlowControlInstructionType.BREAK:
+                    stop.set()
+                    return
+
+                raise CommandException(_("return cannot be used inside a parallel for loop"))
+
+            with lock:
+                results.append((index, result))
+                errors.extend((index, e) for e in self.context.thread_state.errors)
+
+        def worker():
+            config.bind(self.context)
+            self.context.thread_state.worker = True
+            self.context.call_stack = call_stack[:]
+            self.context.thread_state.task_groups = weakref.WeakSet(task_groups)
+            while True:
+                job = queue.get()
+                if job is None:
+                    return
+
+                if stop.is_set():
+                    continue
+
+                index, item = job
+                try:
+                    run(index, item)
+                except BaseException as e:
+                    with lock:
+                        errors.append((index, e))
+
+                    if abort:
+                        stop.set()
+
+        interrupted = False
+        try:
+            for index, item in enumerate(expr):
+                if stop.is_set():
+                    break
+
+                if len(threads) < workers:
+                    t = threading.Thread(target=worker)
+                    t.daemon = True
+                    t.start()
+                    threads.append(t)
+
+                queue.put((index, item))
+        except KeyboardInterrupt:
+            interrupted = True
+            stop.set()
+        finally:
+            for t in threads:
+                queue.put(None)
+
+            # Bodies already running are left to finish, queued ones are skipped
+            for t in threads:
+                while t.is_alive():
+                    try:
+                        t.join(0.1)
+                    except KeyboardInterrupt:
+                        interrupted = True
+                        stop.set()
+
+        if interrupted:
+            raise KeyboardInterrupt()
+
+        if options['ordered']:
+            results.sort(key=lambda r: r[0])
+
+        errors.sort(key=lambda e: e[0])
+        env['_results'] = Environment.Variable([r for i, r in results])
+        env['_errors'] = Environment.Variable([{'index': i, 'error': str(e)} for i, e in errors])
+
+        if errors and abort:
+            raise CommandException(_("{0} iteration(s) of parallel for failed:\n{1}".format(
+                len(errors),
+                '\n'.join('  [{0}] {1}'.format(i, e) for i, e in errors)
+            )))
+
     def get_cwd(self, path):
         if not path:
             return self.cwd
@@ -1362,6 +2138,13 @@ class MainLoop(object):
 
                 return
 
+            if isinstance(token, BackgroundStatement):
+                return self.context.start_job(token.body, env)
+
+            if isinstance(token, ParallelForInStatement):
+                self.eval_parallel_for(token, env)
+                return
+
             if isinstance(token, WhileStatement):
                 while True:
                     expr = self.eval(token.expr, env=env)
@@ -1427,6 +2210,11 @@ class MainLoop(object):
 
                 try:
                     if len(token.args) == 0:
+                        if self.context.in_worker:
+                            raise CommandException(_(
+                                "Namespace navigation is not allowed in parallel for loops and background jobs"
+                            ))
+
                         if path[0] == self.context.root_ns:
                             self.path = self.root_path[:]
                             path.pop(0)
@@ -1437,6 +2225,7 @@ class MainLoop(object):
                             else:
                                 self.cd(i)
 
+                        self.prefetch_completions()
                         return
 
                     top = token.args.pop(0)
@@ -1466,7 +2255,8 @@ class MainLoop(object):
                     if isinstance(top, Literal):
                         top = Symbol(top.value)
 
-                    item = self.eval(top, env=env, path=path, dry_run=dry_run)
+                    with self.context.tracer.span('resolve', name=str(getattr(top, 'name', top))):
+                        item = self.eval(top, env=env, path=path, dry_run=dry_run)
 
                     if isinstance(item, Namespace):
                         item.on_enter()
@@ -1508,9 +2298,11 @@ class MainLoop(object):
                                     if 'params' in ret:
                                         serialize_filter['params'].update(ret['params'])
 
-                            return item.run(self.context, args, kwargs, opargs, input=input_data)
+                            with self.context.rpc_stats.command_scope(self.command_label(path, top)):
+                                return item.run(self.context, args, kwargs, opargs, input=input_data)
                         else:
-                            return item.run(self.context, args, kwargs, opargs)
+                            with self.context.rpc_stats.command_scope(self.command_label(path, top)):
+                                return item.run(self.context, args, kwargs, opargs)
 
                 except BaseException as err:
                     success = False
@@ -1534,7 +2326,12 @@ class MainLoop(object):
                         CallStackEntry(func.name, args, token.file, token.line, token.column)
                     )
 
-                    result = func(env, *args)
+                    if self.context.profiler.active and isinstance(func, Function):
+                        with self.context.profiler.function(func):
+                            result = func(env, *args)
+                    else:
+                        result = func(env, *args)
+
                     self.context.call_stack.pop()
                     return result
 
@@ -1602,11 +2399,8 @@ class MainLoop(object):
     def process(self, line):
         def add_line_to_history(line):
             readline.add_history(line)
-            try:
-                with open(os.path.expanduser('~/.cli_history'), 'a') as history_file:
-                    history_file.write('\n' + line)
-            except IOError:
-                pass
+            if self.context.history is not None:
+                self.context.history.append(line, self.path_string)
 
         if len(line) == 0:
             return
@@ -1615,11 +2409,15 @@ class MainLoop(object):
             prev = self.prev_path[:]
             self.prev_path = self.path[:]
             self.path = prev
+            self.prefetch_completions()
             return
 
+        tracer = self.context.tracer
+        tracer.begin(line)
         try:
             try:
-                tokens = parse(line, '<stdin>')
+                with tracer.span('parse'):
+                    tokens = parse(line, '<stdin>')
             except KeyboardInterrupt:
                 return
             except SyntaxError:
@@ -1632,14 +2430,20 @@ class MainLoop(object):
             # Unparse AST to string and add to readline history and history file
             line = '; '.join(unparse(t, oneliner=True) for t in tokens)
             add_line_to_history(line)
+            tracer.set_command(line)
 
             for i in tokens:
                 try:
                     self.context.call_stack = []
-                    ret = self.eval(i, first=True, printable_none=True)
+                    if self.context.profiler.active:
+                        with self.context.profiler.statement(i):
+                            ret = self.eval(i, first=True, printable_none=True)
+                    else:
+                        ret = self.eval(i, first=True, printable_none=True)
                 except SystemExit as err:
                     raise err
                 except BaseException as err:
+                    tracer.fail(err)
                     output_msg('Error: {0}'.format(str(err)))
                     if len(self.context.call_stack) > 1:
                         output_msg('Call stack: ')
@@ -1654,11 +2458,12 @@ class MainLoop(object):
 
                 if ret is not None:
                     output = self.context.variables.get('output')
-                    if output:
-                        with open(output, 'a+') as f:
-                            format_output(ret, file=f)
-                    else:
-                        format_output(ret)
+                    with tracer.span('render'), output_lock:
+                        if output:
+                            with open(output, 'a+') as f:
+                                format_output(ret, file=f)
+                        else:
+                            format_output(ret)
         except SyntaxError as e:
             output_msg(_('Syntax error: {0}'.format(str(e))))
             return 1
@@ -1690,9 +2495,26 @@ class MainLoop(object):
                 output_msg(error_trace)
 
             return 1
+        finally:
+            tracer.end()
 
         return 0
 
+    def command_label(self, path, top):
+        names = []
+        if not path or path[0] is not self.context.root_ns:
+            names = [str(i.get_name()) for i in self.path[1:]]
+
+        for i in path:
+            if isinstance(i, six.string_types):
+                if i == '..' and names:
+                    names.pop()
+            elif i is not self.context.root_ns:
+                names.append(str(i.get_name()))
+
+        names.append(top.name if isinstance(top, Symbol) else str(top))
+        return ' '.join(names)
+
     def get_relative_object(self, ns, tokens):
         path = self.path[:]
         ptr = ns
@@ -1774,61 +2596,99 @@ class MainLoop(object):
                         args = token.args
 
                 if isinstance(token, CommandCall) or not args:
+                    last = args[-1] if args else None
                     obj = self.get_relative_object(self.cwd, args)
                 else:
                     return None
 
+                # A fully typed name under the cursor may itself have been resolved
+                # (eg. a child namespace), so it must be a part of the cache key
+                text_resolved = last is not None and last not in args and last.column >= readline.get_begidx()
+
+                cache = self.context.completion_cache
+                ttl = self.context.variables.get('complete_cache_ttl')
+
                 if issubclass(type(obj), Namespace):
-                    choices = [quote(i.get_name()) for i in obj.namespaces()]
-                    choices += obj.commands().keys()
-                    choices += ['..', '/', '-']
+                    key = self.completion_key(readline_buffer[:readline.get_begidx()])
+                    if text_resolved:
+                        key += (text,)
 
-                    if type(obj) is RootNamespace:
-                        choices += builtin_command_set
-                    else:
-                        choices += ['help']
+                    choices = cache.get(key)
+                    if choices is None:
+                        choices = self.namespace_choices(obj, builtin_command_set)
+                        cache.put(key, choices, [getattr(obj, 'entity_subscriber_name', None)], ttl)
 
                     if text.startswith('/') and isinstance(obj, RootNamespace):
                         choices = ['/' + i for i in choices]
 
                     append_space = True
                 elif issubclass(type(obj), Command):
-                    c_args = []
-                    c_kwargs = {}
-                    c_opargs = []
-
-                    with contextlib.suppress(BaseException):
-                        token_args = convert_to_literals(copy.deepcopy(token).args)
-
-                        if len(token_args) > 0 and token_args[0] == '..':
-                            args = [token_args[0]]
-                        else:
-                            c_args, c_kwargs, c_opargs = expand_wildcards(
-                                self.context,
-                                *sort_args([self.eval(i) for i in token_args]),
-                                completions=obj.complete(self.context, text=text)
-                            )
-
-                    completions = obj.complete(self.context, text=text, args=c_args, kwargs=c_kwargs, opargs=c_opargs)
-                    choices = [c.name for c in completions if isinstance(c.name, six.string_types)]
-
                     arg = find_arg(args, readline.get_begidx())
                     if arg is False:
                         return None
-                    elif isinstance(arg, six.integer_types):
-                        completion = first_or_default(lambda c: c.name == arg, completions)
-                        if completion:
-                            choices = completion.choices(self.context, None)
-                    elif isinstance(arg, BinaryParameter):
-                        completion = first_or_default(lambda c: c.name == arg.left + '=', completions)
-                        if completion:
-                            choices = completion.choices(self.context, arg)
+
+                    if isinstance(arg, BinaryParameter):
+                        key = self.completion_key(readline_buffer[:arg.column], arg.left + '=')
                     else:
-                        raise AssertionError('Unknown arg returned by find_arg()')
+                        key = self.completion_key(readline_buffer[:readline.get_begidx()], arg)
+
+                    if text_resolved or getattr(obj, 'complete_uses_text', False):
+                        key += (text,)
+
+                    choices = cache.get(key)
+                    if choices is None:
+                        c_args = []
+                        c_kwargs = {}
+                        c_opargs = []
+
+                        with contextlib.suppress(BaseException):
+                            token_args = convert_to_literals(copy.deepcopy(token).args)
+
+                            if len(token_args) > 0 and token_args[0] == '..':
+                                args = [token_args[0]]
+                            else:
+                                c_args, c_kwargs, c_opargs = expand_wildcards(
+                                    self.context,
+                                    *sort_args([self.eval(i) for i in token_args]),
+                                    completions=obj.complete(self.context, text=text)
+                                )
+
+                        completions = obj.complete(self.context, text=text, args=c_args, kwargs=c_kwargs, opargs=c_opargs)
+                        choices = [c.name for c in completions if isinstance(c.name, six.string_types)]
+                        sources = []
+
+                        arg = find_arg(args, readline.get_begidx())
+                        if arg is False:
+                            return None
+                        elif isinstance(arg, six.integer_types):
+                            completion = first_or_default(lambda c: c.name == arg, completions)
+                            if completion:
+                                choices = completion if completion.indexed else completion.choices(self.context, None)
+                                sources = [] if completion.indexed else completion.sources()
+                        elif isinstance(arg, BinaryParameter):
+                            completion = first_or_default(lambda c: c.name == arg.left + '=', completions)
+                            if completion:
+                                choices = completion if completion.indexed else completion.choices(self.context, arg)
+                                sources = [] if completion.indexed else completion.sources()
+                        else:
+                            raise AssertionError('Unknown arg returned by find_arg()')
+
+                        cache.put(key, choices, sources, ttl)
                 else:
                     choices = []
 
-                options = [i + (' ' if append_space else '') for i in choices if i.startswith(text)]
+                limit = self.context.variables.get('complete_limit')
+                if isinstance(choices, NullComplete):
+                    # Indexed completer, only the first matches are materialized
+                    token_arg = arg if isinstance(arg, BinaryParameter) else None
+                    matches, self.saved_count = choices.matches(self.context, token_arg, text, limit)
+                else:
+                    matches = [i for i in choices if i.startswith(text)]
+                    self.saved_count = len(matches)
+                    if limit:
+                        matches = matches[:limit]
+
+                options = [i + (' ' if append_space else '') for i in matches]
                 self.saved_state = options
 
                 if options:
@@ -1844,10 +2704,89 @@ class MainLoop(object):
                 else:
                     return None
 
+    def completion_key(self, prefix, slot=None, path_string=None):
+        if path_string is None:
+            path_string = self.path_string
+
+        return path_string, ' '.join(prefix.split()), slot
+
+    def namespace_choices(self, ns, builtin_command_set):
+        choices = [quote(i.get_name()) for i in ns.namespaces()]
+        choices += ns.commands().keys()
+        choices += ['..', '/', '-']
+
+        if type(ns) is RootNamespace:
+            choices += builtin_command_set
+        else:
+            choices += ['help']
+
+        return choices
+
+    def prefetch_completions(self):
+        if not self.interactive or not self.context.variables.get('complete_prefetch'):
+            return
+
+        cache = self.context.completion_cache
+        ttl = self.context.variables.get('complete_cache_ttl')
+        cwd = self.cwd
+        path_string = self.path_string
+        builtin_command_set = list(self.base_builtin_commands.keys())
+
+        def prefetch():
+            with contextlib.suppress(BaseException):
+                cache.put(
+                    self.completion_key('', None, path_string),
+                    self.namespace_choices(cwd, builtin_command_set),
+                    [getattr(cwd, 'entity_subscriber_name', None)],
+                    ttl
+                )
+
+                for name, cmd in cwd.commands().items():
+                    if self.cwd is not cwd:
+                        # User has moved on in the meantime
+                        return
+
+                    with contextlib.suppress(BaseException):
+                        completions = cmd.complete(self.context, text='', args=[], kwargs={}, opargs=[])
+                        names = [c.name for c in completions if isinstance(c.name, six.string_types)]
+                        if not first_or_default(lambda c: c.name == 0, completions):
+                            cache.put(self.completion_key(name, 0, path_string), names, None, ttl)
+
+                        for c in completions:
+                            if c.name == 0 or isinstance(c.name, six.string_types) and c.name.endswith('='):
+                                key = self.completion_key(name, c.name, path_string)
+                                if c.indexed:
+                                    c.get_index(self.context)
+                                    cache.put(key, c, None, ttl)
+                                else:
+                                    cache.put(key, c.choices(self.context, None), c.sources(), ttl)
+
+        threading.Thread(target=prefetch, daemon=True, name='completion prefetch').start()
+
+    def display_matches(self, substitution, matches, longest_match_length):
+        cols = get_terminal_size((80, 20)).columns or 80
+        width = longest_match_length + 2
+        per_line = max(1, cols // width)
+
+        sys.stdout.write('\n')
+        for i in range(0, len(matches), per_line):
+            sys.stdout.write(''.join(m.ljust(width) for m in matches[i:i + per_line]).rstrip() + '\n')
+
+        if self.saved_count > len(matches):
+            sys.stdout.write(_('... and {0} more, type more characters to narrow down the list\n').format(
+                self.saved_count - len(matches)
+            ))
+
+        self.restore_readline()
+
     def sigint(self):
         pass
 
     def blank_readline(self):
+        # Only a prompt waiting for input needs to be moved out of the way
+        if not self.interactive or self.busy:
+            return
+
         cols = get_terminal_size((80, 20)).columns
         text_len = len(readline.get_line_buffer()) + 2
         sys.stdout.write('\x1b[2K')
@@ -1856,11 +2795,128 @@ class MainLoop(object):
         sys.stdout.flush()
 
     def restore_readline(self):
+        if not self.interactive or self.busy:
+            return
+
         sys.stdout.write(self.__get_prompt() + readline.get_line_buffer().rstrip())
         sys.stdout.flush()
 
 
+def output_startup_profile(startup, text, filename):
+    if text:
+        output_msg(_("Startup took {0:.3f} seconds".format(startup.total)))
+        for i in startup.tables():
+            format_output(i)
+
+    if filename:
+        data = json.dumps(startup.__getstate__(), indent=4)
+        if filename == '-':
+            six.print_(data)
+            return
+
+        with open(filename, 'w') as f:
+            f.write(data)
+
+
+def parse_uri(uri):
+    parsed_uri = urlparse(uri)
+    if parsed_uri.scheme == '':
+        parsed_uri = urlparse("ws://" + uri)
+
+    return parsed_uri
+
+
+def is_local_uri(parsed_uri):
+    return (
+        parsed_uri.scheme in ('unix', 'fake', 'replay') or
+        parsed_uri.netloc in ('localhost', '127.0.0.1', None)
+    )
+
+
+def run_fleet(args):
+    """
+    Runs the -e or -f script against every host listed in the -H file.
+    """
+    if not args.e and not args.f:
+        sys.stderr.write('Fleet mode needs a script to run, use -e or -f\n')
+        return 1
+
+    if args.record or args.profile_startup or args.profile_startup_json:
+        sys.stderr.write('--record and --profile-startup cannot be used with -H\n')
+        return 1
+
+    try:
+        with open(args.H) as f:
+            uris = list(Fleet.read_hosts(f))
+
+        if not uris:
+            sys.stderr.write('No hosts listed in {0}\n'.format(args.H))
+            return 1
+
+        if args.e:
+            script = args.e
+        else:
+            with (sys.stdin if args.f == '-' else open(args.f)) as f:
+                script = f.read()
+    except EnvironmentError as e:
+        sys.stderr.write('Cannot open input file: {0}\n'.format(str(e)))
+        return 1
+
+    try:
+        ast = parse(script, args.f or '<stdin>')
+    except SyntaxError as e:
+        sys.stderr.write(_('Syntax error: {0}\n'.format(str(e))))
+        return 1
+
+    username = None
+    password = args.p
+    remote = [i for i in map(parse_uri, uris) if not is_local_uri(i)]
+    if remote:
+        if any(i.username is None for i in remote):
+            username = six.moves.input('Please provide a username: ')
+
+        if password is None:
+            password = getpass.getpass('Please provide a password: ')
+
+    def setup(context, uri):
+        context.set_uri(uri)
+        if not context.local_connection:
+            context.set_user(context.parsed_uri.username or username)
+
+        context.read_middleware_config_file(args.m)
+        context.variables.load(args.c)
+        context.start(None if context.local_connection else password)
+        context.ml = MainLoop(context)
+        context.login_session(password)
+        context.wait_entity_subscribers()
+        for i in args.D or []:
+            name, value = i.split('=')
+            context.global_env[name] = value
+
+    def connect(uri):
+        context = Context(loop)
+        config.bind(context)
+        try:
+            setup(context, uri)
+        except BaseException:
+            context.output_future.cancel()
+            raise
+
+        return context
+
+    # Hosts share a single event loop
+    loop = EventLoop()
+    try:
+        fleet = Fleet(uris, connect, args.fleet_max, args.fleet_aggregate)
+        format_output(fleet.run(ast))
+    finally:
+        loop.stop()
+
+    return 1 if fleet.failed else 0
+
+
 def main(argv=None):
+    started_at = time.time()
     if not argv:
         argv = sys.argv[1:]
 
@@ -1904,57 +2960,51 @@ def main(argv=None):
     parser.add_argument('-f', metavar='INPUT')
     parser.add_argument('-p', metavar='PASSWORD')
     parser.add_argument('-D', metavar='DEFINE', action='append')
+    parser.add_argument('--record', metavar='FILE', help='Record dispatcher traffic of the session to FILE')
+    parser.add_argument('--profile-startup', action='store_true', help='Print time spent in each phase of startup')
+    parser.add_argument('--profile-startup-json', metavar='FILE', help='Save startup profile as JSON to FILE (- for stdout)')
+    parser.add_argument('-H', metavar='HOSTS', help='Run the -e or -f script against every host URI listed in HOSTS, one per line')
+    parser.add_argument('--fleet-max', metavar='N', type=int, default=8, help='Maximum number of hosts connected at the same time with -H')
+    parser.add_argument('--fleet-aggregate', action='store_true', help='Merge tables of all hosts into one with -H')
     args = parser.parse_args(argv)
 
+    if args.H:
+        sys.exit(run_fleet(args))
+
     context = Context()
     context.argparse_parser = parser
     context.docgen_run = args.makedocs
+    if args.profile_startup or args.profile_startup_json:
+        context.startup.start(started_at)
 
     if not context.docgen_run and os.environ.get('FREENAS_SYSTEM') != 'YES' and args.uri == 'unix:':
         args.uri = six.moves.input('Please provide FreeNAS IP: ')
 
-    context.uri = args.uri
-    context.parsed_uri = urlparse(args.uri)
-    if context.parsed_uri.scheme == '':
-        context.parsed_uri = urlparse("ws://" + args.uri)
-    if context.parsed_uri.scheme == 'ws':
-        context.uri = context.parsed_uri.hostname
-    username = None
-    if context.parsed_uri.hostname is None:
-        context.hostname = 'localhost'
-    else:
-        context.hostname = context.parsed_uri.hostname
-    if (
-        not context.docgen_run and
-        context.parsed_uri.scheme != 'unix' and
-        context.parsed_uri.netloc not in ('localhost', '127.0.0.1', None)
-    ):
-        if context.parsed_uri.username is None:
-            username = six.moves.input('Please provide a username: ')
-            if context.parsed_uri.scheme == 'ssh':
-                context.uri = 'ssh://{0}@{1}'.format(username, context.parsed_uri.hostname)
-                if context.parsed_uri.port is not None:
-                    context.uri = "{0}:{1}".format(context.uri, context.parsed_uri.port)
-                context.parsed_uri = urlparse(context.uri)
-        else:
-            username = context.parsed_uri.username
+    context.set_uri(args.uri)
+    if not context.docgen_run and not context.local_connection:
+        context.set_user(context.parsed_uri.username or six.moves.input('Please provide a username: '))
         if args.p is None:
             try:
                 args.p = getpass.getpass('Please provide a password: ')
             except KeyboardInterrupt:
                 six.print_()
                 return
-        else:
-            args.p = args.p
-    else:
-        context.local_connection = True
 
-    context.read_middleware_config_file(args.m)
-    context.variables.load(args.c)
+    if args.record:
+        context.recorder = Recorder(args.record)
+        atexit.register(context.recorder.close)
+
+    with context.startup.phase('read_middleware_config_file'):
+        context.read_middleware_config_file(args.m)
+
+    with context.startup.phase('VariableStore.load'):
+        context.variables.load(args.c)
+
     context.start(args.p)
 
-    ml = MainLoop(context)
-    context.ml = ml
+    with context.startup.phase('MainLoop'):
+        ml = MainLoop(context)
+        context.ml = ml
 
     if args.makedocs:
         builtin_cmds = context.ml.base_builtin_commands
@@ -1971,12 +3021,14 @@ def main(argv=None):
         docgen.write_docs()
         return
 
-    if username is not None:
-        context.login(username, args.p)
-        context.user = username
-    elif context.local_connection:
-        context.user = getpass.getuser()
-        context.login(context.user, '')
+    context.login_session(args.p)
+
+    if context.startup.enabled:
+        with context.startup.phase('wait_entity_subscribers'):
+            context.wait_entity_subscribers()
+
+        context.startup.finish()
+        output_startup_profile(context.startup, args.profile_startup, args.profile_startup_json)
 
     if args.D:
         for i in args.D:
@@ -2001,17 +3053,13 @@ def main(argv=None):
 
         return
 
-    try:
-        with open(os.path.expanduser('~/.cli_history'), 'rb') as history_file:
-            history_list = history_file.read().decode('utf8', 'ignore').splitlines()
-            history_list = history_list[-1000:]
-            for line in history_list:
-                try:
-                    readline.add_history(line)
-                except UnicodeEncodeError:
-                    pass
-    except FileNotFoundError:
-        pass
+    context.history = HistoryStore(os.path.expanduser('~/.cli_history'))
+    atexit.register(context.history.flush)
+    for entry in context.history.load()[-1000:]:
+        try:
+            readline.add_history(entry.command)
+        except UnicodeEncodeError:
+            pass
 
     cli_rc_paths = ['/usr/local/etc/clirc', os.path.expanduser('~/.clirc')]
     for path in cli_rc_paths:
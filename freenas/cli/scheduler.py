@@ -0,0 +1,243 @@
+#
+# Copyright 2016 iXsystems, Inc.
+# All rights reserved
+#
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted providing that the following conditions
+# are met:
+# 1. Redistributions of source code must retain the above copyright
+#    notice, this list of conditions and the following disclaimer.
+# 2. Redistributions in binary form must reproduce the above copyright
+#    notice, this list of conditions and the following disclaimer in the
+#    documentation and/or other materials provided with the distribution.
+#
+# THIS SOFTWARE IS PROVIDED BY THE AUTHOR ``AS IS'' AND ANY EXPRESS OR
+# IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE IMPLIED
+# WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE
+# ARE DISCLAIMED.  IN NO EVENT SHALL THE AUTHOR BE LIABLE FOR ANY
+# DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL
+# DAMAGES (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS
+# OR SERVICES; LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION)
+# HOWEVER CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT,
+# STRICT LIABILITY, OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING
+# IN ANY WAY OUT OF THE USE OF THIS SOFTWARE, EVEN IF ADVISED OF THE
+# POSSIBILITY OF SUCH DAMAGE.
+#
+#####################################################################
+
+
+import time
+import heapq
+import itertools
+import threading
+import collections
+import six
+
+
+class ScheduledJob(object):
+    """
+    A function run by the Scheduler every `interval` seconds, or once when
+    `repeat` is false.
+
+    In 'rate' mode runs are aligned to a fixed grid counted from the first
+    run, so they do not drift. In 'delay' mode the next run is scheduled
+    `interval` seconds after the previous one finished. When a 'rate' run
+    is due while the previous one is still running, it is either skipped
+    or queued to run right after it, according to `overlap`.
+    """
+    MODES = ('rate', 'delay')
+    OVERLAPS = ('skip', 'queue')
+
+    def __init__(self, id, fn, interval, repeat=True, mode='rate', overlap='skip', name=None):
+        if mode not in self.MODES:
+            raise ValueError('mode must be one of: {0}'.format(', '.join(self.MODES)))
+
+        if overlap not in self.OVERLAPS:
+            raise ValueError('overlap must be one of: {0}'.format(', '.join(self.OVERLAPS)))
+
+        if not callable(fn):
+            raise ValueError('{0} is not a function'.format(fn))
+
+        if repeat and interval <= 0:
+            raise ValueError('interval must be a positive number')
+
+        self.id = id
+        self.fn = fn
+        self.name = name or str(fn)
+        self.interval = interval
+        self.repeat = repeat
+        self.mode = mode
+        self.overlap = overlap
+        self.next_run = None
+        self.active = True
+        self.running = False
+        self.queued = 0
+        self.runs = 0
+        self.skipped = 0
+        self.errors = 0
+        self.last_error = None
+        self.last_duration = None
+
+    def __str__(self):
+        return "<Interval job #{0}>".format(self.id)
+
+
+class Scheduler(object):
+    """
+    Keeps scheduled jobs in a heap ordered by their next run time, with a
+    single timer on the event loop armed for the earliest one. Due jobs are
+    handed to a small pool of worker threads, so a slow job does not hold
+    up the others. `runner(job)` is called to run a job and
+    `on_error(job, err)` when a run raised.
+    """
+    WORKERS = 4
+
+    def __init__(self, loop, runner, on_error=None):
+        self.loop = loop
+        self.runner = runner
+        self.on_error = on_error
+        self.lock = threading.Lock()
+        self.heap = []
+        self.jobs = collections.OrderedDict()
+        self.job_id = 0
+        self.seq = itertools.count()
+        self.timer = None
+        self.queue = six.moves.queue.Queue()
+        self.workers = 0
+        self.idle = 0
+
+    def add(self, fn, interval, repeat=True, mode='rate', overlap='skip', name=None):
+        with self.lock:
+            self.job_id += 1
+            job = ScheduledJob(self.job_id, fn, interval, repeat, mode, overlap, name)
+            job.next_run = time.monotonic() + interval
+            self.jobs[job.id] = job
+            self.push(job)
+            return job
+
+    def remove(self, id):
+        with self.lock:
+            job = self.jobs.pop(id, None)
+            if not job:
+                return False
+
+            # The heap entry is dropped once the timer gets to it
+            job.active = False
+            job.queued = 0
+            return True
+
+    def clear(self):
+        for id in list(self.jobs):
+            self.remove(id)
+
+    def list(self):
+        with self.lock:
+            return list(self.jobs.values())
+
+    def push(self, job):
+        first = not self.heap or job.next_run < self.heap[0][0]
+        heapq.heappush(self.heap, (job.next_run, next(self.seq), job))
+        if first:
+            # Also deferred on the loop thread, as the caller holds the lock
+            self.loop.call_soon(self.arm)
+
+    def arm(self):
+        # Runs on the event loop, which uses time.monotonic() as its clock
+        with self.lock:
+            while self.heap and not self.heap[0][2].active:
+                heapq.heappop(self.heap)
+
+            if self.timer:
+                self.timer.cancel()
+                self.timer = None
+
+            if self.heap:
+                self.timer = self.loop.call_at(self.heap[0][0], self.poll)
+
+    def poll(self):
+        with self.lock:
+            self.timer = None
+            now = time.monotonic()
+            while self.heap and self.heap[0][0] <= now:
+                when, __, job = heapq.heappop(self.heap)
+                if job.active:
+                    self.fire(job, when, now)
+
+        self.arm()
+
+    def fire(self, job, when, now):
+        if job.repeat and job.mode == 'rate':
+            job.next_run = when + job.interval
+            if job.next_run <= now:
+                # Slots that passed while we were late are skipped, not run in a burst
+                missed = int((now - job.next_run) // job.interval) + 1
+                job.skipped += missed
+                job.next_run += missed * job.interval
+
+            self.push(job)
+
+        if job.running:
+            if job.overlap == 'queue':
+                job.queued += 1
+            else:
+                job.skipped += 1
+            return
+
+        job.running = True
+        self.dispatch(job)
+
+    def dispatch(self, job):
+        if not self.idle and self.workers < self.WORKERS:
+            self.workers += 1
+            t = threading.Thread(target=self.worker, name='scheduler worker')
+            t.daemon = True
+            t.start()
+
+        self.queue.put(job)
+
+    def worker(self):
+        while True:
+            with self.lock:
+                self.idle += 1
+
+            job = self.queue.get()
+            with self.lock:
+                self.idle -= 1
+
+            self.execute(job)
+
+    def execute(self, job):
+        while True:
+            started_at = time.monotonic()
+            error = None
+            try:
+                self.runner(job)
+            except BaseException as err:
+                error = err
+
+            with self.lock:
+                job.runs += 1
+                job.last_duration = time.monotonic() - started_at
+                if error:
+                    job.errors += 1
+                    previous, job.last_error = job.last_error, str(error) or type(error).__name__
+
+                if job.active and job.queued:
+                    job.queued -= 1
+                    rerun = True
+                else:
+                    rerun = False
+                    job.running = False
+                    if not job.repeat:
+                        job.active = False
+                        self.jobs.pop(job.id, None)
+                    elif job.active and job.mode == 'delay':
+                        job.next_run = time.monotonic() + job.interval
+                        self.push(job)
+
+            # Report a failure only when it differs from the last one, a failing job would flood the console otherwise
+            if error and self.on_error and job.last_error != previous:
+                self.on_error(job, error)
+
+            if not rerun:
+                return
@@ -32,6 +32,9 @@ import tempfile
 import ipaddress
 import gettext
 import signal
+import time
+import threading
+import collections
 import dateutil.tz
 from freenas.utils.query import get, set
 from datetime import timedelta, datetime
@@ -360,14 +363,56 @@ class PrintableNone(object):
         return value
 
 
+class SubmitPromise(object):
+    """
+    Id of a task whose task.submit call may still be in flight.
+    """
+    def __init__(self, name):
+        self.name = name
+        self.tid = None
+        self.error = None
+        self.done = threading.Event()
+
+    def __str__(self):
+        return str(self.wait())
+
+    def __int__(self):
+        return self.wait()
+
+    def resolve(self, tid):
+        self.tid = tid
+        self.done.set()
+
+    def fail(self, error):
+        self.error = error
+        self.done.set()
+
+    def wait(self):
+        while not self.done.wait(0.5):
+            pass
+
+        if self.error is not None:
+            raise self.error
+
+        return self.tid
+
+
 class TaskPromise(object):
     def __init__(self, context, tid, result=None):
         self.context = context
-        self.tid = tid
+        self.submission = tid if isinstance(tid, SubmitPromise) else None
+        self._tid = None if self.submission else tid
         self.result = result
         self.subscriber = self.context.entity_subscribers['task']
         self.task = None
 
+    @property
+    def tid(self):
+        if self._tid is None and self.submission:
+            self._tid = self.submission.wait()
+
+        return self._tid
+
     def __str__(self):
         task = self.subscriber.get(self.tid, timeout=5)
         if not task:
@@ -392,3 +437,284 @@ class EntityPromise(TaskPromise):
         self.result = super(EntityPromise, self).wait()
         self.ns.wait()
         return self.ns
+
+
+class JobPromise(object):
+    """
+    Result of a statement run in the background with '&'. Waiting on a job
+    whose statement returned a task or entity promise waits on that too.
+    """
+    def __init__(self, context, id, description):
+        self.context = context
+        self.id = id
+        self.description = description
+        self.state = 'RUNNING'
+        self.result = None
+        self.error = None
+        self.started_at = time.time()
+        self.finished_at = None
+        self.done = threading.Event()
+
+    def __str__(self):
+        return "<Job %{0}: {1}>".format(self.id, self.state)
+
+    @property
+    def runtime(self):
+        return (self.finished_at or time.time()) - self.started_at
+
+    def finish(self, result=None, error=None):
+        self.result = result
+        self.error = error
+        self.state = 'FAILED' if error is not None else 'FINISHED'
+        self.finished_at = time.time()
+        self.done.set()
+
+    def wait(self):
+        # Wait in short steps, so that Ctrl+C reaches the main thread
+        while not self.done.wait(0.5):
+            pass
+
+        if self.state != 'FINISHED':
+            raise RuntimeError('Job %{0} failed: {1}'.format(self.id, self.error))
+
+        if hasattr(self.result, 'wait'):
+            return self.result.wait()
+
+        return self.result
+
+
+class TaskGroup(object):
+    """
+    Collects the tasks submitted by the creating thread while it is open, or
+    added explicitly, and waits for all of them with a single listener on
+    the task subscriber. Open groups are only weakly referenced by the
+    context, so a group dropped without waiting on it stops collecting.
+    """
+    DONE_STATES = ('FINISHED', 'FAILED', 'ABORTED', 'CANCELLED')
+
+    def __init__(self, context, open=True):
+        self.context = context
+        self.members = collections.OrderedDict()
+        self.open = open
+        self.groups = context.task_groups
+        if open:
+            self.groups.add(self)
+
+    def __str__(self):
+        return "<Task group of {0} tasks>".format(len(self.members))
+
+    def __len__(self):
+        return len(self.members)
+
+    def close(self):
+        if self.open:
+            self.open = False
+            self.groups.discard(self)
+
+    def add(self, item):
+        if isinstance(item, TaskGroup):
+            for tid in item.members:
+                self.add(tid)
+            return
+
+        tid = item.tid if isinstance(item, (TaskPromise, SubmitPromise)) else int(item)
+        if tid not in self.members:
+            self.members[tid] = {
+                'id': tid,
+                'name': None,
+                'state': 'WAITING',
+                'error': None,
+                'added_at': time.time(),
+                'duration': None
+            }
+
+    @staticmethod
+    def duration(member, task, ended_at=None):
+        # Prefer the task's own timestamps, then the time its end was
+        # announced, then now for a task that ended before wait() started
+        start, end = task.get('created_at'), task.get('finished_at')
+        if isinstance(start, datetime) and isinstance(end, datetime):
+            return round(max((end - start).total_seconds(), 0), 3)
+
+        return round((ended_at or time.time()) - member['added_at'], 3)
+
+    def wait(self, timeout=None):
+        from freenas.cli.output import Table, ValueType
+
+        self.close()
+        self.context.flush_tasks()
+        subscriber = self.context.entity_subscribers['task']
+        changed = threading.Event()
+        deadline = time.time() + timeout if timeout else None
+        ended_at = {}
+
+        def on_update(old, new):
+            if new['id'] in self.members:
+                if new['state'] in self.DONE_STATES:
+                    ended_at.setdefault(new['id'], time.time())
+
+                changed.set()
+
+        subscriber.on_update.add(on_update)
+        try:
+            pending = list(self.members.values())
+            while pending:
+                changed.clear()
+                for member in pending:
+                    task = subscriber.items.get(member['id'])
+                    if not task:
+                        continue
+
+                    member['name'] = task['name']
+                    member['state'] = task['state']
+                    if task['state'] in self.DONE_STATES:
+                        member['duration'] = self.duration(member, task, ended_at.get(member['id']))
+                        member['error'] = get(task, 'error.message')
+
+                pending = [m for m in pending if m['duration'] is None]
+                if not pending or (deadline and time.time() > deadline):
+                    break
+
+                changed.wait(0.5)
+        finally:
+            subscriber.on_update.discard(on_update)
+
+        return Table(list(self.members.values()), [
+            Table.Column('Task ID', 'id', ValueType.NUMBER),
+            Table.Column('Task', 'name'),
+            Table.Column('State', 'state'),
+            Table.Column('Time (s)', 'duration', ValueType.NUMBER),
+            Table.Column('Error', 'error')
+        ])
+
+
+class TaskBatch(object):
+    """
+    Runs tasks with at most `concurrency` of them unfinished at a time and
+    collects the ones that failed. A single listener on the task subscriber
+    tracks all of them.
+    """
+    DONE_STATES = ('FINISHED', 'FAILED', 'ABORTED', 'CANCELLED')
+
+    def __init__(self, context, concurrency, on_change=None):
+        self.context = context
+        self.concurrency = max(1, int(concurrency or 1))
+        self.on_change = on_change
+        self.cv = threading.Condition()
+        self.running = {}
+        self.unfinished = 0
+        self.total = 0
+        self.finished = 0
+        self.failures = []
+        self.subscriber = context.entity_subscribers['task']
+        self.subscriber.on_update.add(self.on_update)
+
+    def __str__(self):
+        return "<Task batch of {0} tasks, {1} failed>".format(self.total, len(self.failures))
+
+    def acquire(self):
+        with self.cv:
+            while self.unfinished >= self.concurrency:
+                self.cv.wait(0.5)
+
+            self.unfinished += 1
+            self.total += 1
+
+    def submit(self, label, name, *args):
+        """
+        Submits a task pipelined over call_async, waiting for a free slot
+        first.
+        """
+        def done(result):
+            if isinstance(result, BaseException):
+                self.end(label, None, str(result))
+            else:
+                self.context.register_task(result)
+                self.track(label, result)
+
+        self.acquire()
+        try:
+            self.context.call_async('task.submit', done, name, args)
+        except BaseException as err:
+            self.end(label, None, str(err))
+            raise
+
+    def submit_call(self, label, fn):
+        """
+        Waits for a free slot and tracks the task whose id fn returns.
+        """
+        self.acquire()
+        try:
+            with self.context.nonblocking_tasks():
+                tid = fn()
+        except BaseException as err:
+            self.end(label, None, str(err))
+            if isinstance(err, KeyboardInterrupt):
+                raise
+            return
+
+        if tid is None:
+            self.end(label, None, None)
+            return
+
+        self.track(label, int(tid))
+
+    def fail(self, label, error):
+        with self.cv:
+            self.total += 1
+            self.finished += 1
+            self.failures.append({'name': label, 'id': None, 'error': error})
+
+        if self.on_change:
+            self.on_change(self)
+
+    def track(self, label, tid):
+        with self.cv:
+            self.running[tid] = label
+
+        # The task may have ended before its id got back to us
+        task = self.subscriber.items.get(tid)
+        if task:
+            self.on_update(None, task)
+
+    def on_update(self, old, new):
+        if new['state'] not in self.DONE_STATES:
+            return
+
+        with self.cv:
+            if new['id'] not in self.running:
+                return
+
+            label = self.running.pop(new['id'])
+
+        error = None
+        if new['state'] != 'FINISHED':
+            error = get(new, 'error.message') or new['state']
+
+        self.end(label, new['id'], error)
+
+    def end(self, label, tid, error):
+        with self.cv:
+            self.unfinished -= 1
+            self.finished += 1
+            if error:
+                self.failures.append({'name': label, 'id': tid, 'error': error})
+
+            self.cv.notify_all()
+
+        if self.on_change:
+            self.on_change(self)
+
+    def wait(self, timeout=None):
+        deadline = time.time() + timeout if timeout else None
+        with self.cv:
+            while self.unfinished > 0:
+                if deadline and time.time() > deadline:
+                    return False
+
+                self.cv.wait(0.5)
+
+        return True
+
+    def close(self):
+        self.subscriber.on_update.discard(self.on_update)
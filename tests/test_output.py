@@ -0,0 +1,79 @@
+#
+# Copyright 2016 iXsystems, Inc.
+# All rights reserved
+#
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted providing that the following conditions
+# are met:
+# 1. Redistributions of source code must retain the above copyright
+#    notice, this list of conditions and the following disclaimer.
+# 2. Redistributions in binary form must reproduce the above copyright
+#    notice, this list of conditions and the following disclaimer in the
+#    documentation and/or other materials provided with the distribution.
+#
+# THIS SOFTWARE IS PROVIDED BY THE AUTHOR ``AS IS'' AND ANY EXPRESS OR
+# IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE IMPLIED
+# WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE
+# ARE DISCLAIMED.  IN NO EVENT SHALL THE AUTHOR BE LIABLE FOR ANY
+# DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL
+# DAMAGES (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS
+# OR SERVICES; LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION)
+# HOWEVER CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT,
+# STRICT LIABILITY, OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING
+# IN ANY WAY OUT OF THE USE OF THIS SOFTWARE, EVEN IF ADVISED OF THE
+# POSSIBILITY OF SUCH DAMAGE.
+#
+#####################################################################
+
+import io
+import sys
+import time
+import threading
+import pytest
+from six.moves.urllib.parse import urlparse
+
+pytest.importorskip('freenas.dispatcher.client')
+pytest.importorskip('freenas.utils')
+
+from freenas.cli import repl
+from freenas.cli.output import ProgressBar
+
+
+@pytest.fixture
+def context():
+    context = repl.Context()
+    context.uri = 'fake:?users=10&task_delay=0.5'
+    context.parsed_uri = urlparse(context.uri)
+    context.read_middleware_config_file(None)
+    context.start()
+    context.ml = repl.MainLoop(context)
+    context.login('root', '')
+    context.wait_entity_subscribers()
+    return context
+
+
+def test_output_queued_during_multi_progress_bar(context):
+    users = list(context.entity_subscribers['user'].items)[:3]
+    tids = [context.submit_task('user.update', i, {'shell': '/bin/sh'}) for i in users]
+    active = []
+
+    def emit():
+        time.sleep(0.2)
+        active.append(ProgressBar.active)
+        context.output_queue.put('event during wait')
+
+    out = io.StringIO()
+    stdout, sys.stdout = sys.stdout, out
+    try:
+        t = threading.Thread(target=emit)
+        t.start()
+        context.wait_for_tasks_with_progress(tids)
+        t.join()
+        time.sleep(0.5)
+    finally:
+        sys.stdout = stdout
+
+    text = out.getvalue()
+    assert active == [1]
+    assert ProgressBar.active == 0
+    assert text.index('event during wait') > text.rindex('Tasks:')
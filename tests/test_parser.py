@@ -0,0 +1,78 @@
+#
+# Copyright 2016 iXsystems, Inc.
+# All rights reserved
+#
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted providing that the following conditions
+# are met:
+# 1. Redistributions of source code must retain the above copyright
+#    notice, this list of conditions and the following disclaimer.
+# 2. Redistributions in binary form must reproduce the above copyright
+#    notice, this list of conditions and the following disclaimer in the
+#    documentation and/or other materials provided with the distribution.
+#
+# THIS SOFTWARE IS PROVIDED BY THE AUTHOR ``AS IS'' AND ANY EXPRESS OR
+# IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE IMPLIED
+# WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE
+# ARE DISCLAIMED.  IN NO EVENT SHALL THE AUTHOR BE LIABLE FOR ANY
+# DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL
+# DAMAGES (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS
+# OR SERVICES; LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION)
+# HOWEVER CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT,
+# STRICT LIABILITY, OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING
+# IN ANY WAY OUT OF THE USE OF THIS SOFTWARE, EVEN IF ADVISED OF THE
+# POSSIBILITY OF SUCH DAMAGE.
+#
+#####################################################################
+
+import pytest
+from freenas.cli.parser import parse, unparse, ParallelForInStatement
+
+
+def roundtrip(line):
+    return '; '.join(unparse(i, oneliner=True) for i in parse(line, '<test>'))
+
+
+@pytest.mark.parametrize('line', [
+    'volume create parallel',
+    'share smb create foo name=parallel',
+    'echo parallel',
+    'parallel = 3',
+    'function parallel(x) { return x }',
+    'parallel(3)',
+    'echo parallel format',
+])
+def test_parallel_is_not_reserved(line):
+    assert parse(line, '<test>')
+
+
+@pytest.mark.parametrize('line', [
+    'parallel for (i in range(3)) { echo ${i} }',
+    'parallel for (i in range(3); max=2) { echo ${i} }',
+    'parallel for (k, v in {"a": 1}) { echo ${k} }',
+])
+def test_parallel_for(line):
+    stmt, = parse(line, '<test>')
+    assert isinstance(stmt, ParallelForInStatement)
+    assert roundtrip(roundtrip(line)) == roundtrip(line)
+
+
+def test_only_parallel_prefixes_for():
+    with pytest.raises(SyntaxError):
+        parse('serial for (i in range(3)) { echo ${i} }', '<test>')
+
+
+@pytest.mark.parametrize('line', ['fg %2', 'wait %1'])
+def test_job_reference(line):
+    stmt, = parse(line, '<test>')
+    assert stmt.args[1].name == line.split()[1]
+
+
+@pytest.mark.parametrize('line', ['echo 100%', 'echo a%b', 'set quota=10%'])
+def test_percent_sign_is_not_split_off(line):
+    with pytest.raises(SyntaxError):
+        parse(line, '<test>')
+
+
+def test_modulo():
+    assert roundtrip('x = 5 %2') == 'x = 5 % 2'
@@ -0,0 +1,147 @@
+#
+# Copyright 2016 iXsystems, Inc.
+# All rights reserved
+#
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted providing that the following conditions
+# are met:
+# 1. Redistributions of source code must retain the above copyright
+#    notice, this list of conditions and the following disclaimer.
+# 2. Redistributions in binary form must reproduce the above copyright
+#    notice, this list of conditions and the following disclaimer in the
+#    documentation and/or other materials provided with the distribution.
+#
+# THIS SOFTWARE IS PROVIDED BY THE AUTHOR ``AS IS'' AND ANY EXPRESS OR
+# IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE IMPLIED
+# WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE
+# ARE DISCLAIMED.  IN NO EVENT SHALL THE AUTHOR BE LIABLE FOR ANY
+# DIRECT, INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL
+# DAMAGES (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS
+# OR SERVICES; LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION)
+# HOWEVER CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT,
+# STRICT LIABILITY, OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING
+# IN ANY WAY OUT OF THE USE OF THIS SOFTWARE, EVEN IF ADVISED OF THE
+# POSSIBILITY OF SUCH DAMAGE.
+#
+#####################################################################
+
+import time
+import threading
+import pytest
+from freenas.cli.eventloop import EventLoop
+from freenas.cli.scheduler import Scheduler
+
+
+@pytest.fixture
+def loop():
+    loop = EventLoop()
+    yield loop
+    loop.stop()
+
+
+@pytest.fixture
+def errors():
+    return []
+
+
+@pytest.fixture
+def scheduler(loop, errors):
+    return Scheduler(loop, lambda job: job.fn(), lambda job, err: errors.append(err))
+
+
+def wait_for(predicate, timeout=2):
+    deadline = time.time() + timeout
+    while not predicate():
+        if time.time() > deadline:
+            return False
+
+        time.sleep(0.01)
+
+    return True
+
+
+def test_rate(scheduler):
+    runs = []
+    job = scheduler.add(lambda: runs.append(time.monotonic()), 0.05)
+    assert wait_for(lambda: len(runs) >= 5)
+    scheduler.remove(job.id)
+
+    # Runs stay on the grid counted from the first one instead of drifting
+    for i, started_at in enumerate(runs[:5]):
+        assert started_at - runs[0] == pytest.approx(i * 0.05, abs=0.04)
+
+
+def test_skip(scheduler):
+    release = threading.Event()
+    job = scheduler.add(lambda: release.wait(2), 0.05, overlap='skip')
+    assert wait_for(lambda: job.skipped >= 3)
+    release.set()
+    scheduler.remove(job.id)
+    assert wait_for(lambda: not job.running)
+    assert job.runs == 1
+
+
+def test_queue(scheduler):
+    release = threading.Event()
+    job = scheduler.add(lambda: release.wait(2), 0.05, overlap='queue')
+    assert wait_for(lambda: job.queued >= 2)
+    scheduler.remove(job.id)
+    release.set()
+    assert wait_for(lambda: not job.running)
+    assert job.runs == 1
+
+
+def test_delay(scheduler):
+    runs = []
+
+    def fn():
+        runs.append(time.monotonic())
+        time.sleep(0.05)
+
+    job = scheduler.add(fn, 0.05, mode='delay')
+    assert wait_for(lambda: len(runs) >= 3)
+    scheduler.remove(job.id)
+
+    # Each run starts an interval after the previous one finished
+    for previous, started_at in zip(runs, runs[1:3]):
+        assert started_at - previous >= 0.1 - 0.01
+
+    assert job.skipped == 0
+
+
+def test_once(scheduler):
+    runs = []
+    job = scheduler.add(lambda: runs.append(1), 0.05, repeat=False)
+    assert wait_for(lambda: job.id not in [i.id for i in scheduler.list()])
+    time.sleep(0.15)
+    assert runs == [1]
+
+
+def test_clearinterval(scheduler):
+    runs = []
+    job = scheduler.add(lambda: runs.append(1), 0.03)
+    assert wait_for(lambda: runs)
+    assert scheduler.remove(job.id)
+    assert not scheduler.remove(job.id)
+    assert scheduler.list() == []
+
+    count = len(runs)
+    time.sleep(0.15)
+    assert len(runs) == count
+
+
+def test_errors_reported_once(scheduler, errors):
+    def fn():
+        raise ValueError('broken')
+
+    job = scheduler.add(fn, 0.03)
+    assert wait_for(lambda: job.errors >= 3)
+    scheduler.remove(job.id)
+    assert job.last_error == 'broken'
+    assert len(errors) == 1
+
+
+def test_add_on_loop_thread(loop, scheduler):
+    runs = []
+    loop.call_soon(lambda: scheduler.add(lambda: runs.append(1), 0.05, repeat=False))
+    assert wait_for(lambda: runs)